@@ -0,0 +1,109 @@
+""" Distribute large infrasetup artifacts to run farm hosts through the run
+farm itself, instead of from the manager to every host. """
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shlex
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join as pjoin
+
+from typing import Deque, Dict, List, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from runtools.ssh_pool import SSHConnectionPool
+
+rootLogger = logging.getLogger()
+
+# smaller files aren't worth the extra hops
+BROADCAST_MIN_BYTES = 16 * 1024 * 1024
+
+class ArtifactBroadcast:
+    """ Send local files to the incoming dirs of many hosts' artifact stores (see
+    InstanceDeployManager.copy_sim_infrastructure).
+
+    The manager uploads a file to at most fanout hosts at a time. Every host
+    that has the file then forwards it to the next host still waiting for
+    it, host to host with the manager's forwarded ssh agent. The number of
+    hosts holding a file roughly doubles every round, so distributing it
+    takes O(log(hosts)) transfer times rather than O(hosts) uploads from the
+    manager.
+
+    Copies keep the local file's mtime, so infrasetup finds them up to date
+    and doesn't send them again. A host that a transfer failed for is just
+    left to infrasetup. """
+    ssh_pool: SSHConnectionPool
+    fanout: int
+    # hosts that received each file
+    received: Dict[str, List[str]]
+
+    def __init__(self, ssh_pool: SSHConnectionPool, fanout: int) -> None:
+        assert fanout > 0
+        self.ssh_pool = ssh_pool
+        self.fanout = fanout
+        self.received = {}
+
+    def upload(self, local_path: str, host: str, dest_dir: str) -> bool:
+        """ Copy local_path from the manager into dest_dir on host. """
+        if self.ssh_pool.run(host, f"mkdir -p {dest_dir}", warn_only=True).failed:
+            return False
+        return self.ssh_pool.rsync(host, local_path, dest_dir + "/", extra_opts="-L -S", warn_only=True).succeeded
+
+    def forward(self, source_host: str, source_path: str, host: str, dest_dir: str) -> bool:
+        """ Copy source_path on source_host into dest_dir on host. """
+        if self.ssh_pool.run(host, f"mkdir -p {dest_dir}", warn_only=True).failed:
+            return False
+        rsh = "ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o BatchMode=yes"
+        command = f"rsync -pthrLS --rsh {shlex.quote(rsh)} {source_path} {host}:{dest_dir}/"
+        return self.ssh_pool.run(source_host, command, warn_only=True, forward_agent=True).succeeded
+
+    async def broadcast(self, local_path: str, dest_dirs: Dict[str, str], upload_slots: asyncio.Semaphore) -> None:
+        """ Send local_path into dest_dirs[host] on each host. """
+        pending: Deque[str] = deque(dest_dirs.keys())
+        name = os.path.basename(local_path.rstrip('/'))
+        received: List[str] = []
+        self.received[local_path] = received
+        senders: List[asyncio.Task] = []
+        loop = asyncio.get_running_loop()
+
+        async def send_from(source_host: Optional[str]) -> None:
+            while pending:
+                if source_host is None:
+                    async with upload_slots:
+                        # a host may have received it meanwhile
+                        if not pending:
+                            return
+                        host = pending.popleft()
+                        ok = await loop.run_in_executor(None, self.upload, local_path, host, dest_dirs[host])
+                else:
+                    host = pending.popleft()
+                    source_path = pjoin(dest_dirs[source_host], name)
+                    ok = await loop.run_in_executor(None, self.forward, source_host, source_path, host, dest_dirs[host])
+                if not ok:
+                    rootLogger.warning(f"[{host}] Could not receive {name} from {source_host or 'the manager'}, it will be copied from the manager.")
+                    continue
+                rootLogger.debug(f"[{host}] Received {name} from {source_host or 'the manager'}.")
+                received.append(host)
+                # the new holder forwards it too
+                senders.append(asyncio.ensure_future(send_from(host)))
+
+        senders.extend(asyncio.ensure_future(send_from(None)) for _ in range(self.fanout))
+        # senders grows while waiting
+        while not all(sender.done() for sender in senders):
+            await asyncio.gather(*senders)
+
+    def run(self, artifacts: Dict[str, Dict[str, str]]) -> None:
+        """ Broadcast all artifacts (local path -> {host: dest dir}) at once.
+        Returns when all transfers are done. """
+        hosts = {host for dest_dirs in artifacts.values() for host in dest_dirs}
+        async def broadcast_all() -> None:
+            # every host may be receiving a file at once, more than the
+            # default executor has threads for
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=min(max(len(hosts), 1), self.ssh_pool.max_concurrency)))
+            upload_slots = asyncio.Semaphore(self.fanout)
+            await asyncio.gather(*[self.broadcast(local_path, dest_dirs, upload_slots)
+                                   for local_path, dest_dirs in artifacts.items()])
+        asyncio.run(broadcast_all())
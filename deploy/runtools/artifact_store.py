@@ -0,0 +1,123 @@
+""" A content-addressed store of simulation artifacts on each run farm host,
+so that infrasetup only transfers what a host doesn't already have. """
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import stat
+
+from typing import Dict, List, Optional, Set, Tuple
+
+rootLogger = logging.getLogger()
+
+# manager-side cache of artifact digests, see ArtifactDigestCache
+ARTIFACT_DIGESTS_PATH = "artifact-digests.json"
+# how many artifacts a host keeps beyond the ones the current infrasetup uses
+ARTIFACT_STORE_MAX_ENTRIES = 32
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+EXTRACTED_SUFFIX = ".extracted"
+
+class ArtifactDigestCache:
+    """ sha256 digests of local files and dirs, as stored in the artifact
+    store. Hashing a multi-GB rootfs on every infrasetup would take longer
+    than the transfer it saves, so file digests are kept in a local json
+    file and reused while the file's size, mtime and inode are unchanged.
+
+    The topology hashes every artifact before infrasetup forks a task per
+    host, so the tasks only ever hit the in-memory cache. """
+    cache_path: str
+    # realpath -> (size, mtime_ns, inode, digest)
+    entries: Optional[Dict[str, Tuple[int, int, int, str]]]
+    dirty: bool
+
+    def __init__(self, cache_path: str) -> None:
+        self.cache_path = cache_path
+        self.entries = None
+        self.dirty = False
+
+    def load(self) -> Dict[str, Tuple[int, int, int, str]]:
+        if self.entries is None:
+            self.entries = {}
+            try:
+                with open(self.cache_path) as f:
+                    self.entries = {path: tuple(entry) for path, entry in json.load(f).items()} # type: ignore
+            except FileNotFoundError:
+                pass
+            except (ValueError, TypeError, AttributeError) as e:
+                rootLogger.debug(f"Ignoring unreadable artifact digest cache {self.cache_path}: {e}")
+        return self.entries
+
+    def file_digest(self, path: str) -> str:
+        entries = self.load()
+        realpath = os.path.realpath(path)
+        st = os.stat(realpath)
+        cached = entries.get(realpath)
+        if cached is not None and cached[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+            return cached[3]
+        m = hashlib.sha256()
+        with open(realpath, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                m.update(chunk)
+        entries[realpath] = (st.st_size, st.st_mtime_ns, st.st_ino, m.hexdigest())
+        self.dirty = True
+        return m.hexdigest()
+
+    def digest(self, path: str) -> str:
+        """ Digest of the file or dir at path, following symlinks like the
+        rsync -L that uploads it. A dir's digest covers the names, contents
+        and executable bits of everything under it. """
+        if not os.path.isdir(path):
+            return self.file_digest(path)
+        m = hashlib.sha256(b"dir\0")
+        for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filepath = os.path.join(dirpath, filename)
+                executable = os.stat(filepath).st_mode & stat.S_IXUSR
+                m.update(f"{os.path.relpath(filepath, path)}\0{executable:o}\0{self.file_digest(filepath)}\0".encode())
+        return m.hexdigest()
+
+    def save(self) -> None:
+        """ Write new digests back to the cache file, atomically, so that
+        concurrent managers sharing a checkout never see a partial file. """
+        if not self.dirty or self.entries is None:
+            return
+        # drop files that are gone
+        entries = {path: entry for path, entry in self.entries.items() if os.path.exists(path)}
+        tmppath = f"{self.cache_path}.tmp-{os.getpid()}"
+        with open(tmppath, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmppath, self.cache_path)
+        self.dirty = False
+
+def manifest_command(store_dir: str) -> str:
+    """ A single command that lists the artifacts in store_dir, which
+    parse_manifest turns into a manifest. """
+    return f"mkdir -p {store_dir} && ls -1 {store_dir}"
+
+def parse_manifest(output: str) -> Set[str]:
+    """ Return the complete entries of a store listing: the digests of
+    stored artifacts, and digest + EXTRACTED_SUFFIX for tarballs that were
+    extracted in the store. Entries are published with an atomic rename, so
+    anything else is an interrupted upload. """
+    manifest = set()
+    for name in output.split():
+        digest = name[:-len(EXTRACTED_SUFFIX)] if name.endswith(EXTRACTED_SUFFIX) else name
+        if DIGEST_RE.match(digest):
+            manifest.add(name)
+    return manifest
+
+def evict_command(store_dir: str, keep: List[str]) -> str:
+    """ A command that removes the least recently used artifacts of
+    store_dir beyond ARTIFACT_STORE_MAX_ENTRIES, except those in keep, and
+    any interrupted uploads that aren't in keep. Entries are touched when a
+    slot dir is linked to them. """
+    keep_pattern = "|".join(keep) if keep else "^$"
+    return (f"cd {store_dir} && ls -1t | grep -vE '{EXTRACTED_SUFFIX}$|^\\.' | grep -vE '{keep_pattern}' "
+            f"| tail -n +{ARTIFACT_STORE_MAX_ENTRIES + 1} | while read d; do rm -rf $d $d{EXTRACTED_SUFFIX}; done; "
+            f"ls -1 .incoming 2>/dev/null | grep -vE '{keep_pattern}' | while read d; do rm -rf .incoming/$d; done; true")
@@ -4,57 +4,143 @@ topology.
 
 from __future__ import annotations
 
+from collections import deque
+
 from runtools.user_topology import UserTopologies
-from runtools.firesim_topology_elements import FireSimSwitchNode, FireSimServerNode
+from runtools.firesim_topology_elements import FireSimNode, FireSimSwitchNode, FireSimServerNode
+
+from typing import Any, Deque, Dict, List, Tuple, Callable, Optional, Union
+
+class FireSimTopologyIndex:
+    """ Traversal orders and adjacency for a topology, computed once in
+    O(V+E) from a set of roots.
+
+    An index is only valid for the graph it was built from. FireSimTopology
+    rebuilds it whenever the roots change or a link is added anywhere (see
+    FireSimNode.topology_generation). """
+    roots: Tuple[FireSimNode, ...]
+    generation: int
+    dfs_order: List[FireSimNode]
+    bfs_order: List[FireSimNode]
+    switches: List[FireSimSwitchNode]
+    servers: List[FireSimServerNode]
+    children: Dict[FireSimNode, List[FireSimNode]]
+    parents: Dict[FireSimNode, List[FireSimNode]]
+
+    def __init__(self, roots: Tuple[FireSimNode, ...]) -> None:
+        self.roots = roots
+        self.generation = FireSimNode.topology_generation
+
+        self.children = {}
+        self.parents = {}
+        self.bfs_order = []
+        queue: Deque[FireSimNode] = deque()
+        for root in roots:
+            if root not in self.children:
+                self.children[root] = []
+                queue.append(root)
+        while queue:
+            node = queue.popleft()
+            self.bfs_order.append(node)
+            nodechildren = [link.get_downlink_side() for link in node.downlinks]
+            self.children[node] = nodechildren
+            self.parents[node] = [link.get_uplink_side() for link in node.uplinks]
+            for child in nodechildren:
+                if child not in self.children:
+                    # placeholder marks the node as enqueued
+                    self.children[child] = []
+                    queue.append(child)
+
+        # post-order: a node is emitted after all of its children, and each
+        # node is emitted only the first time it is reached
+        self.dfs_order = []
+        visited = set()
+        for root in roots:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(self.children[root]))]
+            while stack:
+                node, childiter = stack[-1]
+                for child in childiter:
+                    if child not in visited:
+                        visited.add(child)
+                        stack.append((child, iter(self.children[child])))
+                        break
+                else:
+                    stack.pop()
+                    self.dfs_order.append(node)
+
+        self.switches = [x for x in self.dfs_order if isinstance(x, FireSimSwitchNode)]
+        self.servers = [x for x in self.dfs_order if isinstance(x, FireSimServerNode)]
+
+    def is_current(self, roots: Tuple[FireSimNode, ...]) -> bool:
+        """ Return True if this index still describes the graph reachable
+        from roots. """
+        return self.generation == FireSimNode.topology_generation and self.roots == roots
 
-from typing import List, Callable, Optional, Union, TYPE_CHECKING
-if TYPE_CHECKING:
-    from runtools.firesim_topology_elements import FireSimNode
 
 class FireSimTopology(UserTopologies):
     """ A FireSim Topology consists of a list of root FireSimNodes, which
     connect to other FireSimNodes.
 
     This is designed to model tree-like topologies."""
+    index: Optional[FireSimTopologyIndex]
 
-    def __init__(self, user_topology_name: str, no_net_num_nodes: int) -> None:
+    def __init__(self, user_topology_name: str, no_net_num_nodes: int, topology_params: Optional[Dict[str, Any]] = None) -> None:
         # This just constructs the user topology. an upper level pass manager
-        # will apply passes to it.
+        # will apply passes to it. topology_params are passed as keyword
+        # arguments to parametric topologies.
 
         # a topology can specify a custom target -> host mapping. if left as None,
         # the default mapper is used, which handles no network and simple networked cases.
         super().__init__(no_net_num_nodes)
+        self.index = None
 
         config_func = getattr(self, user_topology_name)
-        config_func()
+        config_func(**(topology_params or {}))
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """ Custom mappers are often closures, which can't be pickled. Once
+        a topology is worth pickling it has already been mapped, so they
+        are dropped, along with the index, which is cheap to rebuild. """
+        state = self.__dict__.copy()
+        if callable(state['custom_mapper']):
+            state['custom_mapper'] = None
+        state['index'] = None
+        return state
+
+    def get_index(self) -> FireSimTopologyIndex:
+        """ Return the traversal index for the current graph, rebuilding it
+        if the topology changed since it was last computed. """
+        roots = tuple(self.roots)
+        if self.index is None or not self.index.is_current(roots):
+            self.index = FireSimTopologyIndex(roots)
+        return self.index
 
     def get_dfs_order(self) -> List[FireSimNode]:
         """ Return all nodes in the topology in dfs order, as a list. """
-        stack = list(self.roots)
-        retlist: List[FireSimNode] = []
-        visitedonce = set()
-        while stack:
-            nextup = stack[0]
-            if nextup in visitedonce:
-                if nextup not in retlist:
-                    retlist.append(stack.pop(0))
-                else:
-                    stack.pop(0)
-            else:
-                visitedonce.add(nextup)
-                stack = list(map(lambda x: x.get_downlink_side(), nextup.downlinks)) + stack
-        return retlist
+        return list(self.get_index().dfs_order)
 
     def get_dfs_order_switches(self) -> List[FireSimSwitchNode]:
         """ Utility function that returns only switches, in dfs order. """
-        return [x for x in self.get_dfs_order() if isinstance(x, FireSimSwitchNode)]
+        return list(self.get_index().switches)
 
     def get_dfs_order_servers(self) -> List[FireSimServerNode]:
         """ Utility function that returns only servers, in dfs order. """
-        return [x for x in self.get_dfs_order() if isinstance(x, FireSimServerNode)]
+        return list(self.get_index().servers)
+
+    def get_bfs_order(self) -> List[FireSimNode]:
+        """ Return all nodes in the topology in bfs order, as a list. Nodes
+        reachable from several parents appear only once, at their shallowest
+        position. """
+        return list(self.get_index().bfs_order)
+
+    def get_children(self, node: FireSimNode) -> List[FireSimNode]:
+        """ Return the downlink-side neighbors of node, in port order. """
+        return list(self.get_index().children[node])
 
-    def get_bfs_order(self) -> None:
-        """ return the nodes in the topology in bfs order """
-        # don't forget to eliminate dups
-        assert False, "TODO"
+    def get_parents(self, node: FireSimNode) -> List[FireSimNode]:
+        """ Return the uplink-side neighbors of node, in port order. """
+        return list(self.get_index().parents[node])
 
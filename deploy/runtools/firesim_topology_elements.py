@@ -4,26 +4,32 @@ from __future__ import annotations
 
 import logging
 import abc
+import shlex
+import subprocess
 import sys
-from fabric.contrib.project import rsync_project # type: ignore
-from fabric.api import run, local, warn_only, get, put, cd, hide # type: ignore
-from fabric.exceptions import CommandTimeout # type: ignore
+from fabric.api import local, get # type: ignore
 
 from runtools.switch_model_config import AbstractSwitchToSwitchConfig
-from runtools.utils import get_local_shared_libraries
+from runtools.utils import get_local_shared_libraries, SwitchingTable
 from runtools.simulation_data_classes import TracerVConfig, AutoCounterConfig, HostDebugConfig, SynthPrintConfig
 
-from runtools.run_farm_deploy_managers import InstanceDeployManager
-from typing import Optional, List, Tuple, Sequence, Union, Any, TYPE_CHECKING
+from runtools.run_farm_deploy_managers import InstanceDeployManager, EC2InstanceDeployManager
+from typing import Optional, List, Tuple, Sequence, Union, Any, TYPE_CHECKING, cast
 if TYPE_CHECKING:
     from runtools.workload import JobConfig
     from runtools.run_farm import Inst
     from runtools.runtime_config import RuntimeHWConfig
     from runtools.utils import MacAddress
-    from runtools.run_farm_deploy_managers import EC2InstanceDeployManager
+    from runtools.ssh_pool import SSHConnectionPool
 
 rootLogger = logging.getLogger()
 
+# transports that can implement a link between two switches, see
+# target-design/switch/socketport.h. shmem and unix only work between
+# switches on the same host
+LINK_TRANSPORTS = ['shmem', 'unix', 'tcp', 'tcp_tuned']
+CROSS_HOST_LINK_TRANSPORTS = ['tcp', 'tcp_tuned']
+
 class FireSimLink:
     """ This represents a link that connects different FireSimNodes.
 
@@ -41,24 +47,30 @@ class FireSimLink:
         Sim X has an uplink connected to RootSwitch.
         RootSwitch has a downlink to Sim X.
 
+    The transport (one of LINK_TRANSPORTS) can be set per link when building
+    the topology. Links left at None get a default from the runtime config in
+    pass_assign_link_transports. Links to simulations always use shmem.
     """
+    # links and nodes use __slots__: large topologies have tens of thousands
+    # of them, and the whole graph is pickled into every @parallel task
+    __slots__ = ('id', 'uplink_side', 'downlink_side', 'port', 'transport')
+
     # links have a globally unique identifier, currently used for naming
     # shmem regions for Shmem Links
     next_unique_link_identifier: int = 0
     id: int
-    id_as_str: str
     uplink_side: Optional[FireSimNode]
     downlink_side: Optional[FireSimNode]
     port: Optional[int]
+    transport: Optional[str]
 
-    def __init__(self, uplink_side: FireSimNode, downlink_side: FireSimNode) -> None:
+    def __init__(self, uplink_side: FireSimNode, downlink_side: FireSimNode, transport: Optional[str] = None) -> None:
         self.id = FireSimLink.next_unique_link_identifier
         FireSimLink.next_unique_link_identifier += 1
-        # format as 100 char hex string padded with zeroes
-        self.id_as_str = format(self.id, '0100X')
         self.uplink_side = None
         self.downlink_side = None
         self.port = None
+        self.transport = transport
         self.set_uplink_side(uplink_side)
         self.set_downlink_side(downlink_side)
 
@@ -76,11 +88,24 @@ class FireSimLink:
         assert self.downlink_side is not None
         return self.downlink_side
 
+    def get_transport(self) -> str:
+        """ Return the transport of this link. Until pass_assign_link_transports
+        sets one, links use tcp if they cross hosts and shmem otherwise. """
+        if self.transport is None:
+            return 'tcp' if self.link_crosses_hosts() else 'shmem'
+        return self.transport
+
+    def link_uses_sockets(self) -> bool:
+        """ Return True if this link is implemented with socket ports, which
+        need a host port. """
+        return self.get_transport() != 'shmem'
+
     def link_hostserver_port(self) -> int:
         """ Get the port used for this Link. This should only be called for
-        links implemented with SocketPorts. """
+        links implemented with SocketPorts. For unix links, this numbers the
+        socket file instead of being a TCP port. """
         if self.port is None:
-            self.port = self.get_uplink_side().get_host_instance().allocate_host_port()
+            self.port = self.get_uplink_side().get_host_instance().allocate_host_port(self.get_transport())
         return self.port
 
     def link_hostserver_host(self) -> str:
@@ -88,17 +113,23 @@ class FireSimLink:
         links implemented with SocketPorts. """
         return self.get_uplink_side().get_host_instance().get_host()
 
+    def link_hostserver_socket_path(self) -> str:
+        """ Get the path of the socket file used for this Link. This should
+        only be called for unix links. """
+        return "{}/link-{}.sock".format(self.get_uplink_side().get_host_instance().get_sim_dir(), self.link_hostserver_port())
+
     def link_crosses_hosts(self) -> bool:
         """ Return True if the user has mapped the two endpoints of this link to
-        separate hosts. This implies a SocketServerPort / SocketClientPort will be used
-        to implement the Link. If False, use a sharedmem port to implement the link. """
+        separate hosts. This implies one of the CROSS_HOST_LINK_TRANSPORTS will
+        be used to implement the Link. """
         if isinstance(self.get_downlink_side(), FireSimDummyServerNode):
             return False
         return self.get_uplink_side().get_host_instance() != self.get_downlink_side().get_host_instance()
 
     def get_global_link_id(self) -> str:
         """ Return the globally unique link id, used for naming shmem ports. """
-        return self.id_as_str
+        # format as 100 char hex string padded with zeroes
+        return format(self.id, '0100X')
 
 
 class FireSimNode(metaclass=abc.ABCMeta):
@@ -118,30 +149,37 @@ class FireSimNode(metaclass=abc.ABCMeta):
         3) Assigning workloads to run to simulators
 
     """
+    __slots__ = ('downlinks', 'downlinkmacranges', 'uplinks', 'host_instance')
+
+    # bumped whenever a link is added anywhere in the graph, so that cached
+    # traversals (see FireSimTopologyIndex) know when they are stale
+    topology_generation: int = 0
     downlinks: List[FireSimLink]
-    downlinkmacs: List[MacAddress]
+    downlinkmacranges: List[Tuple[int, int]]
     uplinks: List[FireSimLink]
     host_instance: Optional[Inst]
 
     def __init__(self) -> None:
         self.downlinks = []
-        self.downlinkmacs = []
+        self.downlinkmacranges = []
         self.uplinks = []
         self.host_instance = None
 
-    def add_downlink(self, firesimnode: FireSimNode) -> None:
+    def add_downlink(self, firesimnode: FireSimNode, transport: Optional[str] = None) -> None:
         """ A "downlink" is a link that will take you further from the root
         of the tree. Users define a tree topology by specifying "downlinks".
-        Uplinks are automatically inferred. """
-        linkobj = FireSimLink(self, firesimnode)
+        Uplinks are automatically inferred. transport optionally picks the
+        link's transport, see FireSimLink. """
+        linkobj = FireSimLink(self, firesimnode, transport)
         firesimnode.add_uplink(linkobj)
         self.downlinks.append(linkobj)
+        FireSimNode.topology_generation += 1
 
-    def add_downlinks(self, firesimnodes: Sequence[FireSimNode]) -> None:
+    def add_downlinks(self, firesimnodes: Sequence[FireSimNode], transport: Optional[str] = None) -> None:
         """ Just a convenience function to add multiple downlinks at once.
         Assumes downlinks in the supplied list are ordered. """
         for node in firesimnodes:
-            self.add_downlink(node)
+            self.add_downlink(node, transport)
 
     def add_uplink(self, firesimlink: FireSimLink) -> None:
         """ This is only for internal use - uplinks are automatically populated
@@ -172,6 +210,11 @@ class FireSimNode(metaclass=abc.ABCMeta):
 
 class FireSimServerNode(FireSimNode):
     """ This is a simulated server instance in FireSim. """
+    __slots__ = ('server_hardware_config', 'server_link_latency', 'server_bw_max',
+                 'server_profile_interval', 'tracerv_config', 'autocounter_config',
+                 'hostdebug_config', 'synthprint_config', 'job', 'server_id_internal',
+                 'mac_address', 'plusarg_passthrough')
+
     SERVERS_CREATED: int = 0
     server_hardware_config: Optional[Union[RuntimeHWConfig, str]]
     server_link_latency: Optional[int]
@@ -228,17 +271,19 @@ class FireSimServerNode(FireSimNode):
         assert self.mac_address is not None
         return self.mac_address
 
-    def process_qcow2_rootfses(self, rootfses_list: List[Optional[str]]) -> List[Optional[str]]:
+    def process_qcow2_rootfses(self, rootfses_list: List[Optional[str]]) -> Tuple[List[Optional[str]], Optional[str]]:
         """ Take in list of all rootfses on this node. For the qcow2 ones, find
-        the allocated devices, attach the device to the qcow2 image on the
-        remote node, and replace it in the list with that nbd device. Return
-        the new list.
+        the allocated devices and replace them in the list with those nbd
+        devices. Return the new list, and a single command that attaches all
+        of the devices to their qcow2 images on the remote node (or None if
+        there are no qcow2 rootfses).
 
-        Assumes it will be called from a sim_slot_* directory."""
+        The command assumes it will be run from a sim_slot_* directory."""
 
         assert self.has_assigned_host_instance(), "qcow2 attach cannot be done without a host instance."
 
         result_list = []
+        attach_commands = []
         for rootfsname in rootfses_list:
             if rootfsname is not None and rootfsname.endswith(".qcow2"):
                 host_inst = self.get_host_instance()
@@ -248,10 +293,14 @@ class FireSimServerNode(FireSimNode):
                 allocd_device = nbd_tracker.get_nbd_for_imagename(rootfsname)
 
                 # connect the /dev/nbdX device to the rootfs
-                run("""sudo qemu-nbd -c {devname} {rootfs}""".format(devname=allocd_device, rootfs=rootfsname))
+                attach_commands.append("""qemu-nbd -c {devname} {rootfs}""".format(devname=allocd_device, rootfs=rootfsname))
                 rootfsname = allocd_device
             result_list.append(rootfsname)
-        return result_list
+
+        if not attach_commands:
+            return result_list, None
+        # one sudo for every sibling's rootfs
+        return result_list, "sudo sh -c {}".format(shlex.quote(" && ".join(attach_commands)))
 
     def allocate_nbds(self) -> None:
         """ called by the allocate nbds pass to assign an nbd to a qcow2 image. """
@@ -272,16 +321,15 @@ class FireSimServerNode(FireSimNode):
                                                    str(self.server_hardware_config))
         return msg
 
+    def get_slot_nodes(self) -> List[FireSimServerNode]:
+        """ Return the nodes simulated in this node's sim slot, in order. """
+        return [self]
+
     def get_sim_start_command(self, slotno: int, sudo: bool, extra_plusargs: Optional[str]) -> str:
-        """ get the command to run a simulation. assumes it will be
-        called in a directory where its required_files are already located.
+        """ get the commands to run a simulation: attach any qcow2 rootfses,
+        write the driver's plusargs file and boot the driver. assumes it will
+        be called in a directory where its required_files are already located.
         """
-        shmemportname = "default"
-        if self.uplinks:
-            shmemportname = self.uplinks[0].get_global_link_id()
-
-        assert self.server_link_latency is not None
-        assert self.server_bw_max is not None
         assert self.server_profile_interval is not None
         assert self.tracerv_config is not None
         assert self.autocounter_config is not None
@@ -289,35 +337,42 @@ class FireSimServerNode(FireSimNode):
         assert self.synthprint_config is not None
         assert self.plusarg_passthrough is not None
 
-        all_macs = [self.get_mac_address()]
-        all_rootfses = self.process_qcow2_rootfses([self.get_rootfs_name()])
-        all_linklatencies = [self.server_link_latency]
-        all_maxbws = [self.server_bw_max]
-        all_bootbins = [self.get_bootbin_name()]
-        all_shmemportnames = [shmemportname]
+        nodes = self.get_slot_nodes()
+        all_macs = [x.get_mac_address() for x in nodes]
+        all_rootfses, attach_command = self.process_qcow2_rootfses([x.get_rootfs_name() for x in nodes])
+        all_linklatencies = [x.server_link_latency for x in nodes]
+        all_maxbws = [x.server_bw_max for x in nodes]
+        assert None not in all_linklatencies and None not in all_maxbws
+        all_bootbins = [x.get_bootbin_name() for x in nodes]
+        if self.uplinks:
+            all_shmemportnames = [x.uplinks[0].get_global_link_id() for x in nodes]
+        else:
+            all_shmemportnames = ["default"] * len(nodes)
 
         plusargs = self.plusarg_passthrough
         if extra_plusargs is not None:
             plusargs = plusargs + " " + extra_plusargs
 
-        runcommand = self.get_resolved_server_hardware_config().get_boot_simulation_command(
-            slotno,
+        resolved_cfg = self.get_resolved_server_hardware_config()
+        sim_plusargs = resolved_cfg.get_sim_plusargs(
             all_macs,
             all_rootfses,
-            all_linklatencies,
-            all_maxbws,
+            cast(List[int], all_linklatencies),
+            cast(List[int], all_maxbws),
             self.server_profile_interval,
             all_bootbins,
             all_shmemportnames,
             self.tracerv_config,
             self.autocounter_config,
             self.hostdebug_config,
-            self.synthprint_config,
-            sudo,
-            plusargs,
-            "")
+            self.synthprint_config)
 
-        return runcommand
+        # a failed attach must not boot the simulation
+        commands = ["set -e"]
+        if attach_command is not None:
+            commands.append(attach_command)
+        commands.append(resolved_cfg.get_boot_simulation_command(slotno, sim_plusargs, all_bootbins, sudo, plusargs, ""))
+        return "\n".join(commands)
 
     def get_local_job_results_dir_path(self) -> str:
         """ Return local job results directory path. e.g.:
@@ -375,12 +430,16 @@ class FireSimServerNode(FireSimNode):
         sim_start_script_local_path = self.write_script("sim-run.sh", start_cmd)
         return sim_start_script_local_path
 
-    def copy_back_job_results_from_run(self, slotno: int, sudo: bool) -> None:
+    def copy_back_job_results_from_run(self, slotno: int, sudo: bool, ssh_pool: SSHConnectionPool) -> None:
         """
         1) Copy back UART log
         2) Mount rootfs on the remote node and copy back files
+
+        This only reaches the host through ssh_pool, not fabric, so copies of
+        several slots can run at once on different threads.
         """
         assert self.has_assigned_host_instance(), "copy requires assigned host instance"
+        host = self.get_host_instance().get_host()
 
         # rsync_project defaults to using -a and that will copy symlinks as links
         # and preserve group ownership and permissions.
@@ -393,8 +452,6 @@ class FireSimServerNode(FireSimNode):
         jobinfo = self.get_job()
         job_dir = self.get_local_job_results_dir_path()
 
-        self.write_job_complete_file()
-
         dest_sim_dir = self.get_host_instance().get_sim_dir()
         dest_sim_slot_dir = f"{dest_sim_dir}/sim_slot_{slotno}/"
 
@@ -403,24 +460,24 @@ class FireSimServerNode(FireSimNode):
 
         def mount(img: str, mnt: str, tmp_dir: str) -> None:
             if sudo:
-                run(f"sudo mount -o loop {img} {mnt}")
-                run(f"sudo chown -R $(whoami) {mnt}")
+                ssh_pool.run(host, f"sudo mount -o loop {img} {mnt}")
+                ssh_pool.run(host, f"sudo chown -R $(whoami) {mnt}")
             else:
-                run(f"""screen -S guestmount-wait-{pos_hash(mnt)} -dm bash -c "guestmount -o uid=$(id -u) -o gid=$(id -g) --pid-file {tmp_dir}/guestmount.pid -a {img} -m /dev/sda {mnt}; while true; do sleep 1; done;" """, pty=False)
+                ssh_pool.run(host, f"""screen -S guestmount-wait-{pos_hash(mnt)} -dm bash -c "guestmount -o uid=$(id -u) -o gid=$(id -g) --pid-file {tmp_dir}/guestmount.pid -a {img} -m /dev/sda {mnt}; while true; do sleep 1; done;" """)
                 try:
-                    run(f"""while [ ! "$(ls -A {mnt})" ]; do echo "Waiting for mount to finish"; sleep 1; done""", timeout=60*10)
-                except CommandTimeout:
+                    ssh_pool.run(host, f"""while [ ! "$(ls -A {mnt})" ]; do echo "Waiting for mount to finish"; sleep 1; done""", timeout=60*10)
+                except subprocess.TimeoutExpired:
                     umount(mnt, tmp_dir)
 
         def umount(mnt: str, tmp_dir: str) -> None:
             if sudo:
-                run(f"sudo umount {mnt}")
+                ssh_pool.run(host, f"sudo umount {mnt}")
             else:
-                pid = run(f"cat {tmp_dir}/guestmount.pid")
-                run(f"screen -XS guestmount-wait-{pos_hash(mnt)} quit")
-                run(f"guestunmount {mnt}")
-                run(f"tail --pid={pid} -f /dev/null")
-                run(f"rm -f {tmp_dir}/guestmount.pid")
+                pid = ssh_pool.run(host, f"cat {tmp_dir}/guestmount.pid")
+                ssh_pool.run(host, f"screen -XS guestmount-wait-{pos_hash(mnt)} quit")
+                ssh_pool.run(host, f"guestunmount {mnt}")
+                ssh_pool.run(host, f"tail --pid={pid} -f /dev/null")
+                ssh_pool.run(host, f"rm -f {tmp_dir}/guestmount.pid")
 
         # mount rootfs, copy files from it back to local system
         rfsname = self.get_rootfs_name()
@@ -428,7 +485,7 @@ class FireSimServerNode(FireSimNode):
             is_qcow2 = rfsname.endswith(".qcow2")
             mountpoint = dest_sim_slot_dir + "mountpoint"
 
-            run("""{} mkdir -p {}""".format("sudo" if sudo else "", mountpoint))
+            ssh_pool.run(host, """{} mkdir -p {}""".format("sudo" if sudo else "", mountpoint))
 
             if is_qcow2:
                 host_inst = self.get_host_instance()
@@ -440,43 +497,26 @@ class FireSimServerNode(FireSimNode):
                 rfsname = dest_sim_slot_dir + rfsname
 
             mount(rfsname, mountpoint, dest_sim_slot_dir)
-            with warn_only(), hide('warnings'):
-                # ignore if this errors. not all rootfses have /etc/sysconfig/nfs
-                run("""{} chattr -i {}/etc/sysconfig/nfs""".format("sudo" if sudo else "", mountpoint))
+            # ignore if this errors. not all rootfses have /etc/sysconfig/nfs
+            ssh_pool.run(host, """{} chattr -i {}/etc/sysconfig/nfs""".format("sudo" if sudo else "", mountpoint), warn_only=True)
 
             ## copy back files from inside the rootfs
-            with warn_only():
-                for outputfile in jobinfo.outputs:
-                    rsync_cap = rsync_project(remote_dir=mountpoint + outputfile,
-                            local_dir=job_dir,
-                            ssh_opts="-o StrictHostKeyChecking=no",
-                            extra_opts=copy_back_extra_opts,
-                            upload=False,
-                            capture=True)
-                    rootLogger.debug(rsync_cap)
-                    rootLogger.debug(rsync_cap.stderr)
+            for outputfile in jobinfo.outputs:
+                ssh_pool.rsync_from(host, mountpoint + outputfile, job_dir, extra_opts=copy_back_extra_opts, warn_only=True)
 
             ## unmount
             umount(mountpoint, dest_sim_slot_dir)
 
             ## if qcow2, detach .qcow2 image from the device, we're done with it
             if is_qcow2:
-                run("""sudo qemu-nbd -d {devname}""".format(devname=rfsname))
+                ssh_pool.run(host, """sudo qemu-nbd -d {devname}""".format(devname=rfsname))
 
 
         ## copy output files generated by the simulator that live on the host:
         ## e.g. uartlog, memory_stats.csv, etc
         remote_sim_run_dir = dest_sim_slot_dir
         for simoutputfile in jobinfo.simoutputs:
-            with warn_only():
-                rsync_cap = rsync_project(remote_dir=remote_sim_run_dir + simoutputfile,
-                        local_dir=job_dir,
-                        ssh_opts="-o StrictHostKeyChecking=no",
-                        extra_opts=copy_back_extra_opts,
-                        upload=False,
-                        capture=True)
-                rootLogger.debug(rsync_cap)
-                rootLogger.debug(rsync_cap.stderr)
+            ssh_pool.rsync_from(host, remote_sim_run_dir + simoutputfile, job_dir, extra_opts=copy_back_extra_opts, warn_only=True)
 
     def get_sim_kill_command(self, slotno: int) -> str:
         """ return the command to kill the simulation. assumes it will be
@@ -558,6 +598,20 @@ class FireSimServerNode(FireSimNode):
         assert self.job is not None
         return self.job.jobname
 
+    def uses_rootfs_overlay(self) -> bool:
+        """ Return True iff this node's rootfs is a qcow2 overlay backed by
+        the raw image of its job, which is then only stored once per host
+        (see InstanceDeployManager.copy_sim_infrastructure). Overlays are
+        attached like any qcow2 rootfs, with NBD, so they are only used if
+        the workload asks for them and the host supports NBD. """
+        rootfs_path = self.get_job().rootfs_path()
+        if rootfs_path is None or rootfs_path.endswith(".qcow2") or not self.get_job().parent_workload.rootfs_overlays:
+            return False
+        if not self.has_assigned_host_instance():
+            return False
+        idm = self.get_host_instance().instance_deploy_manager
+        return idm is not None and idm.nbd_tracker is not None
+
     def get_rootfs_name(self) -> Optional[str]:
         rootfs_path = self.get_job().rootfs_path()
         if rootfs_path is None:
@@ -565,11 +619,14 @@ class FireSimServerNode(FireSimNode):
         else:
             # prefix rootfs name with the job name to disambiguate in supernode
             # cases
-            return self.get_job_name() + "-" + rootfs_path.split("/")[-1]
+            rootfs_name = self.get_job_name() + "-" + rootfs_path.split("/")[-1]
+            if self.uses_rootfs_overlay():
+                rootfs_name += ".qcow2"
+            return rootfs_name
 
     def get_all_rootfs_names(self) -> List[Optional[str]]:
         """ Get all rootfs filenames as a list. """
-        return [self.get_rootfs_name()]
+        return [x.get_rootfs_name() for x in self.get_slot_nodes()]
 
     def qcow2_support_required(self) -> bool:
         """ Return True iff any rootfses for this sim require QCOW2 support, as
@@ -587,113 +644,64 @@ class FireSimSuperNodeServerNode(FireSimServerNode):
     out to dummy server nodes to get all the info to run the single sim binary
     that models the N > 1 copies of a design present in a single simulator
     (e.g. a single FPGA or single metasim) in supernode mode."""
+    __slots__ = ()
 
     def __init__(self) -> None:
         super().__init__()
 
-    def copy_back_job_results_from_run(self, slotno: int, sudo: bool) -> None:
+    def uses_rootfs_overlay(self) -> bool:
+        """ Siblings have no host of their own (see
+        copy_back_job_results_from_run), so supernodes use rootfs copies. """
+        return False
+
+    def copy_back_job_results_from_run(self, slotno: int, sudo: bool, ssh_pool: SSHConnectionPool) -> None:
         """ This override is to call copy back job results for all the dummy nodes too. """
         # first call the original
-        super().copy_back_job_results_from_run(slotno, sudo)
+        super().copy_back_job_results_from_run(slotno, sudo, ssh_pool)
 
         # call on all siblings
-        num_siblings = self.supernode_get_num_siblings_plus_one()
-
         # TODO: for now, just hackishly give the siblings a host node.
         # fixing this properly is going to probably require a larger revamp
         # of supernode handling
         super_server_host = self.get_host_instance()
-        for sibindex in range(1, num_siblings):
-            sib = self.supernode_get_sibling(sibindex)
+        for sib in self.supernode_get_siblings():
             sib.assign_host_instance(super_server_host)
-            sib.copy_back_job_results_from_run(slotno, sudo)
+            sib.copy_back_job_results_from_run(slotno, sudo, ssh_pool)
+
+    def supernode_get_siblings(self) -> List[FireSimDummyServerNode]:
+        """ Return the dummy server nodes simulated alongside this one, in
+        order. These are the FireSimDummyServerNodes that directly follow
+        this node on its switch. """
+        downlinks = self.uplinks[0].get_uplink_side().downlinks
+        for index, link in enumerate(downlinks):
+            if link.get_downlink_side() is self:
+                break
+        else:
+            assert False, "Supernode is not a downlink of its own switch"
+        siblings = []
+        for link in downlinks[index+1:]:
+            node = link.get_downlink_side()
+            if not isinstance(node, FireSimDummyServerNode):
+                break
+            siblings.append(node)
+        return siblings
 
     def supernode_get_num_siblings_plus_one(self) -> int:
         """ This returns the number of siblings the supernodeservernode has,
         plus one (because in most places, we use siblings + 1, not just siblings)
         """
-        siblings = 1
-        count = False
-        for index, servernode in enumerate(map(lambda x : x.get_downlink_side(), self.uplinks[0].get_uplink_side().downlinks)):
-            if count:
-                if isinstance(servernode, FireSimDummyServerNode):
-                    siblings += 1
-                else:
-                    return siblings
-            elif self == servernode:
-                count = True
-        return siblings
+        return len(self.supernode_get_siblings()) + 1
 
     def supernode_get_sibling(self, siblingindex: int) -> FireSimDummyServerNode:
         """ return the sibling for supernode mode.
         siblingindex = 1 -> next sibling, 2 = second, 3 = last one."""
-        for index, servernode in enumerate(map(lambda x : x.get_downlink_side(), self.uplinks[0].get_uplink_side().downlinks)):
-            if self == servernode:
-                node = self.uplinks[0].get_uplink_side().downlinks[index+siblingindex].get_downlink_side()
-                assert isinstance(node, FireSimDummyServerNode)
-                return node
-        assert False, "Should return supernode sibling"
-
-    def get_all_rootfs_names(self) -> List[Optional[str]]:
-        """ Get all rootfs filenames as a list. """
-        num_siblings = self.supernode_get_num_siblings_plus_one()
-        return [self.get_rootfs_name()] + [self.supernode_get_sibling(x).get_rootfs_name() for x in range(1, num_siblings)]
+        return self.supernode_get_siblings()[siblingindex - 1]
 
-    def get_sim_start_command(self, slotno: int, sudo: bool, extra_plusargs: Optional[str]) -> str:
-        """ get the command to run a simulation. assumes it will be
-        called in a directory where its required_files are already located."""
-
-        num_siblings = self.supernode_get_num_siblings_plus_one()
-
-        assert self.server_link_latency is not None
-        assert self.server_bw_max is not None
-        assert self.server_profile_interval is not None
-        assert self.tracerv_config is not None
-        assert self.autocounter_config is not None
-        assert self.hostdebug_config is not None
-        assert self.synthprint_config is not None
-        assert self.plusarg_passthrough is not None
-
-        all_macs = [self.get_mac_address()] + [self.supernode_get_sibling(x).get_mac_address() for x in range(1, num_siblings)]
-        all_rootfses = self.process_qcow2_rootfses(self.get_all_rootfs_names())
-        all_bootbins = [self.get_bootbin_name()] + [self.supernode_get_sibling(x).get_bootbin_name() for x in range(1, num_siblings)]
-        all_linklatencies = [self.server_link_latency]
-        for x in range(1, num_siblings):
-            sibling = self.supernode_get_sibling(x)
-            assert sibling.server_link_latency is not None
-            all_linklatencies.append(sibling.server_link_latency)
-        all_maxbws = [self.server_bw_max]
-        for x in range(1, num_siblings):
-            sibling = self.supernode_get_sibling(x)
-            assert sibling.server_bw_max is not None
-            all_maxbws.append(sibling.server_bw_max)
-
-        all_shmemportnames = ["default" for x in range(num_siblings)]
-        if self.uplinks:
-            all_shmemportnames = [self.uplinks[0].get_global_link_id()] + [self.supernode_get_sibling(x).uplinks[0].get_global_link_id() for x in range(1, num_siblings)]
-
-        plusargs = self.plusarg_passthrough
-        if extra_plusargs is not None:
-            plusargs = plusargs + " " + extra_plusargs
-
-        runcommand = self.get_resolved_server_hardware_config().get_boot_simulation_command(
-            slotno,
-            all_macs,
-            all_rootfses,
-            all_linklatencies,
-            all_maxbws,
-            self.server_profile_interval,
-            all_bootbins,
-            all_shmemportnames,
-            self.tracerv_config,
-            self.autocounter_config,
-            self.hostdebug_config,
-            self.synthprint_config,
-            sudo,
-            plusargs,
-            "")
-
-        return runcommand
+    def get_slot_nodes(self) -> List[FireSimServerNode]:
+        """ The supernode and all its siblings share a sim slot. """
+        nodes: List[FireSimServerNode] = [self]
+        nodes.extend(self.supernode_get_siblings())
+        return nodes
 
     def get_required_files_local_paths(self) -> List[Tuple[str, str]]:
         """ Return local paths of all stuff needed to run this simulation as
@@ -720,11 +728,7 @@ class FireSimSuperNodeServerNode(FireSimServerNode):
         all_paths += get_local_shared_libraries(driver_path)
         all_paths += self.get_resolved_server_hardware_config().get_additional_required_sim_files()
 
-        num_siblings = self.supernode_get_num_siblings_plus_one()
-
-        for x in range(1, num_siblings):
-            sibling = self.supernode_get_sibling(x)
-
+        for sibling in self.supernode_get_siblings():
             sibling_job_rootfs_path = self.get_job().rootfs_path()
             if sibling_job_rootfs_path is not None:
                 sibling_rootfs_name = sibling.get_rootfs_name()
@@ -745,6 +749,7 @@ class FireSimSuperNodeServerNode(FireSimServerNode):
 
 class FireSimDummyServerNode(FireSimServerNode):
     """ This is a dummy server node for supernode mode. """
+    __slots__ = ()
 
     def __init__(self, server_hardware_config: Optional[Union[RuntimeHWConfig, str]] = None, server_link_latency: Optional[int] = None,
             server_bw_max: Optional[int] = None):
@@ -755,17 +760,23 @@ class FireSimDummyServerNode(FireSimServerNode):
         when called"""
         pass
 
+    def uses_rootfs_overlay(self) -> bool:
+        """ See FireSimSuperNodeServerNode.uses_rootfs_overlay. """
+        return False
+
 
 class FireSimSwitchNode(FireSimNode):
     """ This is a simulated switch instance in FireSim.
 
     This is purposefully simple. Abstractly, switches don't do much/have
     much special configuration."""
+    __slots__ = ('switch_id_internal', 'switch_table', 'switch_link_latency',
+                 'switch_switching_latency', 'switch_bandwidth', 'switch_builder')
 
     # used to give switches a global ID
     SWITCHES_CREATED: int = 0
     switch_id_internal: int
-    switch_table: List[int]
+    switch_table: Union[SwitchingTable, Sequence[int]]
     switch_link_latency: Optional[int]
     switch_switching_latency: Optional[int]
     switch_bandwidth: Optional[int]
@@ -794,11 +805,7 @@ class FireSimSwitchNode(FireSimNode):
     def get_required_files_local_paths(self) -> List[Tuple[str, str]]:
         """ Return local paths of all stuff needed to run this simulation as
         array. """
-        all_paths = []
-        bin = self.switch_builder.switch_binary_local_path()
-        all_paths.append((bin, ''))
-        all_paths += get_local_shared_libraries(bin)
-        return all_paths
+        return self.switch_builder.get_required_files_local_paths()
 
     def get_switch_start_command(self, sudo: bool) -> str:
         return self.switch_builder.get_switch_simulation_command(sudo)
@@ -829,6 +836,9 @@ class FireSimSwitchNode(FireSimNode):
     def diagramstr(self) -> str:
         msg =  f"FireSimSwitchNode:{self.switch_id_internal}\n"
         msg += f"---------\n"
-        msg += f"""downlinks: {", ".join(map(str, self.downlinkmacs))}\n"""
-        msg += f"""switchingtable: {", ".join(map(str, self.switch_table))}"""
+        msg += f"""downlinks: {", ".join(f"[{lo}, {hi})" for lo, hi in self.downlinkmacranges)}\n"""
+        if isinstance(self.switch_table, SwitchingTable):
+            msg += f"""switchingtable: {self.switch_table}"""
+        else:
+            msg += f"""switchingtable: {", ".join(map(str, self.switch_table))}"""
         return msg
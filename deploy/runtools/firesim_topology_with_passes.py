@@ -8,32 +8,40 @@ import pprint
 import logging
 import datetime
 import sys
+import subprocess
+from collections import Counter
 from fabric.api import env, parallel, execute, run, local, warn_only # type: ignore
 from colorama import Fore, Style # type: ignore
-from functools import reduce
 from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from runtools.firesim_topology_elements import FireSimServerNode, FireSimDummyServerNode, FireSimSwitchNode
+from runtools.firesim_topology_elements import FireSimServerNode, FireSimDummyServerNode, FireSimSwitchNode, LINK_TRANSPORTS, CROSS_HOST_LINK_TRANSPORTS
 from runtools.firesim_topology_core import FireSimTopology
-from runtools.utils import MacAddress
+from runtools.utils import MacAddress, SwitchingTable, merge_mac_ranges, intersect_mac_ranges, subtract_mac_ranges
+from runtools.switch_model_config import RuntimeSwitchToSwitchConfig, report_switch_build_failure
 from runtools.simulation_data_classes import TracerVConfig, AutoCounterConfig, HostDebugConfig, SynthPrintConfig
 
-from runtools.run_farm_deploy_managers import InstanceDeployManager
-from typing import Dict, Any, cast, List, TYPE_CHECKING, Callable
+from runtools.run_farm_deploy_managers import InstanceDeployManager, CopyBackQueue
+from runtools.pass_manager import PassManager
+from runtools.ssh_pool import SSHConnectionPool, RemoteResult
+from runtools.host_capabilities import probe_command, parse_probe_output
+from runtools.host_event_watcher import HostEventWatcher
+from runtools.artifact_broadcast import ArtifactBroadcast, BROADCAST_MIN_BYTES
+from runtools.artifact_store import manifest_command, parse_manifest
+from typing import Dict, Any, cast, List, Optional, Sequence, Set, Tuple, TYPE_CHECKING, Callable
 if TYPE_CHECKING:
-    from runtools.run_farm import RunFarm
+    from runtools.run_farm import RunFarm, Inst
     from runtools.runtime_config import RuntimeHWDB, RuntimeBuildRecipes
     from runtools.workload import WorkloadConfig
 
 rootLogger = logging.getLogger()
 
-@parallel
-def instance_liveness() -> None:
-    """ Confirm that all instances are accessible (are running and can be
-    ssh'ed into) first so that we don't run any actual firesim-related commands
-    on only some of the run farm machines.
+# how often runworkload checks on the hosts when none of them reported a
+# simulation or switch exiting
+MONITOR_FALLBACK_POLL_S = 10
 
-    Also confirm that the default shell in use is one that is known to handle
+def check_default_shell(host: str, shell_path: str) -> None:
+    """ Confirm that the default shell in use is one that is known to handle
     commands we pass to run() in the manager. The default shell must be able to
     handle our command strings because it is always the first to interpret the
     command string, even if the command string starts with /bin/bash.
@@ -49,26 +57,21 @@ def instance_liveness() -> None:
         exit immediately.
     c) For unknown shells, print a warning and continue normally.
     """
-    rootLogger.info("""[{}] Checking if host instance is up...""".format(env.host_string))
-    run("uname -a")
-    collect = run("echo $SHELL")
-
     allowed_shells = ["bash"]
     disallowed_shells = ["csh"]
 
-    shell_info = collect.stdout.split("/")[-1]
+    shell_info = shell_path.split("/")[-1]
     if shell_info in allowed_shells:
         return
     if shell_info in disallowed_shells:
-        rootLogger.error(f"::ERROR:: Invalid default shell in use: {shell_info}. Allowed shells: {allowed_shells}.")
+        rootLogger.error(f"::ERROR:: [{host}] Invalid default shell in use: {shell_info}. Allowed shells: {allowed_shells}.")
         sys.exit(1)
-    rootLogger.warning(f"::WARNING:: Unknown default shell in use: {shell_info}. Allowed shells: {allowed_shells}. You are using a default shell that has not yet been tested to correctly interpret the commands run by the FireSim manager. Proceed at your own risk. If you find that your shell works correctly, please file an issue on the FireSim repo (https://github.com/firesim/firesim/issues) so that we can add your shell to the list of known good shells.")
+    rootLogger.warning(f"::WARNING:: [{host}] Unknown default shell in use: {shell_info}. Allowed shells: {allowed_shells}. You are using a default shell that has not yet been tested to correctly interpret the commands run by the FireSim manager. Proceed at your own risk. If you find that your shell works correctly, please file an issue on the FireSim repo (https://github.com/firesim/firesim/issues) so that we can add your shell to the list of known good shells.")
 
 class FireSimTopologyWithPasses:
     """ This class constructs a FireSimTopology, then performs a series of passes
     on the topology to map it all the way to something usable to deploy a simulation.
     """
-    passes_used: List[str]
     user_topology_name: str
     no_net_num_nodes: int
     run_farm: RunFarm
@@ -86,6 +89,18 @@ class FireSimTopologyWithPasses:
     defaulthostdebugconfig: HostDebugConfig
     defaultsynthprintconfig: SynthPrintConfig
     terminateoncompletion: bool
+    switch_config_mode: str
+    topology_diagram: str
+    # default transports of links between switches, see FireSimLink
+    cross_host_link_transport: str
+    same_host_link_transport: str
+    pass_manager: PassManager
+    # where URIs are downloaded to, see get_uri_dir()
+    uri_tempdir: Optional[TemporaryDirectory]
+    # connections to the run farm hosts, see get_ssh_pool()
+    ssh_pool: Optional[SSHConnectionPool]
+    # in auto mode, topologies larger than this get a collapsed diagram
+    topology_diagram_full_max_nodes: int = 128
 
     def __init__(self,
             user_topology_name: str,
@@ -105,15 +120,19 @@ class FireSimTopologyWithPasses:
             terminateoncompletion: bool,
             build_recipes: RuntimeBuildRecipes,
             default_metasim_mode: bool,
-            default_plusarg_passthrough: str) -> None:
-        self.passes_used = []
+            default_plusarg_passthrough: str,
+            switch_config_mode: str = 'compile_time',
+            topology_diagram: str = 'auto',
+            topology_params: Optional[Dict[str, Any]] = None,
+            cross_host_link_transport: str = 'tcp',
+            same_host_link_transport: str = 'shmem') -> None:
         self.user_topology_name = user_topology_name
         self.no_net_num_nodes = no_net_num_nodes
         self.run_farm = run_farm
         self.hwdb = hwdb
         self.build_recipes = build_recipes
         self.workload = workload
-        self.firesimtopol = FireSimTopology(user_topology_name, no_net_num_nodes)
+        self.firesimtopol = FireSimTopology(user_topology_name, no_net_num_nodes, topology_params)
         self.defaulthwconfig = defaulthwconfig
         self.defaultlinklatency = defaultlinklatency
         self.defaultswitchinglatency = defaultswitchinglatency
@@ -126,12 +145,122 @@ class FireSimTopologyWithPasses:
         self.defaultsynthprintconfig = defaultsynthprintconfig
         self.default_metasim_mode = default_metasim_mode
         self.default_plusarg_passthrough = default_plusarg_passthrough
+        self.switch_config_mode = switch_config_mode
+        self.topology_diagram = topology_diagram
+        self.cross_host_link_transport = cross_host_link_transport
+        self.same_host_link_transport = same_host_link_transport
+        self.uri_tempdir = None
+        self.ssh_pool = None
+        self.pass_manager = self.make_pass_manager()
 
         self.phase_one_passes()
 
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state['uri_tempdir'] = None
+        state['ssh_pool'] = None
+        return state
+
+    def make_pass_manager(self) -> PassManager:
+        """ Declare the artifacts each pass reads and writes. Artifacts that
+        no pass writes (dir, servers, switches) are inputs to the pass
+        manager, passed to the passes as keyword arguments. """
+        pass_manager = PassManager()
+        pass_manager.add_pass(self.pass_assign_mac_addresses, provides=['macs'])
+        pass_manager.add_pass(self.pass_compute_switching_tables, requires=['macs'], provides=['switching_tables'])
+        pass_manager.add_pass(self.pass_perform_host_node_mapping, provides=['host_mapping'])
+        pass_manager.add_pass(self.pass_apply_default_hwconfig, provides=['hwconfigs'])
+        pass_manager.add_pass(self.pass_apply_default_params, provides=['server_params'])
+        pass_manager.add_pass(self.pass_assign_jobs, provides=['jobs'])
+        pass_manager.add_pass(self.pass_allocate_nbd_devices, requires=['host_mapping', 'jobs'], provides=['nbds'])
+        pass_manager.add_pass(self.pass_assign_link_transports, requires=['host_mapping'], provides=['link_transports'])
+        pass_manager.add_pass(self.pass_create_topology_diagram, requires=['macs', 'host_mapping', 'hwconfigs'], provides=['topology_diagram'])
+
+        pass_manager.add_pass(self.pass_fetch_URI_resolve_runtime_cfg, requires=['hwconfigs', 'dir'], provides=['resolved_hwconfigs'])
+        pass_manager.add_pass(self.pass_build_required_drivers, requires=['resolved_hwconfigs', 'jobs', 'servers'], provides=['drivers'])
+        # switch builds don't use fabric, so they can overlap the URI
+        # downloads and driver builds
+        pass_manager.add_pass(self.pass_build_required_switches, requires=['switching_tables', 'host_mapping', 'link_transports', 'switches'], provides=['switch_binaries'], threadsafe=True)
+        return pass_manager
+
+    @property
+    def pass_timings(self) -> Dict[str, float]:
+        """ Seconds taken by the last run of each pass, by pass name. """
+        return self.pass_manager.timings
+
+    def get_uri_dir(self) -> str:
+        """ Return the directory URIs are downloaded to. It lasts as long as
+        the manager does, so that passes skipped because they already ran
+        don't leave their downloads behind in some other directory. """
+        if self.uri_tempdir is None:
+            self.uri_tempdir = TemporaryDirectory()
+        return self.uri_tempdir.name
+
+    def get_ssh_pool(self) -> SSHConnectionPool:
+        """ Return the pool of SSH connections to run farm hosts, which
+        stay open for the rest of the manager command. """
+        if self.ssh_pool is None:
+            self.ssh_pool = SSHConnectionPool()
+        return self.ssh_pool
+
+    def probe_hosts(self, hosts: Sequence[str]) -> Dict[str, RemoteResult]:
+        """ Probe the capabilities of hosts in one round trip each and keep
+        them on the hosts' Insts for the rest of the command, where forked
+        fabric tasks see them too. Return the raw results by host. """
+        def probe(host: str) -> RemoteResult:
+            inst = self.run_farm.lookup_by_host(host)
+            result = self.get_ssh_pool().run(host, probe_command(inst.sim_dir), warn_only=True)
+            if result.succeeded:
+                inst.capabilities = parse_probe_output(result)
+                rootLogger.debug(f"[{host}] {inst.capabilities}")
+            return result
+        return self.get_ssh_pool().call_on_hosts(hosts, probe)
+
+    def check_liveness(self, hosts: Sequence[str]) -> None:
+        """ Confirm that all hosts are accessible (are running and can be
+        ssh'ed into) first so that we don't run any actual firesim-related
+        commands on only some of the run farm machines. Also check their
+        default shells, see check_default_shell. This probes the hosts'
+        capabilities and opens the pooled connections later passes use. """
+        rootLogger.info(f"Checking if {len(hosts)} host instance(s) are up...")
+        results = self.probe_hosts(hosts)
+        unreachable = [host for host, result in results.items() if result.failed]
+        if unreachable:
+            for host in unreachable:
+                rootLogger.critical(f"[{host}] Host instance is not accessible: {results[host].stderr}")
+            sys.exit(1)
+        for host in hosts:
+            capabilities = self.run_farm.lookup_by_host(host).capabilities
+            assert capabilities is not None
+            check_default_shell(host, capabilities.shell)
+            if not capabilities.has_screen:
+                rootLogger.warning(f"::WARNING:: [{host}] screen is not installed, simulations and switches can't be started on this host.")
+
+    def wait_for_screens_to_exit(self, hosts: Sequence[str]) -> None:
+        """ poll on screens to make sure kill succeeded. """
+        rootLogger.info("Confirming exit...")
+        pending = list(hosts)
+        # keep checking screen until it reports that there are no screens left
+        while pending:
+            # wipe any potentially dead screens first
+            results = self.get_ssh_pool().run_on_hosts(pending, "screen -wipe > /dev/null 2>&1; screen -ls 2>&1", warn_only=True)
+            pending = []
+            for host, screenoutput in results.items():
+                if "No Sockets found" in screenoutput:
+                    continue
+                # If AutoILA is enabled, use the following condition ('hw_server'/'virtual_jtag' are still running)
+                elif "2 Sockets in" in screenoutput and "hw_server" in screenoutput and "virtual_jtag" in screenoutput:
+                    continue
+                # If AutoILA is disabled, continue as long as there is a fsim* or switch* screen.
+                elif "fsim" in screenoutput or "switch" in screenoutput:
+                    pending.append(host)
+                else:
+                    rootLogger.warning(f"[{host}] Unknown screen state. Breaking poll and printing screen state:\n{screenoutput}")
+            if pending:
+                time.sleep(1)
+
     def pass_assign_mac_addresses(self) -> None:
         """ DFS through the topology to assign mac addresses """
-        self.passes_used.append("pass_assign_mac_addresses")
 
         nodes_dfs_order = self.firesimtopol.get_dfs_order()
         MacAddress.reset_allocator()
@@ -140,79 +269,166 @@ class FireSimTopologyWithPasses:
                 node.assign_mac_address(MacAddress())
 
     def pass_compute_switching_tables(self) -> None:
-        """ This creates the MAC addr -> port lists for switch nodes.
+        """ This creates the MAC addr -> port tables for switch nodes.
 
-        a) First, a pass that computes "downlinkmacs" for each node, which
+        a) First, a pass that computes "downlinkmacranges" for each node, which
         represents all of the MAC addresses that are reachable on the downlinks
-        of this switch, to advertise to uplinks.
+        of this switch, to advertise to uplinks. Since MACs are assigned in
+        DFS order, these are kept as a short list of [lo, hi) ranges.
+
+        b) Next, a pass from the roots down that computes the MACs each node
+        can deliver to, either through its downlinks or by going further up.
 
-        b) Next, a pass that actually constructs the MAC addr -> port lists
-        for switch nodes.
+        c) Finally, a pass that actually constructs the MAC addr -> port tables
+        for switch nodes, as one range per downlink port in the common case.
 
         It is assumed that downlinks take ports [0, num downlinks) and
         uplinks take ports [num downlinks, num downlinks + num uplinks)
 
-        This will currently just assume that there is one uplink, since the
-        switch models do not handle load balancing across multiple paths.
+        MACs that are not reachable through a downlink but that every uplink
+        can deliver to are mapped to SwitchingTable.ANY_UPLINK, for which the
+        switch model picks an uplink by hashing the packet's flow, spreading
+        load across all equal-cost paths (as in clos_m_n_r or fat_tree_4ary).
+        MACs that only some uplinks can deliver to are sent to the first of
+        those.
         """
 
-        # this pass requires mac addresses to already be assigned
-        assert "pass_assign_mac_addresses" in self.passes_used
-        self.passes_used.append("pass_compute_switching_tables")
-
         nodes_dfs_order = self.firesimtopol.get_dfs_order()
         for node in nodes_dfs_order:
             if isinstance(node, FireSimServerNode):
-                node.downlinkmacs = [node.get_mac_address()]
+                mac = node.get_mac_address().as_int_no_prefix()
+                node.downlinkmacranges = [(mac, mac + 1)]
             else:
-                childdownlinkmacs: List[List[MacAddress]] = []
-                for x in node.downlinks:
-                    childdownlinkmacs.append(x.get_downlink_side().downlinkmacs)
+                node.downlinkmacranges = merge_mac_ranges(
+                    macrange for x in node.downlinks for macrange in x.get_downlink_side().downlinkmacranges)
 
-                # flatten
-                node.downlinkmacs = reduce(lambda x, y: x + y, childdownlinkmacs)
+        # parents come after all of their children in DFS order
+        deliverable: Dict[Any, List[Tuple[int, int]]] = dict()
+        for node in reversed(nodes_dfs_order):
+            ranges = list(node.downlinkmacranges)
+            for uplink in node.uplinks:
+                ranges.extend(deliverable.get(uplink.get_uplink_side(), []))
+            deliverable[node] = merge_mac_ranges(ranges)
 
         switches_dfs_order = self.firesimtopol.get_dfs_order_switches()
+        num_macs = MacAddress.next_mac_to_allocate()
 
         for switch in switches_dfs_order:
-            uplinkportno = len(switch.downlinks)
+            uplinkportbase = len(switch.downlinks)
+
+            # everything not claimed by a downlink goes to the uplinks
+            switchtab = SwitchingTable(num_macs, SwitchingTable.ANY_UPLINK)
+            uplinkranges = [deliverable.get(x.get_uplink_side(), []) for x in switch.uplinks]
+            if uplinkranges:
+                alluplinks = uplinkranges[0]
+                for ranges in uplinkranges[1:]:
+                    alluplinks = intersect_mac_ranges(alluplinks, ranges)
+                # add in reverse so that the first capable uplink wins
+                for uplinkno in reversed(range(len(uplinkranges))):
+                    for lo, hi in subtract_mac_ranges(uplinkranges[uplinkno], alluplinks):
+                        switchtab.add_range(lo, hi, uplinkportbase + uplinkno)
 
-            # prepopulate the table with the last port, which will be
-            switchtab = [uplinkportno for x in range(MacAddress.next_mac_to_allocate())]
             for port_no in range(len(switch.downlinks)):
-                portmacs = switch.downlinks[port_no].get_downlink_side().downlinkmacs
-                for mac in portmacs:
-                    switchtab[mac.as_int_no_prefix()] = port_no
+                for lo, hi in switch.downlinks[port_no].get_downlink_side().downlinkmacranges:
+                    switchtab.add_range(lo, hi, port_no)
 
             switch.switch_table = switchtab
 
     def pass_create_topology_diagram(self) -> None:
         """ Produce a PDF that shows a diagram of the network.
         Useful for debugging passes to see what has been done to particular
-        nodes. """
+        nodes.
+
+        Only the graphviz source is generated here. Laying out and rendering
+        the PDF can take far longer than the rest of a manager command for
+        large topologies, so it is handed off to a detached dot process that
+        the manager never waits on. """
+        if self.topology_diagram == 'none':
+            return
+
         from graphviz import Digraph # type: ignore
 
         gviz_graph = Digraph('gviz_graph', filename='generated-topology-diagrams/firesim_topology'
                              + self.user_topology_name + '.gv',
                              node_attr={'shape': 'record', 'height': '.1'})
 
-        # add all nodes to the graph
         nodes_dfs_order = self.firesimtopol.get_dfs_order()
-        for node in nodes_dfs_order:
-            nodehost = node.get_host_instance()
-            with gviz_graph.subgraph(name='cluster_' + str(nodehost), node_attr={'shape': 'box'}) as cluster:
-                cluster.node(str(node), node.diagramstr())
-                cluster.attr(label=str(nodehost))
+        mode = self.topology_diagram
+        if mode == 'auto':
+            mode = 'full' if len(nodes_dfs_order) <= self.topology_diagram_full_max_nodes else 'collapsed'
 
-
-        # add all edges to the graph
-        switches_dfs_order = self.firesimtopol.get_dfs_order_switches()
-        for node in switches_dfs_order:
-            for downlink in node.downlinks:
-                downlink_side = downlink.get_downlink_side()
-                gviz_graph.edge(str(node), str(downlink_side))
-
-        gviz_graph.render(view=False)
+        if mode == 'collapsed':
+            self.add_collapsed_topology_to_diagram(gviz_graph)
+        else:
+            # add all nodes to the graph
+            for node in nodes_dfs_order:
+                nodehost = node.get_host_instance()
+                with gviz_graph.subgraph(name='cluster_' + str(nodehost), node_attr={'shape': 'box'}) as cluster:
+                    cluster.node(str(node), node.diagramstr())
+                    cluster.attr(label=str(nodehost))
+
+            # add all edges to the graph
+            switches_dfs_order = self.firesimtopol.get_dfs_order_switches()
+            for node in switches_dfs_order:
+                for downlink in node.downlinks:
+                    downlink_side = downlink.get_downlink_side()
+                    gviz_graph.edge(str(node), str(downlink_side))
+
+        gviz_graph.save()
+        try:
+            subprocess.Popen(["dot", "-T" + gviz_graph.format, "-O", gviz_graph.filepath],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+        except OSError as e:
+            rootLogger.debug(f"Unable to render topology diagram {gviz_graph.filepath}: {e}")
+
+    def add_collapsed_topology_to_diagram(self, gviz_graph: Any) -> None:
+        """ Add a condensed version of the topology to gviz_graph: sibling
+        subtrees that are structurally identical are drawn once, with the
+        edge to them labeled with how many there are and the node labeled
+        with how many hosts they span. The size of the diagram depends on the
+        number of distinct subtree shapes, not on the number of nodes. """
+        index = self.firesimtopol.get_index()
+
+        # intern a structural signature for every node, children first
+        signature_ids: Dict[Any, int] = {}
+        node_signatures: Dict[Any, int] = {}
+        for node in index.dfs_order:
+            hwconfig = getattr(node, 'server_hardware_config', None)
+            key = (type(node).__name__,
+                   getattr(hwconfig, 'name', hwconfig),
+                   tuple(node_signatures[child] for child in index.children[node]))
+            node_signatures[node] = signature_ids.setdefault(key, len(signature_ids))
+
+        def group_by_signature(nodes: List[Any]) -> List[List[Any]]:
+            groups: Dict[int, List[Any]] = {}
+            for node in nodes:
+                groups.setdefault(node_signatures[node], []).append(node)
+            return list(groups.values())
+
+        drawn = set()
+
+        def draw_group(group: List[Any]) -> str:
+            representative = group[0]
+            if representative not in drawn:
+                drawn.add(representative)
+                label = representative.diagramstr()
+                if len(group) > 1:
+                    numhosts = len(set(x.get_host_instance() for x in group))
+                    label = f"{len(group)} x {type(representative).__name__} on {numhosts} host(s), first shown:\n" + label
+                nodehost = representative.get_host_instance()
+                with gviz_graph.subgraph(name='cluster_' + str(nodehost), node_attr={'shape': 'box'}) as cluster:
+                    cluster.node(str(representative), label)
+                    cluster.attr(label=str(nodehost))
+
+                for childgroup in group_by_signature(index.children[representative]):
+                    childname = draw_group(childgroup)
+                    gviz_graph.edge(str(representative), childname,
+                                    label=f"x{len(childgroup)}" if len(childgroup) > 1 else None)
+            return str(representative)
+
+        for rootgroup in group_by_signature(list(index.roots)):
+            draw_group(rootgroup)
 
     def pass_no_net_host_mapping(self) -> None:
         # only if we have no networks - pack simulations
@@ -275,6 +491,70 @@ class FireSimTopologyWithPasses:
             elif any([isinstance(x, FireSimServerNode) for x in downlinknodes]):
                 assert False, "MIXED DOWNLINKS NOT SUPPORTED."
 
+    def mapping_min_cut_partition(self) -> None:
+        """ Partition the topology across run farm hosts so that as few links
+        as possible cross between hosts, since those links become TCP sockets
+        instead of shared memory.
+
+        Each switch is kept on one host together with the simulations directly
+        attached to it. These units are packed onto hosts in DFS order, so
+        that units under the same parent switch share a host whenever the
+        slot counts allow it; a new host is sized to hold as many of the
+        remaining simulations as possible. Switches without simulations are
+        placed on the host that holds most of their downlinks. """
+        index = self.firesimtopol.get_index()
+        unit_sims = dict()
+        for switch in index.switches:
+            # FireSimDummyServerNodes are deployed with their supernode
+            unit_sims[switch] = [x for x in index.children[switch] if isinstance(x, FireSimServerNode) and not isinstance(x, FireSimDummyServerNode)]
+        remaining_sims = sum(len(x) for x in unit_sims.values())
+
+        current_inst: Optional[Inst] = None
+        free_slots = 0
+        for switch in index.switches:
+            sims = unit_sims[switch]
+            if not sims:
+                # children precede their parents in DFS order, so they
+                # have all been placed already
+                neighbor_hosts = Counter(x.get_host_instance() for x in index.children[switch] if not isinstance(x, FireSimDummyServerNode))
+                if neighbor_hosts:
+                    neighbor_hosts.most_common(1)[0][0].add_switch(switch)
+                else:
+                    switch_inst_handle = self.run_farm.get_switch_only_host_handle()
+                    self.run_farm.allocate_sim_host(switch_inst_handle).add_switch(switch)
+                continue
+
+            if current_inst is None or free_slots < len(sims):
+                available = [x for x in self.run_farm.get_available_sim_host_handles() if x[0] >= len(sims)]
+                if not available:
+                    # this call will error out with the reason
+                    self.run_farm.get_smallest_sim_host_handle(num_sims=len(sims))
+                large_enough = [x for x in available if x[0] >= remaining_sims]
+                _, inst_handle = large_enough[0] if large_enough else available[-1]
+                current_inst = self.run_farm.allocate_sim_host(inst_handle)
+                free_slots = current_inst.MAX_SIM_SLOTS_ALLOWED
+
+            current_inst.add_switch(switch)
+            for server in sims:
+                current_inst.add_simulation(server)
+            free_slots -= len(sims)
+            remaining_sims -= len(sims)
+
+    def count_cross_host_links(self) -> Tuple[int, int]:
+        """ Return (links between nodes on different hosts, all links) for the
+        current host mapping. """
+        cross_host_links = 0
+        all_links = 0
+        for switch in self.firesimtopol.get_dfs_order_switches():
+            for downlink in switch.downlinks:
+                downlink_side = downlink.get_downlink_side()
+                if isinstance(downlink_side, FireSimDummyServerNode):
+                    continue
+                all_links += 1
+                if downlink_side.get_host_instance() is not switch.get_host_instance():
+                    cross_host_links += 1
+        return cross_host_links, all_links
+
     def pass_perform_host_node_mapping(self) -> None:
         """ This pass assigns host nodes to nodes in the abstract FireSim
         configuration tree.
@@ -308,6 +588,10 @@ class FireSimTopologyWithPasses:
         else:
             assert False, "IMPROPER MAPPING CONFIGURATION"
 
+        cross_host_links, all_links = self.count_cross_host_links()
+        if all_links:
+            rootLogger.info(f"Host mapping: {cross_host_links} of {all_links} network links cross between run farm hosts and will use sockets instead of shared memory.")
+
     def pass_apply_default_hwconfig(self) -> None:
         """ This is the default mapping pass for hardware configurations - it
         does 3 things:
@@ -344,6 +628,8 @@ class FireSimTopologyWithPasses:
                     node.switch_switching_latency = self.defaultswitchinglatency
                 if node.switch_bandwidth is None:
                     node.switch_bandwidth = self.defaultnetbandwidth
+                if self.switch_config_mode == 'runtime':
+                    node.switch_builder = RuntimeSwitchToSwitchConfig(node)
 
             if isinstance(node, FireSimServerNode):
                 if node.server_link_latency is None:
@@ -363,6 +649,30 @@ class FireSimTopologyWithPasses:
                 if node.plusarg_passthrough is None:
                     node.plusarg_passthrough = self.default_plusarg_passthrough
 
+    def pass_assign_link_transports(self) -> None:
+        """ Give links that the topology left at the default transport the
+        configured one, and check that every link's transport works for the
+        way it was mapped. """
+        for switch in self.firesimtopol.get_dfs_order_switches():
+            for link in switch.downlinks:
+                if isinstance(link.get_downlink_side(), FireSimServerNode):
+                    # the simulation side only implements shmem ports
+                    if link.transport not in [None, 'shmem']:
+                        rootLogger.critical(f"Link from switch {switch.switch_id_internal} to a simulation uses transport {link.transport}, but links to simulations only support shmem.")
+                        sys.exit(1)
+                    link.transport = 'shmem'
+                    continue
+
+                crosses_hosts = link.link_crosses_hosts()
+                if link.transport is None:
+                    link.transport = self.cross_host_link_transport if crosses_hosts else self.same_host_link_transport
+                if link.transport not in LINK_TRANSPORTS:
+                    rootLogger.critical(f"Unknown transport {link.transport} for the link between switches {switch.switch_id_internal} and {cast(FireSimSwitchNode, link.get_downlink_side()).switch_id_internal}. Must be one of {LINK_TRANSPORTS}.")
+                    sys.exit(1)
+                if crosses_hosts and link.transport not in CROSS_HOST_LINK_TRANSPORTS:
+                    rootLogger.critical(f"The link between switches {switch.switch_id_internal} and {cast(FireSimSwitchNode, link.get_downlink_side()).switch_id_internal} crosses hosts, so it can't use transport {link.transport}. Must be one of {CROSS_HOST_LINK_TRANSPORTS}.")
+                    sys.exit(1)
+
     def pass_allocate_nbd_devices(self) -> None:
         """ allocate NBD devices. this must be done here to preserve the
         data structure for use in runworkload teardown. """
@@ -380,19 +690,123 @@ class FireSimTopologyWithPasses:
         """ These are passes that can run without requiring host-node binding.
         i.e. can be run before you have run launchrunfarm. They're run
         automatically when creating this object. """
-        self.pass_assign_mac_addresses()
-        self.pass_compute_switching_tables()
-        self.pass_perform_host_node_mapping() # TODO: we can know ports here?
-        self.pass_apply_default_hwconfig()
-        self.pass_apply_default_params()
-        self.pass_assign_jobs()
-        self.pass_allocate_nbd_devices()
-
-        self.pass_create_topology_diagram()
+        self.pass_manager.run(
+            'pass_assign_mac_addresses',
+            'pass_compute_switching_tables',
+            'pass_perform_host_node_mapping', # TODO: we can know ports here?
+            'pass_apply_default_hwconfig',
+            'pass_apply_default_params',
+            'pass_assign_jobs',
+            'pass_allocate_nbd_devices',
+            'pass_assign_link_transports',
+            'pass_create_topology_diagram',
+        )
+
+    def bind_run_farm(self, use_mock_instances_for_testing: bool, lost_hosts: Sequence[str]) -> Tuple[List[Inst], List[FireSimSwitchNode]]:
+        """ Bind the run farm to its hosts, then remap lost_hosts with
+        pass_remap_lost_hosts and return its result. """
+        self.run_farm.post_launch_binding(use_mock_instances_for_testing)
+        replacement_insts, changed_switches = self.pass_remap_lost_hosts(lost_hosts)
+        if replacement_insts:
+            self.pass_manager.invalidate('host_mapping')
+        return replacement_insts, changed_switches
+
+    def pass_allocate_switch_ports(self) -> None:
+        """ Allocate host ports for every link implemented with sockets, in
+        the same order that emitting the switch configs would. Ports are
+        otherwise allocated lazily, as a side effect of emitting configs. """
+        for switch in self.firesimtopol.get_dfs_order_switches():
+            for link in switch.downlinks + switch.uplinks:
+                if link.link_uses_sockets():
+                    link.link_hostserver_port()
+
+    def pass_remap_lost_hosts(self, lost_hosts: Sequence[str]) -> Tuple[List[Inst], List[FireSimSwitchNode]]:
+        """ Move everything mapped to the run farm hosts in lost_hosts onto
+        unused hosts in the run farm, leaving the rest of the mapping alone.
+        Requires hosts to be bound to instances.
+
+        Each lost host is replaced by the smallest spare host with enough
+        simulation slots. A spare starts out empty, so every link that
+        crossed hosts before still does (and vice versa): only the moved
+        switches and the switches with an uplink served by a moved switch
+        get new configs. Returns the replacement hosts and the switches
+        whose configs changed. Given the same lost hosts, the remapping is
+        deterministic, so every task can redo it. """
+        if not lost_hosts:
+            return [], []
 
-    def pass_build_required_drivers(self) -> None:
-        """ Build all simulation drivers. The method we're calling here won't actually
-        repeat the build process more than once per run of the manager. """
+        switches = self.firesimtopol.get_dfs_order_switches()
+        # settle the ports of the original mapping first, so that links
+        # that don't touch a lost host keep them
+        self.pass_allocate_switch_ports()
+
+        def port_layout(switch: FireSimSwitchNode) -> List[Any]:
+            return [link.link_uses_sockets() and (link.link_hostserver_host(), link.link_hostserver_port())
+                    for link in switch.downlinks + switch.uplinks]
+        layout_before = {switch: port_layout(switch) for switch in switches}
+
+        bound_hosts = self.run_farm.get_all_bound_host_nodes()
+        hosts_by_name = {x.get_host(): x for x in bound_hosts}
+        lost_insts = []
+        for host in lost_hosts:
+            if host not in hosts_by_name:
+                rootLogger.critical(f"Lost host {host} is not a host in the run farm.")
+                sys.exit(1)
+            lost_insts.append(hosts_by_name[host])
+
+        spares = [x for x in bound_hosts if not x.sim_slots and not x.switch_slots and x not in lost_insts]
+        spares.sort(key=lambda x: x.MAX_SIM_SLOTS_ALLOWED)
+
+        replacements: Dict[Inst, Inst] = {}
+        for lost_inst in lost_insts:
+            if not lost_inst.sim_slots and not lost_inst.switch_slots:
+                continue
+            candidates = [x for x in spares if x.MAX_SIM_SLOTS_ALLOWED >= len(lost_inst.sim_slots)]
+            if not candidates:
+                rootLogger.critical(f"No spare run farm host with at least {len(lost_inst.sim_slots)} simulation slots to replace {lost_inst.get_host()}. Add one to the run farm and try again.")
+                sys.exit(1)
+            replacement = candidates[0]
+            spares.remove(replacement)
+            replacements[lost_inst] = replacement
+            rootLogger.info(f"Remapping {len(lost_inst.sim_slots)} simulations and {len(lost_inst.switch_slots)} switches from lost host {lost_inst.get_host()} to {replacement.get_host()}.")
+
+            for server in lost_inst.sim_slots:
+                replacement.add_simulation(server)
+            for switch in lost_inst.switch_slots:
+                replacement.add_switch(switch)
+            lost_inst.sim_slots = []
+            lost_inst.switch_slots = []
+
+        if not replacements:
+            return [], []
+
+        # FireSimDummyServerNodes are not in any slot, but follow their supernode
+        for node in self.firesimtopol.get_dfs_order():
+            if node.host_instance in replacements:
+                node.assign_host_instance(replacements[node.host_instance])
+
+        replacement_insts = list(replacements.values())
+        for inst in replacement_insts:
+            for server in inst.sim_slots:
+                server.allocate_nbds()
+            # a link's port belongs to its uplink side, so only the moved
+            # switches' downlinks need new ones
+            for switch in inst.switch_slots:
+                for link in switch.downlinks:
+                    link.port = None
+        self.pass_allocate_switch_ports()
+
+        changed_switches = [x for x in switches if x.get_host_instance() in replacement_insts or port_layout(x) != layout_before[x]]
+        return replacement_insts, changed_switches
+
+    def get_run_farm_ips(self, lost_hosts: Sequence[str] = ()) -> List[str]:
+        """ Return the hosts of all bound run farm instances that aren't lost. """
+        return [x.get_host() for x in self.run_farm.get_all_bound_host_nodes() if x.get_host() not in lost_hosts]
+
+    def pass_build_required_drivers(self, servers: Optional[List[FireSimServerNode]] = None) -> None:
+        """ Build the simulation drivers for servers (by default, all of them).
+        The method we're calling here won't actually repeat the build process
+        more than once per run of the manager. """
 
         def build_drivers_helper(servers: List[FireSimServerNode]) -> None:
             for server in servers:
@@ -405,28 +819,104 @@ class FireSimTopologyWithPasses:
                 resolved_cfg.build_sim_driver()
                 resolved_cfg.build_sim_tarball(server.get_tarball_files_paths(), resolved_cfg.get_driver_tar_filename())
 
-        servers = self.firesimtopol.get_dfs_order_servers()
+        if servers is None:
+            servers = self.firesimtopol.get_dfs_order_servers()
         execute(build_drivers_helper, servers, hosts=['localhost'])
 
-    def pass_build_required_switches(self) -> None:
-        """ Build all the switches required for this simulation. """
+    def pass_build_required_switches(self, switches: Optional[List[FireSimSwitchNode]] = None) -> None:
+        """ Build the switches required for this simulation (by default, all
+        of them). """
         # the way the switch models are designed, this requires hosts to be
         # bound to instances.
-        switches = self.firesimtopol.get_dfs_order_switches()
+        if switches is None:
+            switches = self.firesimtopol.get_dfs_order_switches()
+        if not switches:
+            return
+
+        # emitting configs allocates host ports, so do it serially. the
+        # compiles themselves are independent
         for switch in switches:
-            switch.build_switch_sim_binary()
+            switch.switch_builder.prepare_switch_build()
+
+        max_workers = min(len(switches), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(switch.switch_builder.compile_switch): switch for switch in switches}
+            for future in as_completed(futures):
+                if not future.result():
+                    for pending in futures:
+                        pending.cancel()
+                    report_switch_build_failure(futures[future].switch_builder)
+                    sys.exit(1)
 
     def pass_fetch_URI_resolve_runtime_cfg(self, dir: str) -> None:
         """Locally download URIs, and use any URI-contained metadata to resolve runtime config values"""
         servers = self.firesimtopol.get_dfs_order_servers()
+        # servers usually share a handful of hardware configs
+        resolved_cfgs = dict()
         for server in servers:
             resolved_cfg = server.get_resolved_server_hardware_config()
+            resolved_cfgs[id(resolved_cfg)] = resolved_cfg
+        for resolved_cfg in resolved_cfgs.values():
             resolved_cfg.fetch_all_URI(dir)
             resolved_cfg.resolve_hwcfg_values(dir)
 
-    def infrasetup_passes(self, use_mock_instances_for_testing: bool) -> None:
-        """ extra passes needed to do infrasetup """
-        self.run_farm.post_launch_binding(use_mock_instances_for_testing)
+    def fetch_artifact_manifests(self, hosts: Sequence[str], uridir: str) -> None:
+        """ Hash the files that hosts' sim slots need, and list the artifact
+        store of every host at once, so that the infrasetup tasks (which
+        inherit both) only have to upload what is missing. See
+        InstanceDeployManager.copy_sim_infrastructure. """
+        idms = []
+        for host in hosts:
+            idm = self.run_farm.lookup_by_host(host).instance_deploy_manager
+            assert idm is not None
+            if idm.instance_assigned_simulations():
+                idms.append(idm)
+                for slotno in range(len(idm.parent_node.sim_slots)):
+                    for local_path, _ in idm.get_sim_slot_files(slotno, uridir):
+                        idm.artifact_digests.digest(local_path)
+        if not idms:
+            return
+        idms[0].artifact_digests.save()
+
+        def fetch_manifest(host: str) -> Optional[Set[str]]:
+            idm = self.run_farm.lookup_by_host(host).instance_deploy_manager
+            assert idm is not None
+            result = self.get_ssh_pool().run(host, manifest_command(idm.get_artifact_store_dir()), warn_only=True)
+            # if this fails, the infrasetup task lists the store itself
+            return parse_manifest(result) if result.succeeded else None
+        manifests = self.get_ssh_pool().call_on_hosts([idm.parent_node.get_host() for idm in idms], fetch_manifest)
+        for idm in idms:
+            idm.store_manifest = manifests[idm.parent_node.get_host()]
+
+    def broadcast_infrasetup_artifacts(self, hosts: Sequence[str], uridir: str, fanout: int) -> None:
+        """ Send the large files that several hosts' sim slots need, and
+        don't have in their artifact stores yet, through the run farm, see
+        ArtifactBroadcast. The infrasetup that follows then finds them up to
+        date in the hosts' incoming dirs. """
+        artifacts: Dict[str, Dict[str, str]] = {}
+        for host in hosts:
+            idm = self.run_farm.lookup_by_host(host).instance_deploy_manager
+            assert idm is not None
+            if not idm.instance_assigned_simulations():
+                continue
+            for slotno in range(len(idm.parent_node.sim_slots)):
+                for local_path, _ in idm.get_sim_slot_files(slotno, uridir):
+                    digest = idm.artifact_digests.digest(local_path)
+                    if idm.store_manifest is None or digest not in idm.store_manifest:
+                        artifacts.setdefault(local_path, {})[host] = idm.get_incoming_dir(digest)
+        artifacts = {local_path: dest_dirs for local_path, dest_dirs in artifacts.items()
+                     if len(dest_dirs) > 1 and os.path.isfile(local_path) and os.path.getsize(local_path) >= BROADCAST_MIN_BYTES}
+        if not artifacts:
+            return
+        rootLogger.info(f"Broadcasting {len(artifacts)} artifact(s) through {len(hosts)} host(s), {fanout} at a time from the manager...")
+        ArtifactBroadcast(self.get_ssh_pool(), fanout).run(artifacts)
+
+    def infrasetup_passes(self, use_mock_instances_for_testing: bool, lost_hosts: Sequence[str] = (), broadcast_fanout: int = 0) -> None:
+        """ extra passes needed to do infrasetup. if lost_hosts are given,
+        only set up what they were running, on spare hosts. if
+        broadcast_fanout is set, large files are first distributed through
+        the run farm hosts. """
+        replacement_insts, changed_switches = self.bind_run_farm(use_mock_instances_for_testing, lost_hosts)
 
         @parallel
         def infrasetup_node_wrapper(run_farm: RunFarm, dir: str) -> None:
@@ -435,17 +925,41 @@ class FireSimTopologyWithPasses:
             assert my_node.instance_deploy_manager is not None
             my_node.instance_deploy_manager.infrasetup_instance(dir)
 
-        all_run_farm_ips = [x.get_host() for x in self.run_farm.get_all_bound_host_nodes()]
-        execute(instance_liveness, hosts=all_run_farm_ips)
+        @parallel
+        def infrasetup_switches_wrapper(run_farm: RunFarm, switches: List[FireSimSwitchNode]) -> None:
+            my_node = run_farm.lookup_by_host(env.host_string)
+            assert my_node is not None
+            assert my_node.instance_deploy_manager is not None
+            my_node.instance_deploy_manager.infrasetup_switches_instance(switches)
+
+        if lost_hosts:
+            # replacement hosts get a full setup, other hosts only get the
+            # switches whose configs changed
+            infrasetup_ips = [x.get_host() for x in replacement_insts]
+            switch_only_ips = sorted(set(x.get_host_instance().get_host() for x in changed_switches) - set(infrasetup_ips))
+            if not infrasetup_ips:
+                rootLogger.info("Nothing was mapped to the lost hosts, skipping infrasetup.")
+                return
+            servers: Optional[List[FireSimServerNode]] = [x for inst in replacement_insts for x in inst.sim_slots]
+            switches: Optional[List[FireSimSwitchNode]] = changed_switches
+        else:
+            infrasetup_ips = self.get_run_farm_ips()
+            switch_only_ips = []
+            servers = None
+            switches = None
+
+        self.check_liveness(infrasetup_ips + switch_only_ips)
 
-        # Steps occur within the context of a tempdir.
-        # This allows URI's to survive until after deploy, and cleanup upon error
-        with TemporaryDirectory() as uridir:
-            self.pass_fetch_URI_resolve_runtime_cfg(uridir)
-            self.pass_build_required_drivers()
-            self.pass_build_required_switches()
+        uridir = self.get_uri_dir()
+        self.pass_manager.run('pass_build_required_drivers', 'pass_build_required_switches', dir=uridir, servers=servers, switches=switches)
 
-            execute(infrasetup_node_wrapper, self.run_farm, uridir, hosts=all_run_farm_ips)
+        self.fetch_artifact_manifests(infrasetup_ips, uridir)
+        if broadcast_fanout > 0:
+            self.broadcast_infrasetup_artifacts(infrasetup_ips, uridir, broadcast_fanout)
+
+        execute(infrasetup_node_wrapper, self.run_farm, uridir, hosts=infrasetup_ips)
+        if switch_only_ips:
+            execute(infrasetup_switches_wrapper, self.run_farm, changed_switches, hosts=switch_only_ips)
 
     def enumerate_fpgas_passes(self, use_mock_instances_for_testing: bool) -> None:
         """ extra passes needed to do enumerate_fpgas """
@@ -458,36 +972,29 @@ class FireSimTopologyWithPasses:
             assert my_node.instance_deploy_manager is not None
             my_node.instance_deploy_manager.enumerate_fpgas(dir)
 
-        all_run_farm_ips = [x.get_host() for x in self.run_farm.get_all_bound_host_nodes()]
-        execute(instance_liveness, hosts=all_run_farm_ips)
+        all_run_farm_ips = self.get_run_farm_ips()
+        self.check_liveness(all_run_farm_ips)
 
-        # Steps occur within the context of a tempdir.
-        # This allows URI's to survive until after deploy, and cleanup upon error
-        with TemporaryDirectory() as uridir:
-            self.pass_fetch_URI_resolve_runtime_cfg(uridir)
-            self.pass_build_required_drivers()
-            execute(enumerate_fpgas_node_wrapper, self.run_farm, uridir, hosts=all_run_farm_ips)
+        uridir = self.get_uri_dir()
+        self.pass_manager.run('pass_build_required_drivers', dir=uridir, servers=None)
+        execute(enumerate_fpgas_node_wrapper, self.run_farm, uridir, hosts=all_run_farm_ips)
 
     def build_driver_passes(self) -> None:
         """ Only run passes to build drivers. """
+        self.pass_manager.run('pass_build_required_drivers', dir=self.get_uri_dir(), servers=None)
 
-        # Steps occur within the context of a tempdir.
-        # This allows URI's to survive until after deploy, and cleanup upon error
-        with TemporaryDirectory() as uridir:
-            self.pass_fetch_URI_resolve_runtime_cfg(uridir)
-            self.pass_build_required_drivers()
-
-    def boot_simulation_passes(self, use_mock_instances_for_testing: bool, skip_instance_binding: bool = False) -> None:
+    def boot_simulation_passes(self, use_mock_instances_for_testing: bool, skip_instance_binding: bool = False, lost_hosts: Sequence[str] = ()) -> None:
         """ Passes that setup for boot and boot the simulation.
         skip instance binding lets users not call the binding pass on the run_farm
         again, e.g. if this was called by runworkload (because runworkload calls
-        boot_simulation_passes internally)
+        boot_simulation_passes internally). lost_hosts are remapped as in
+        infrasetup and left alone.
         TODO: the reason we need this is that somehow we're getting
         garbage results if the AWS EC2 API gets called twice by accident
         (e.g.  incorrect private IPs)
         """
         if not skip_instance_binding:
-            self.run_farm.post_launch_binding(use_mock_instances_for_testing)
+            self.bind_run_farm(use_mock_instances_for_testing, lost_hosts)
 
         @parallel
         def boot_switch_wrapper(run_farm: RunFarm) -> None:
@@ -496,13 +1003,10 @@ class FireSimTopologyWithPasses:
             assert my_node.instance_deploy_manager is not None
             my_node.instance_deploy_manager.start_switches_instance()
 
-        # Steps occur within the context of a tempdir.
-        # This allows URI's to survive until after deploy, and cleanup upon error
-        with TemporaryDirectory() as uridir:
-            self.pass_fetch_URI_resolve_runtime_cfg(uridir)
+        self.pass_manager.run('pass_fetch_URI_resolve_runtime_cfg', dir=self.get_uri_dir())
 
-        all_run_farm_ips = [x.get_host() for x in self.run_farm.get_all_bound_host_nodes()]
-        execute(instance_liveness, hosts=all_run_farm_ips)
+        all_run_farm_ips = self.get_run_farm_ips(lost_hosts)
+        self.check_liveness(all_run_farm_ips)
         execute(boot_switch_wrapper, self.run_farm, hosts=all_run_farm_ips)
 
         @parallel
@@ -513,9 +1017,9 @@ class FireSimTopologyWithPasses:
 
         execute(boot_simulation_wrapper, self.run_farm, hosts=all_run_farm_ips)
 
-    def kill_simulation_passes(self, use_mock_instances_for_testing: bool, disconnect_all_nbds: bool = True) -> None:
+    def kill_simulation_passes(self, use_mock_instances_for_testing: bool, disconnect_all_nbds: bool = True, lost_hosts: Sequence[str] = ()) -> None:
         """ Passes that kill the simulator. """
-        self.run_farm.post_launch_binding(use_mock_instances_for_testing)
+        self.bind_run_farm(use_mock_instances_for_testing, lost_hosts)
 
         @parallel
         def kill_switch_wrapper(run_farm: RunFarm) -> None:
@@ -529,45 +1033,21 @@ class FireSimTopologyWithPasses:
             assert my_node.instance_deploy_manager is not None
             my_node.instance_deploy_manager.kill_simulations_instance(disconnect_all_nbds=disconnect_all_nbds)
 
-        # Steps occur within the context of a tempdir.
-        # This allows URI's to survive until after deploy, and cleanup upon error
-        with TemporaryDirectory() as uridir:
-            self.pass_fetch_URI_resolve_runtime_cfg(uridir)
+        self.pass_manager.run('pass_fetch_URI_resolve_runtime_cfg', dir=self.get_uri_dir())
 
-        all_run_farm_ips = [x.get_host() for x in self.run_farm.get_all_bound_host_nodes()]
+        all_run_farm_ips = self.get_run_farm_ips(lost_hosts)
 
+        # hosts that can't be reached are left to fail in the kill tasks
+        self.probe_hosts(all_run_farm_ips)
         execute(kill_switch_wrapper, self.run_farm, hosts=all_run_farm_ips)
         execute(kill_simulation_wrapper, self.run_farm, hosts=all_run_farm_ips)
+        self.wait_for_screens_to_exit(all_run_farm_ips)
 
-        def screens() -> None:
-            """ poll on screens to make sure kill succeeded. """
-            with warn_only():
-                rootLogger.info("Confirming exit...")
-                # keep checking screen until it reports that there are no screens left
-                while True:
-                    run("screen -wipe || true") # wipe any potentially dead screens
-                    screenoutput = run("screen -ls")
-                    # If AutoILA is enabled, use the following condition
-                    if "No Sockets found" in screenoutput:
-                        break
-                    # If AutoILA is enabled, use the following condition ('hw_server'/'virtual_jtag' are still running)
-                    elif "2 Sockets in" in screenoutput and "hw_server" in screenoutput and "virtual_jtag" in screenoutput:
-                        break
-                    # If AutoILA is disabled, continue as long as there is a fsim* or switch* screen.
-                    elif "fsim" in screenoutput or "switch" in screenoutput:
-                        time.sleep(1)
-                        continue
-                    else:
-                        rootLogger.warning(f"Unknown screen state. Breaking poll and printing screen state:\n{screenoutput}")
-                        break
-
-        execute(screens, hosts=all_run_farm_ips)
-
-    def run_workload_passes(self, use_mock_instances_for_testing: bool) -> None:
+    def run_workload_passes(self, use_mock_instances_for_testing: bool, lost_hosts: Sequence[str] = ()) -> None:
         """ extra passes needed to do runworkload. """
-        self.run_farm.post_launch_binding(use_mock_instances_for_testing)
+        self.bind_run_farm(use_mock_instances_for_testing, lost_hosts)
 
-        all_run_farm_ips = [x.get_host() for x in self.run_farm.get_all_bound_host_nodes()]
+        all_run_farm_ips = self.get_run_farm_ips(lost_hosts)
 
         rootLogger.info("""Creating the directory: {}""".format(self.workload.job_results_dir))
         localcap = local("""mkdir -p {}""".format(self.workload.job_results_dir), capture=True)
@@ -580,7 +1060,7 @@ class FireSimTopologyWithPasses:
         rootLogger.debug("[localhost] " + str(localcap.stderr))
 
         # boot up as usual
-        self.boot_simulation_passes(False, skip_instance_binding=True)
+        self.boot_simulation_passes(False, skip_instance_binding=True, lost_hosts=lost_hosts)
 
         @parallel
         def monitor_jobs_wrapper(
@@ -589,12 +1069,59 @@ class FireSimTopologyWithPasses:
                 is_final_loop: bool,
                 is_networked: bool,
                 terminateoncompletion: bool,
-                job_results_dir: str) -> Dict[str, Dict[str, bool]]:
+                job_results_dir: str,
+                screen_statuses: Dict[str, Dict[str, List[str]]]) -> Dict[str, Dict[str, bool]]:
             """ on each instance, check over its switches and simulations
             to copy results off. """
             my_node = run_farm.lookup_by_host(env.host_string)
             assert my_node.instance_deploy_manager is not None
-            return my_node.instance_deploy_manager.monitor_jobs_instance(prior_completed_jobs, is_final_loop, is_networked, terminateoncompletion, job_results_dir)
+            # this runs in a forked process, which has to finish its copies
+            fork_copy_back_queue = CopyBackQueue(self.get_ssh_pool())
+            instancestate = my_node.instance_deploy_manager.monitor_jobs_instance(prior_completed_jobs, is_final_loop, is_networked, terminateoncompletion, job_results_dir, fork_copy_back_queue, screen_statuses.get(env.host_string))
+            fork_copy_back_queue.shutdown()
+            return instancestate
+
+        deploy_managers = {}
+        for host in all_run_farm_ips:
+            idm = self.run_farm.lookup_by_host(host).instance_deploy_manager
+            assert idm is not None
+            deploy_managers[host] = idm
+
+        def monitor_jobs(prior_completed_jobs: List[str], is_final_loop: bool) -> Dict[str, Dict[str, Dict[str, bool]]]:
+            """ Poll the screens of all hosts over the SSH connection pool,
+            and queue the copy-back of jobs that completed. Only start fabric
+            tasks on the hosts that need more than that (e.g. to terminate
+            them), once their outstanding copies are done. """
+            screen_statuses: Dict[str, Dict[str, List[str]]] = {}
+            fabric_hosts = all_run_farm_ips
+            if not is_final_loop:
+                polls = self.get_ssh_pool().run_on_hosts(all_run_farm_ips, "screen -ls 2>&1", warn_only=True)
+                # screen -ls exits with 1 when there are no screens, 255 is
+                # ssh failing. leave those hosts to fabric, which reports it
+                screen_statuses = {host: InstanceDeployManager.parse_screen_status(result)
+                                   for host, result in polls.items() if result.return_code != 255}
+                fabric_hosts = [host for host in all_run_farm_ips
+                                if host not in screen_statuses
+                                or deploy_managers[host].monitor_requires_remote_work(prior_completed_jobs, is_final_loop, is_networked, self.terminateoncompletion, screen_statuses[host])]
+
+            instancestates = {}
+            for host in all_run_farm_ips:
+                if host not in fabric_hosts:
+                    instancestates[host] = deploy_managers[host].monitor_jobs_instance(prior_completed_jobs, is_final_loop, is_networked, self.terminateoncompletion, self.workload.job_results_dir, copy_back_queue, screen_statuses[host])
+            if fabric_hosts:
+                copy_back_queue.wait(fabric_hosts)
+                # the copies that just finished marked their jobs complete
+                prior_completed_jobs = os.listdir(self.workload.job_monitoring_dir)
+                instancestates.update(execute(monitor_jobs_wrapper,
+                                              self.run_farm,
+                                              prior_completed_jobs,
+                                              is_final_loop,
+                                              is_networked,
+                                              self.terminateoncompletion,
+                                              self.workload.job_results_dir,
+                                              screen_statuses,
+                                              hosts=fabric_hosts))
+            return {host: instancestates[host] for host in all_run_farm_ips}
 
         def loop_logger(instancestates: Dict[str, Any], terminateoncompletion: bool) -> None:
             """ Print the simulation status nicely. """
@@ -645,7 +1172,7 @@ class FireSimTopologyWithPasses:
             rootLogger.info("""This workload's output is located in:\n{}""".format(self.workload.job_results_dir))
             assert isinstance(rootLogger.handlers[0], logging.FileHandler)
             rootLogger.info("""This run's log is located in:\n{}""".format(rootLogger.handlers[0].baseFilename))
-            rootLogger.info("""This status will update every 10s.""")
+            rootLogger.info(f"""This status will update when a simulation exits, or every {MONITOR_FALLBACK_POLL_S}s.""")
             rootLogger.info("-"*80)
             rootLogger.info("Instances")
             rootLogger.info("-"*80)
@@ -671,70 +1198,68 @@ class FireSimTopologyWithPasses:
         # is networked if a switch node is the root
         is_networked = isinstance(self.firesimtopol.roots[0], FireSimSwitchNode)
 
-        # run polling loop
-        while True:
-            """ break out of this loop when either all sims are completed (no
-            network) or when one sim is completed (networked case) """
-
-            def get_jobs_completed_local_info():
-                # this is a list of jobs completed, since any completed job will have
-                # a directory within this directory.
-                monitored_jobs_completed = os.listdir(self.workload.job_monitoring_dir)
-                rootLogger.debug(f"Monitoring dir jobs completed: {monitored_jobs_completed}")
-                return monitored_jobs_completed
-
-            # return all the state about the instance (potentially copy back results and/or terminate)
-            is_final_run = False
-            monitored_jobs_completed = get_jobs_completed_local_info()
-            instancestates = execute(monitor_jobs_wrapper,
-                                     self.run_farm,
-                                     monitored_jobs_completed,
-                                     is_final_run,
-                                     is_networked,
-                                     self.terminateoncompletion,
-                                     self.workload.job_results_dir,
-                                     hosts=all_run_farm_ips)
-
-            # log sim state, raw
-            rootLogger.debug(pprint.pformat(instancestates))
-
-            # log sim state, properly
-            loop_logger(instancestates, self.terminateoncompletion)
-
-            jobs_complete_dict = {}
-            simstates = [x['sims'] for x in instancestates.values()]
-            for x in simstates:
-                jobs_complete_dict.update(x)
-            global_status = jobs_complete_dict.values()
-            rootLogger.debug(f"Jobs complete: {jobs_complete_dict}")
-            rootLogger.debug(f"Global status: {global_status}")
-
-            if is_networked and any(global_status):
-                # at least one simulation has finished
-
-                # in this case, do the teardown, then call exec again, then exit
-                rootLogger.info("Networked simulation, manually tearing down all instances...")
-                # do not disconnect nbds, because we may need them for copying
-                # results. the process of copying results will tear them down anyway
-                self.kill_simulation_passes(use_mock_instances_for_testing, disconnect_all_nbds=False)
-
-                rootLogger.debug("One more loop to fully copy results and terminate.")
-                is_final_run = True
+        # run polling loop, which only waits for the hosts to report a
+        # sim or switch exiting, or for the fallback poll interval
+        watcher = HostEventWatcher(self.get_ssh_pool(), all_run_farm_ips)
+        # copy-backs of jobs that completed while the other jobs keep
+        # running. a finished copy completes its job, so it wakes the loop too
+        copy_back_queue = CopyBackQueue(self.get_ssh_pool(), on_copied=watcher.notify)
+        watcher.start()
+        try:
+            while True:
+                """ break out of this loop when either all sims are completed (no
+                network) or when one sim is completed (networked case) """
+
+                def get_jobs_completed_local_info():
+                    # this is a list of jobs completed, since any completed job will have
+                    # a directory within this directory.
+                    monitored_jobs_completed = os.listdir(self.workload.job_monitoring_dir)
+                    rootLogger.debug(f"Monitoring dir jobs completed: {monitored_jobs_completed}")
+                    return monitored_jobs_completed
+
+                # return all the state about the instance (potentially copy back results and/or terminate)
+                is_final_run = False
                 monitored_jobs_completed = get_jobs_completed_local_info()
-                instancestates = execute(monitor_jobs_wrapper,
-                                         self.run_farm,
-                                         monitored_jobs_completed,
-                                         is_final_run,
-                                         is_networked,
-                                         self.terminateoncompletion,
-                                         self.workload.job_results_dir,
-                                         hosts=all_run_farm_ips)
-                break
-
-            if not is_networked and all(global_status):
-                break
-
-            time.sleep(10)
+                instancestates = monitor_jobs(monitored_jobs_completed, is_final_run)
+
+                # log sim state, raw
+                rootLogger.debug(pprint.pformat(instancestates))
+
+                # log sim state, properly
+                loop_logger(instancestates, self.terminateoncompletion)
+
+                jobs_complete_dict = {}
+                simstates = [x['sims'] for x in instancestates.values()]
+                for x in simstates:
+                    jobs_complete_dict.update(x)
+                global_status = jobs_complete_dict.values()
+                rootLogger.debug(f"Jobs complete: {jobs_complete_dict}")
+                rootLogger.debug(f"Global status: {global_status}")
+
+                if is_networked and any(global_status):
+                    # at least one simulation has finished
+
+                    # in this case, do the teardown, then call exec again, then exit
+                    rootLogger.info("Networked simulation, manually tearing down all instances...")
+                    # do not disconnect nbds, because we may need them for copying
+                    # results. the process of copying results will tear them down anyway
+                    self.kill_simulation_passes(use_mock_instances_for_testing, disconnect_all_nbds=False, lost_hosts=lost_hosts)
+
+                    rootLogger.debug("One more loop to fully copy results and terminate.")
+                    is_final_run = True
+                    monitored_jobs_completed = get_jobs_completed_local_info()
+                    instancestates = monitor_jobs(monitored_jobs_completed, is_final_run)
+                    break
+
+                if not is_networked and all(global_status):
+                    break
+
+                # the watcher wakes us up as soon as a sim or switch exits
+                watcher.wait(MONITOR_FALLBACK_POLL_S)
+            # the last copies may still be running
+            copy_back_queue.shutdown()
+        finally:
+            watcher.stop()
 
         # run post-workload hook, if one exists
         if self.workload.post_run_hook is not None:
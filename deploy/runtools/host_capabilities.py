@@ -0,0 +1,71 @@
+""" What a run farm host supports, probed once per manager command. """
+
+from __future__ import annotations
+
+import shlex
+from dataclasses import dataclass, field
+
+from typing import List, Optional, Set
+
+# kernel modules the deploy managers load, unload or depend on
+PROBED_MODULES = ['nbd', 'xdma', 'xvsec']
+
+@dataclass
+class HostCapabilities:
+    """ Results of probe_command on a host. The deploy managers consult
+    these instead of checking the host again, see
+    InstanceDeployManager.has_sudo and module_loaded. """
+    # default shell, as $SHELL
+    shell: str
+    # passwordless sudo is available
+    sudo: bool
+    # uname -r
+    kernel: str
+    # free space in the simulation dir (or the closest existing parent)
+    sim_dir_free_kb: Optional[int]
+    # loaded modules out of PROBED_MODULES
+    modules: Set[str] = field(default_factory=set)
+    has_screen: bool = False
+    has_guestmount: bool = False
+    # disk images can be streamed through zstd, see upload_disk_image
+    has_zstd: bool = False
+
+def probe_command(sim_dir: Optional[str]) -> str:
+    """ A single command that prints key=value lines describing the host,
+    which parse_probe_output turns into HostCapabilities. """
+    # $SHELL is printed by the default shell, which may not be bash (see
+    # check_default_shell). the rest runs in bash
+    lines: List[str] = [
+        'echo kernel=$(uname -r)',
+        'if sudo -ln true >/dev/null 2>&1; then echo sudo=1; else echo sudo=0; fi',
+        f"echo modules=$(lsmod | awk 'NR > 1 {{print $1}}' | grep -xE '{'|'.join(PROBED_MODULES)}')",
+        'command -v screen >/dev/null && echo screen=1 || echo screen=0',
+        'command -v guestmount >/dev/null && echo guestmount=1 || echo guestmount=0',
+        'command -v zstd >/dev/null && echo zstd=1 || echo zstd=0',
+    ]
+    if sim_dir is not None:
+        # the sim dir doesn't exist before the first infrasetup
+        if sim_dir.startswith("~"):
+            sim_dir = "$HOME" + sim_dir[1:]
+        lines += [
+            f'd="{sim_dir}"; while [ ! -e "$d" ]; do d=$(dirname "$d"); done',
+            """echo sim_dir_free_kb=$(df -Pk "$d" | awk 'NR == 2 {print $4}')""",
+        ]
+    return "echo shell=$SHELL; bash -c " + shlex.quote("; ".join(lines))
+
+def parse_probe_output(output: str) -> HostCapabilities:
+    values = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            values[key.strip()] = value.strip()
+    free_kb = values.get('sim_dir_free_kb', "")
+    return HostCapabilities(
+        shell=values.get('shell', ""),
+        sudo=values.get('sudo') == "1",
+        kernel=values.get('kernel', ""),
+        sim_dir_free_kb=int(free_kb) if free_kb.isdigit() else None,
+        modules=set(values.get('modules', "").split()),
+        has_screen=values.get('screen') == "1",
+        has_guestmount=values.get('guestmount') == "1",
+        has_zstd=values.get('zstd') == "1")
@@ -0,0 +1,146 @@
+""" Stream simulation and switch exits from run farm hosts to the manager as
+they happen. """
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import shlex
+import threading
+
+from typing import Dict, List, Optional, Sequence, TYPE_CHECKING
+if TYPE_CHECKING:
+    from runtools.ssh_pool import SSHConnectionPool
+
+rootLogger = logging.getLogger()
+
+# runs on each host for as long as the manager watches it. prints the fsim*
+# and switch* screens whenever they change, waiting on the screen socket dir
+# with inotifywait where it's installed and checking every second otherwise.
+# the heartbeat makes the watcher exit (on SIGPIPE) once the manager is gone
+WATCHER_SCRIPT = r"""
+prev=unset
+last_beat=$SECONDS
+while true; do
+    ls_out=$(screen -ls 2>&1)
+    cur=$(echo "$ls_out" | grep -oE '[0-9]+\.(fsim|switch)[0-9]+' | cut -d. -f2 | sort | tr '\n' ' ')
+    if [ "$cur" != "$prev" ]; then
+        echo "screens: $cur"
+        prev="$cur"
+    fi
+    if [ $((SECONDS - last_beat)) -ge 30 ]; then
+        echo "heartbeat"
+        last_beat=$SECONDS
+    fi
+    dir=$(echo "$ls_out" | sed -n 's/.* in \(\/.*\)\.$/\1/p' | tail -n1)
+    if [ -n "$dir" ] && [ -d "$dir" ] && command -v inotifywait >/dev/null; then
+        inotifywait -qq -t 30 -e create -e delete "$dir" >/dev/null 2>&1
+    else
+        sleep 1
+    fi
+done
+"""
+
+class HostEventWatcher:
+    """ Keeps a long-lived SSH channel open to each host, running
+    WATCHER_SCRIPT. wait() returns as soon as the set of simulations and
+    switches running on any host changes, so the manager can react to a
+    completed job right away instead of on its next poll.
+
+    Watching is best effort: a host whose channel drops is only picked up by
+    the manager's fallback polling. """
+    pool: SSHConnectionPool
+    hosts: List[str]
+    # last reported screens, by host
+    screens: Dict[str, List[str]]
+    # changes reported so far, and how many of them wait() has returned for
+    changes: int
+    changes_seen: int
+    condition: threading.Condition
+    thread: Optional[threading.Thread]
+    loop: Optional[asyncio.AbstractEventLoop]
+    stopping: Optional[asyncio.Event]
+
+    def __init__(self, pool: SSHConnectionPool, hosts: Sequence[str]) -> None:
+        self.pool = pool
+        self.hosts = list(hosts)
+        self.screens = {}
+        self.changes = 0
+        self.changes_seen = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.loop = None
+        self.stopping = None
+
+    def start(self) -> None:
+        started = threading.Event()
+        def run_loop() -> None:
+            async def watch_all() -> None:
+                self.loop = asyncio.get_running_loop()
+                self.stopping = asyncio.Event()
+                started.set()
+                await asyncio.gather(*[self.watch(host) for host in self.hosts])
+            asyncio.run(watch_all())
+        self.thread = threading.Thread(target=run_loop, name="host-event-watcher", daemon=True)
+        self.thread.start()
+        started.wait()
+
+    async def watch(self, host: str) -> None:
+        """ Follow the watcher on host until stop() or the channel drops. """
+        assert self.stopping is not None
+        semaphore = asyncio.Semaphore(1)
+        await self.pool.connect_async(host, semaphore)
+        proc = await asyncio.create_subprocess_exec(*self.pool.ssh_command(host, "bash -c " + shlex.quote(WATCHER_SCRIPT)),
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        assert proc.stdout is not None
+        stop_task = asyncio.ensure_future(self.stopping.wait())
+        try:
+            while True:
+                line_task = asyncio.ensure_future(proc.stdout.readline())
+                done, _ = await asyncio.wait([line_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+                if stop_task in done:
+                    line_task.cancel()
+                    break
+                line = line_task.result().decode(errors="replace")
+                if not line:
+                    rootLogger.debug(f"[{host}] Lost the job event channel, falling back to polling.")
+                    break
+                if line.startswith("screens:"):
+                    # the first report is what was running when watching started
+                    first_report = host not in self.screens
+                    self.screens[host] = line[len("screens:"):].split()
+                    rootLogger.debug(f"[{host}] Running screens: {self.screens[host]}")
+                    if not first_report:
+                        self.notify()
+        finally:
+            stop_task.cancel()
+            if proc.returncode is None:
+                proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), 10)
+            except asyncio.TimeoutError:
+                rootLogger.debug(f"[{host}] Job event channel did not close.")
+
+    def notify(self) -> None:
+        """ Report a change, waking up wait(). Safe to call from any thread. """
+        with self.condition:
+            self.changes += 1
+            self.condition.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        """ Wait until the screens on some host changed (or notify() was
+        called) since the last call, for at most timeout seconds. Return
+        whether they did. Changes are counted, so one that is reported while
+        the caller isn't waiting is returned by the next call. """
+        with self.condition:
+            changed = self.condition.wait_for(lambda: self.changes > self.changes_seen, timeout)
+            self.changes_seen = self.changes
+            return changed
+
+    def stop(self) -> None:
+        if self.thread is None:
+            return
+        assert self.loop is not None and self.stopping is not None
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join()
+        self.thread = None
@@ -0,0 +1,36 @@
+""" Upload disk images (workload rootfses) to run farm hosts, keeping their
+holes and compressing them on the way. """
+
+from __future__ import annotations
+
+import os
+import shlex
+import shutil
+from fabric.api import env # type: ignore
+from fabric.network import key_filenames, normalize # type: ignore
+
+# zstd -1 compresses faster than most links, and rootfses are mostly zeros
+ZSTD_LEVEL = 1
+
+def manager_has_zstd() -> bool:
+    return shutil.which("zstd") is not None
+
+def fabric_ssh_command() -> str:
+    """ The ssh command that rsync_project uses to reach env.host_string. """
+    user, host, port = normalize(env.host_string)
+    options = ["-o StrictHostKeyChecking=no"] + [f"-i {key}" for key in key_filenames()]
+    if port != env.default_port:
+        options.append(f"-p {port}")
+    return f"ssh {' '.join(options)} {user}@{host}"
+
+def sparse_upload_command(local_path: str, remote_dir: str) -> str:
+    """ A local bash command that streams local_path into remote_dir on
+    env.host_string as a sparse tar, compressed with zstd. GNU tar finds
+    the holes with SEEK_HOLE and recreates them when it extracts, and the
+    host unpacks the stream as it arrives, so nothing but the image itself
+    is written there. Symlinks are followed, like rsync -L, but the image
+    keeps the name it has in local_path. """
+    local_dir, name = os.path.split(os.path.abspath(local_path))
+    remote_command = f"zstd -dq | tar -xSf - -C {remote_dir}"
+    return (f"set -o pipefail; tar -chSf - -C {shlex.quote(local_dir)} {shlex.quote(name)} "
+            f"| zstd -{ZSTD_LEVEL} -T0 -q | {fabric_ssh_command()} {shlex.quote(remote_command)}")
@@ -0,0 +1,172 @@
+""" Runs the passes of FireSimTopologyWithPasses in dependency order. """
+
+from __future__ import annotations
+
+import logging
+import os
+import pprint
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+from typing import Any, Callable, Dict, List, Sequence, Set, Tuple
+
+rootLogger = logging.getLogger()
+
+class TopologyPass:
+    """ A pass and the artifacts it reads and writes.
+
+    Attributes:
+        func: the pass. Required inputs are passed to it as keyword arguments
+        requires: names of the artifacts the pass reads
+        provides: names of the artifacts the pass writes
+        threadsafe: if True, the pass may run on a worker thread alongside
+            other passes. Otherwise it runs on the calling thread
+    """
+    func: Callable[..., Any]
+    requires: Tuple[str, ...]
+    provides: Tuple[str, ...]
+    threadsafe: bool
+
+    def __init__(self, func: Callable[..., Any], requires: Sequence[str], provides: Sequence[str], threadsafe: bool) -> None:
+        self.func = func
+        self.requires = tuple(requires)
+        self.provides = tuple(provides)
+        self.threadsafe = threadsafe
+
+    @property
+    def name(self) -> str:
+        return self.func.__name__
+
+class PassManager:
+    """ Runs passes in dependency order.
+
+    An artifact is a named piece of state, either written by exactly one
+    pass or an input given to run(). Running a pass first runs the passes
+    that write what it requires. A pass is skipped if nothing it requires
+    changed since it last ran, so e.g. a pass that requires nothing runs
+    once. Passes that don't depend on each other run concurrently, as far
+    as their threadsafe flags allow. """
+    passes: Dict[str, TopologyPass]
+    producers: Dict[str, str]
+    inputs: Dict[str, Any]
+    # bumped every time an artifact is written or an input changes
+    versions: Dict[str, int]
+    # versions of its requirements when each pass last ran
+    last_run: Dict[str, Tuple[int, ...]]
+    # seconds taken by the last run of each pass
+    timings: Dict[str, float]
+    max_workers: int
+
+    def __init__(self, max_workers: int = 0) -> None:
+        self.passes = {}
+        self.producers = {}
+        self.inputs = {}
+        self.versions = {}
+        self.last_run = {}
+        self.timings = {}
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def add_pass(self, func: Callable[..., Any], requires: Sequence[str] = (), provides: Sequence[str] = (), threadsafe: bool = False) -> None:
+        topology_pass = TopologyPass(func, requires, provides, threadsafe)
+        assert topology_pass.name not in self.passes, f"Pass {topology_pass.name} added twice"
+        for artifact in topology_pass.provides:
+            assert artifact not in self.producers, f"{artifact} is provided by both {self.producers[artifact]} and {topology_pass.name}"
+            self.producers[artifact] = topology_pass.name
+        self.passes[topology_pass.name] = topology_pass
+
+    def set_input(self, name: str, value: Any) -> None:
+        assert name not in self.producers, f"{name} is provided by {self.producers[name]}, not an input"
+        if name not in self.inputs or self.inputs[name] != value:
+            self.inputs[name] = value
+            self.invalidate(name)
+
+    def invalidate(self, artifact: str) -> None:
+        """ Mark an artifact as changed, e.g. when something other than its
+        pass modified the state it names. """
+        self.versions[artifact] = self.versions.get(artifact, 0) + 1
+
+    def is_current(self, name: str) -> bool:
+        """ Return True if the pass has run since its requirements last changed. """
+        return self.last_run.get(name) == self.requirement_versions(name)
+
+    def requirement_versions(self, name: str) -> Tuple[int, ...]:
+        return tuple(self.versions.get(x, 0) for x in self.passes[name].requires)
+
+    def schedule(self, names: Sequence[str]) -> List[str]:
+        """ Return names and the passes they transitively depend on, with
+        every pass after its dependencies. """
+        order: List[str] = []
+        visiting: Set[str] = set()
+
+        def visit(name: str) -> None:
+            if name in order:
+                return
+            assert name not in visiting, f"Dependency cycle through pass {name}"
+            visiting.add(name)
+            for artifact in self.passes[name].requires:
+                if artifact in self.producers:
+                    visit(self.producers[artifact])
+                else:
+                    assert artifact in self.inputs, f"Pass {name} requires input {artifact}, which was not given"
+            visiting.remove(name)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order
+
+    def run_pass(self, name: str) -> bool:
+        """ Run a pass unless it is current. Return True if it ran. """
+        if self.is_current(name):
+            rootLogger.debug(f"Skipping {name}, nothing it requires changed since it last ran")
+            return False
+        topology_pass = self.passes[name]
+        requirement_versions = self.requirement_versions(name)
+        kwargs = {x: self.inputs[x] for x in topology_pass.requires if x in self.inputs}
+        start = time.perf_counter()
+        topology_pass.func(**kwargs)
+        self.timings[name] = time.perf_counter() - start
+        self.last_run[name] = requirement_versions
+        for artifact in topology_pass.provides:
+            self.invalidate(artifact)
+        return True
+
+    def run(self, *names: str, **inputs: Any) -> None:
+        """ Set inputs, then run the named passes and everything they depend
+        on. Independent threadsafe passes run on a thread pool while the
+        others run one at a time on this thread. """
+        for name, value in inputs.items():
+            self.set_input(name, value)
+
+        pending = self.schedule(names)
+        dependencies = {name: set(self.producers[x] for x in self.passes[name].requires if x in self.producers) for name in pending}
+        done: Set[str] = set()
+        ran: List[str] = []
+        running: Dict[Future, str] = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [x for x in pending if dependencies[x] <= done]
+                for name in ready:
+                    if self.passes[name].threadsafe:
+                        pending.remove(name)
+                        running[executor.submit(self.run_pass, name)] = name
+                inline = [x for x in ready if not self.passes[x].threadsafe]
+                if inline:
+                    pending.remove(inline[0])
+                    if self.run_pass(inline[0]):
+                        ran.append(inline[0])
+                    done.add(inline[0])
+                    finished = [x for x in running if x.done()]
+                elif running:
+                    finished = list(wait(running, return_when=FIRST_COMPLETED).done)
+                else:
+                    assert False, f"Passes {pending} can never run"
+                for future in finished:
+                    name = running.pop(future)
+                    if future.result():
+                        ran.append(name)
+                    done.add(name)
+
+        timings = {x: round(self.timings[x], 4) for x in ran}
+        rootLogger.debug(f"Passes took {time.perf_counter() - start:.3f}s, per pass (s): " + pprint.pformat(timings))
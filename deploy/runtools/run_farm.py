@@ -21,6 +21,7 @@ from typing import Any, Dict, Optional, List, Union, Set, Type, Tuple, TYPE_CHEC
 from mypy_boto3_ec2.service_resource import Instance as EC2InstanceResource
 if TYPE_CHECKING:
     from runtools.firesim_topology_elements import FireSimSwitchNode, FireSimServerNode
+    from runtools.host_capabilities import HostCapabilities
 
 rootLogger = logging.getLogger()
 
@@ -32,6 +33,7 @@ class Inst(metaclass=abc.ABCMeta):
         MAX_SWITCH_SLOTS_ALLOWED: max switch slots allowed (hardcoded)
         switch_slots: switch node slots
         _next_switch_port: next switch port to assign
+        _next_unix_socket_id: next unix socket number to assign
         MAX_SIM_SLOTS_ALLOWED: max simulations allowed. given by `config_runfarm.yaml`
         sim_slots: simulation node slots
         sim_dir: name of simulation directory on the run host
@@ -47,6 +49,7 @@ class Inst(metaclass=abc.ABCMeta):
     MAX_SWITCH_SLOTS_ALLOWED: int = 1000
     switch_slots: List[FireSimSwitchNode]
     _next_switch_port: int
+    _next_unix_socket_id: int
 
     # simulation variables (e.g. maximum supported number of {fpga,meta}-sims)
     MAX_SIM_SLOTS_ALLOWED: int
@@ -59,6 +62,9 @@ class Inst(metaclass=abc.ABCMeta):
 
     host: Optional[str]
 
+    # probed when the host is first reached in a manager command
+    capabilities: Optional[HostCapabilities]
+
     metasimulation_enabled: bool
 
     def __init__(self, run_farm: RunFarm, max_sim_slots_allowed: int, instance_deploy_manager: Type[InstanceDeployManager], sim_dir: Optional[str] = None, metasimulation_enabled: bool = False) -> None:
@@ -68,6 +74,7 @@ class Inst(metaclass=abc.ABCMeta):
 
         self.switch_slots = []
         self._next_switch_port = 10000 # track ports to allocate for server switch model ports
+        self._next_unix_socket_id = 0
 
         self.MAX_SIM_SLOTS_ALLOWED = max_sim_slots_allowed
         self.sim_slots = []
@@ -78,6 +85,7 @@ class Inst(metaclass=abc.ABCMeta):
         self.instance_deploy_manager = instance_deploy_manager(self)
 
         self.host = None
+        self.capabilities = None
 
     def set_sim_dir(self, drctry: str) -> None:
         self.sim_dir = drctry
@@ -99,9 +107,14 @@ class Inst(metaclass=abc.ABCMeta):
         self.switch_slots.append(firesimswitchnode)
         firesimswitchnode.assign_host_instance(self)
 
-    def allocate_host_port(self) -> int:
+    def allocate_host_port(self, transport: str = 'tcp') -> int:
         """ Allocate a port to use for something on the host. Successive calls
-        will return a new port. """
+        will return a new port. Unix sockets are numbered separately, so they
+        don't use up the TCP ports the security groups allow. """
+        if transport == 'unix':
+            retport = self._next_unix_socket_id
+            self._next_unix_socket_id += 1
+            return retport
         retport = self._next_switch_port
         assert retport < 11000, "Exceeded number of ports used on host. You will need to modify your security groups to increase this value."
         self._next_switch_port += 1
@@ -170,10 +183,10 @@ class RunFarm(metaclass=abc.ABCMeta):
         self.SORTED_SIM_HOST_HANDLE_TO_MAX_FPGA_SLOTS = invert_filter_sort(self.SIM_HOST_HANDLE_TO_MAX_FPGA_SLOTS)
         self.SORTED_SIM_HOST_HANDLE_TO_MAX_METASIM_SLOTS = invert_filter_sort(self.SIM_HOST_HANDLE_TO_MAX_METASIM_SLOTS)
 
-    def get_smallest_sim_host_handle(self, num_sims: int) -> str:
-        """Return the smallest run host handle (unique string to identify a run host type) that
-        supports greater than or equal to num_sims simulations AND has available run hosts
-        of that type (according to run host counts you've specified in config_run_farm.ini).
+    def get_available_sim_host_handles(self) -> List[Tuple[int, str]]:
+        """Return (max simulations, run host handle) pairs for every run host type
+        that supports simulations AND still has unallocated run hosts, sorted by
+        max simulations (smallest first).
         """
         sorted_slots = None
         if self.metasimulation_enabled:
@@ -181,16 +194,24 @@ class RunFarm(metaclass=abc.ABCMeta):
         else:
             sorted_slots = self.SORTED_SIM_HOST_HANDLE_TO_MAX_FPGA_SLOTS
 
+        available = []
         for max_simcount, sim_host_handle in sorted_slots:
-            if max_simcount < num_sims:
-                # instance doesn't support enough sims
-                continue
             num_consumed = self.mapper_consumed[sim_host_handle]
             num_allocated = len(self.run_farm_hosts_dict[sim_host_handle])
             if num_consumed >= num_allocated:
-                # instance supports enough sims but none are available
+                # none of this instance type are available
                 continue
-            return sim_host_handle
+            available.append((max_simcount, sim_host_handle))
+        return available
+
+    def get_smallest_sim_host_handle(self, num_sims: int) -> str:
+        """Return the smallest run host handle (unique string to identify a run host type) that
+        supports greater than or equal to num_sims simulations AND has available run hosts
+        of that type (according to run host counts you've specified in config_run_farm.ini).
+        """
+        for max_simcount, sim_host_handle in self.get_available_sim_host_handles():
+            if max_simcount >= num_sims:
+                return sim_host_handle
 
         rootLogger.critical(f"ERROR: No hosts are available to satisfy the request for a host with support for {num_sims} simulation slots. Add more hosts in your run farm configuration (e.g., config_runtime.yaml).")
         raise Exception
@@ -10,29 +10,44 @@ from fabric.api import prefix, local, run, env, cd, warn_only, put, settings, hi
 from fabric.contrib.project import rsync_project # type: ignore
 from os.path import join as pjoin
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 
 from util.streamlogger import StreamLogger
 from awstools.awstools import terminate_instances, get_instance_ids_for_instances
-from runtools.utils import has_sudo
+from runtools.utils import has_sudo as probe_sudo
+from runtools.host_capabilities import PROBED_MODULES
+from runtools.image_transfer import manager_has_zstd, sparse_upload_command
+from runtools.artifact_store import ArtifactDigestCache, ARTIFACT_DIGESTS_PATH, EXTRACTED_SUFFIX, manifest_command, parse_manifest, evict_command
 
-from typing import List, Dict, Optional, Union, Tuple, TYPE_CHECKING
+from typing import Callable, List, Dict, Optional, Set, Union, Tuple, Sequence, TYPE_CHECKING
 if TYPE_CHECKING:
     from runtools.run_farm import Inst
+    from runtools.firesim_topology_elements import FireSimServerNode, FireSimSwitchNode
+    from runtools.ssh_pool import SSHConnectionPool
     from awstools.awstools import MockBoto3Instance
 
 rootLogger = logging.getLogger()
 
+# suffix of the read-only image a slot's rootfs overlay is backed by, next to
+# the overlay
+ROOTFS_BACKING_SUFFIX = ".backing"
+
 class NBDTracker:
     """Track allocation of NBD devices on an instance. Used for mounting
     qcow2 images."""
 
+    __slots__ = ('next_nbd', 'allocated_dict')
+
     # max number of NBDs allowed by the nbd.ko kernel module
     NBDS_MAX: int = 128
-    unallocd: List[str]
+    next_nbd: int
     allocated_dict: Dict[str, str]
 
     def __init__(self) -> None:
-        self.unallocd = ["""/dev/nbd{}""".format(x) for x in range(self.NBDS_MAX)]
+        # devices are handed out in order, so only the next index is kept
+        # rather than a list of all unallocated device names
+        self.next_nbd = 0
 
         # this is a mapping from .qcow2 image name to nbd device.
         self.allocated_dict = {}
@@ -46,11 +61,84 @@ class NBDTracker:
         THIS DOES NOT CALL qemu-nbd to actually connect the image to the device"""
         if imagename not in self.allocated_dict.keys():
             # otherwise, allocate it
-            assert len(self.unallocd) >= 1, "No NBDs left to allocate on this instance."
-            self.allocated_dict[imagename] = self.unallocd.pop(0)
+            assert self.next_nbd < self.NBDS_MAX, "No NBDs left to allocate on this instance."
+            self.allocated_dict[imagename] = """/dev/nbd{}""".format(self.next_nbd)
+            self.next_nbd += 1
 
         return self.allocated_dict[imagename]
 
+class CopyBackQueue:
+    """Copy back the results of finished jobs in the background, on a few
+    worker threads per host, so that monitoring continues meanwhile. Copies
+    only reach hosts through the SSH connection pool, see
+    FireSimServerNode.copy_back_job_results_from_run.
+
+    A job is only marked complete once its results are copied back. Until
+    then it is in flight: not complete, but not to be queued again.
+
+    The workers belong to the process that made the queue, so a forked
+    fabric task needs its own queue, and must wait on it before it returns."""
+
+    # copies running at once on one host
+    WORKERS_PER_HOST: int = 4
+    ssh_pool: SSHConnectionPool
+    executors: Dict[str, ThreadPoolExecutor]
+    outstanding: Dict[str, List[Future]]
+    # host -> names of the jobs whose copies haven't succeeded yet
+    in_flight: Dict[str, Set[str]]
+    lock: threading.Lock
+    # called from a worker thread after each successful copy
+    on_copied: Optional[Callable[[], None]]
+
+    def __init__(self, ssh_pool: SSHConnectionPool, on_copied: Optional[Callable[[], None]] = None) -> None:
+        self.ssh_pool = ssh_pool
+        self.on_copied = on_copied
+        self.executors = {}
+        self.outstanding = {}
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def submit(self, host: str, server: FireSimServerNode, slotno: int, sudo: bool) -> None:
+        """ Start copying back the results of the job in slotno on host. """
+        jobname = server.get_job_name()
+        with self.lock:
+            self.in_flight.setdefault(host, set()).add(jobname)
+
+        def copy_back() -> None:
+            server.copy_back_job_results_from_run(slotno, sudo, self.ssh_pool)
+            for node in server.get_slot_nodes():
+                node.write_job_complete_file()
+            # a failed copy stays in flight, wait() raises its exception
+            with self.lock:
+                self.in_flight[host].discard(jobname)
+            if self.on_copied is not None:
+                self.on_copied()
+
+        if host not in self.executors:
+            self.executors[host] = ThreadPoolExecutor(self.WORKERS_PER_HOST, thread_name_prefix=f"copy-back-{host}")
+        future = self.executors[host].submit(copy_back)
+        self.outstanding.setdefault(host, []).append(future)
+
+    def is_in_flight(self, host: str, jobname: str) -> bool:
+        with self.lock:
+            return jobname in self.in_flight.get(host, set())
+
+    def has_outstanding(self, host: str) -> bool:
+        return any(not future.done() for future in self.outstanding.get(host, []))
+
+    def wait(self, hosts: Optional[Sequence[str]] = None) -> None:
+        """ Wait for the outstanding copies on hosts (by default, all of
+        them). Raises the exception of a copy that failed. """
+        for host in (list(self.outstanding.keys()) if hosts is None else hosts):
+            for future in self.outstanding.pop(host, []):
+                future.result()
+
+    def shutdown(self) -> None:
+        self.wait()
+        for executor in self.executors.values():
+            executor.shutdown()
+        self.executors = {}
+
 class InstanceDeployManager(metaclass=abc.ABCMeta):
     """Class used to represent different "run platforms" and how to start/stop and setup simulations.
 
@@ -59,6 +147,10 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
     """
     parent_node: Inst
     nbd_tracker: Optional[NBDTracker]
+    # digests of the local files infrasetup copies, shared by all hosts
+    artifact_digests: ArtifactDigestCache = ArtifactDigestCache(ARTIFACT_DIGESTS_PATH)
+    # entries of this host's artifact store, if the manager already listed it
+    store_manifest: Optional[Set[str]]
 
     def __init__(self, parent_node: Inst) -> None:
         """
@@ -70,6 +162,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
         # Set this to self.nbd_tracker = NBDTracker() in the __init__ of your
         # subclass if your system supports the NBD kernel module.
         self.nbd_tracker = None
+        self.store_manifest = None
 
     @abc.abstractmethod
     def infrasetup_instance(self, uridir: str) -> None:
@@ -108,10 +201,36 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
 
     def instance_logger(self, logstr: str, debug: bool = False) -> None:
         """ Log with this host's info as prefix. """
+        # not env.host_string, monitoring also runs outside of fabric tasks
         if debug:
-            rootLogger.debug("""[{}] """.format(env.host_string) + logstr)
+            rootLogger.debug("""[{}] """.format(self.parent_node.host) + logstr)
         else:
-            rootLogger.info("""[{}] """.format(env.host_string) + logstr)
+            rootLogger.info("""[{}] """.format(self.parent_node.host) + logstr)
+
+    def has_sudo(self) -> bool:
+        """ Whether this host allows passwordless sudo. Uses the result of
+        the host's capability probe if it ran in this command. """
+        if self.parent_node.capabilities is not None:
+            return self.parent_node.capabilities.sudo
+        return probe_sudo()
+
+    def module_loaded(self, module: str) -> bool:
+        """ Whether kernel module is loaded on this host. The capability
+        probe only covers PROBED_MODULES, and is kept current by
+        set_module_loaded. """
+        capabilities = self.parent_node.capabilities
+        if capabilities is not None and module in PROBED_MODULES:
+            return module in capabilities.modules
+        return run(f'lsmod | grep -wq {module}', warn_only=True).return_code == 0
+
+    def set_module_loaded(self, module: str, loaded: bool) -> None:
+        """ Record that this host (un)loaded module. """
+        capabilities = self.parent_node.capabilities
+        if capabilities is not None:
+            if loaded:
+                capabilities.modules.add(module)
+            else:
+                capabilities.modules.discard(module)
 
     def sim_node_qcow(self) -> None:
         """ If NBD is available and qcow2 support is required, install qemu-img
@@ -134,6 +253,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             self.instance_logger("Loading NBD Kernel Module.")
             self.unload_nbd_module()
             run(f"""sudo insmod /home/{os.environ['USER']}/nbd.ko nbds_max={self.nbd_tracker.NBDS_MAX}""")
+            self.set_module_loaded('nbd', True)
 
     def unload_nbd_module(self) -> None:
         """ If NBD is available and qcow2 support is required, unload the nbd
@@ -145,6 +265,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             self.disconnect_all_nbds_instance()
             with warn_only():
                 run('sudo rmmod nbd')
+            self.set_module_loaded('nbd', False)
 
     def disconnect_all_nbds_instance(self) -> None:
         """ If NBD is available and qcow2 support is required, disconnect all
@@ -171,46 +292,144 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
 
         return remote_sim_dir
 
-    def copy_sim_slot_infrastructure(self, slotno: int, uridir: str) -> None:
-        """ copy all the simulation infrastructure to the remote node. """
-        if self.instance_assigned_simulations():
-            assert slotno < len(self.parent_node.sim_slots), f"{slotno} can not index into sim_slots {len(self.parent_node.sim_slots)} on {self.parent_node.host}"
-            serv = self.parent_node.sim_slots[slotno]
-
-            self.instance_logger(f"""Copying {self.sim_type_message} simulation infrastructure for slot: {slotno}.""")
-
-            remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
-            remote_sim_rsync_dir = remote_sim_dir + "rsyncdir/"
-            run(f"mkdir -p {remote_sim_rsync_dir}")
-
-            files_to_copy = serv.get_required_files_local_paths()
+    def get_artifact_store_dir(self) -> str:
+        """ Returns the path on the remote of the artifact store, see
+        copy_sim_infrastructure. """
+        return f"{self.parent_node.get_sim_dir()}/artifact_store"
 
-            # Append required URI paths to the end of this list
-            hwcfg = serv.get_resolved_server_hardware_config()
-            files_to_copy.extend(hwcfg.get_local_uri_paths(uridir))
+    def get_incoming_dir(self, digest: str) -> str:
+        """ Returns the dir on the remote that the artifact with digest is
+        uploaded into, before it is published in the store. """
+        return pjoin(self.get_artifact_store_dir(), ".incoming", digest)
 
-            for local_path, remote_path in files_to_copy:
-                # -z --inplace
-                rsync_cap = rsync_project(local_dir=local_path, remote_dir=pjoin(remote_sim_rsync_dir, remote_path),
-                            ssh_opts="-o StrictHostKeyChecking=no", extra_opts="-L", capture=True)
-                rootLogger.debug(rsync_cap)
-                rootLogger.debug(rsync_cap.stderr)
+    def get_sim_slot_files(self, slotno: int, uridir: str) -> List[Tuple[str, str]]:
+        """ Return local and remote paths of all files sim slot slotno needs,
+        the remote paths relative to the slot dir. """
+        serv = self.parent_node.sim_slots[slotno]
+        files_to_copy = serv.get_required_files_local_paths()
 
-            run(f"cp -r {remote_sim_rsync_dir}/* {remote_sim_dir}/", shell=True)
+        # Append required URI paths to the end of this list
+        hwcfg = serv.get_resolved_server_hardware_config()
+        files_to_copy.extend(hwcfg.get_local_uri_paths(uridir))
+        return files_to_copy
+
+    def upload_disk_image(self, local_path: str, remote_dir: str) -> None:
+        """ Copy the disk image at local_path into remote_dir, keeping its
+        holes. Rootfses are mostly empty space, so where both the manager
+        and the host have zstd, the image is streamed through it and
+        unpacked into remote_dir as it arrives (see sparse_upload_command).
+        Otherwise it is rsynced with -S. """
+        capabilities = self.parent_node.capabilities
+        if capabilities is not None and capabilities.has_zstd and manager_has_zstd():
+            local(sparse_upload_command(local_path, remote_dir), shell="/bin/bash")
+        else:
+            rsync_cap = rsync_project(local_dir=local_path, remote_dir=remote_dir + "/",
+                        ssh_opts="-o StrictHostKeyChecking=no", extra_opts="-L -S", capture=True)
+            rootLogger.debug(rsync_cap)
+            rootLogger.debug(rsync_cap.stderr)
 
-    def extract_driver_tarball(self, slotno: int) -> None:
-        """ extract tarball that already exists on the remote node. """
+    def copy_sim_infrastructure(self, uridir: str) -> None:
+        """ copy all the simulation infrastructure to the remote node, and
+        extract the driver tarballs.
+
+        Each host keeps the files it was sent in an artifact store under its
+        sim dir, named by the sha256 of their contents. Only files missing
+        from the store (per its manifest, a listing of the store dir) are
+        uploaded, and a driver tarball is only extracted once, in the store.
+        So an infrasetup with unchanged drivers, bitstreams and rootfses
+        transfers next to nothing. The slot dirs get hardlinks to the
+        stored files, except for rootfses, which simulations write to. Those
+        are copied, as a reflink where the filesystem supports it, or get a
+        qcow2 overlay backed by a hardlink to the stored image (see
+        FireSimServerNode.uses_rootfs_overlay). Rootfses are uploaded with
+        upload_disk_image. """
         if self.instance_assigned_simulations():
-            assert slotno < len(self.parent_node.sim_slots)
-            serv = self.parent_node.sim_slots[slotno]
-
-            hwcfg = serv.get_resolved_server_hardware_config()
-
-            remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
-            options = "-xf"
+            self.instance_logger(f"""Copying {self.sim_type_message} simulation infrastructure for {len(self.parent_node.sim_slots)} slot(s).""")
+            store_dir = self.get_artifact_store_dir()
+            # local path -> digest, for each distinct local file
+            digests: Dict[str, str] = {}
+            extracted_digests: List[str] = []
+            disk_images: Set[str] = set()
+            link_commands = []
+            for slotno, serv in enumerate(self.parent_node.sim_slots):
+                remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
+                link_commands.append(f"mkdir -p {remote_sim_dir}")
 
-            with cd(remote_sim_dir):
-                run(f"tar {options} {hwcfg.get_driver_tar_filename()}")
+                files_to_copy = self.get_sim_slot_files(slotno, uridir)
+                hwcfg = serv.get_resolved_server_hardware_config()
+                rootfs_names = [x for x in serv.get_all_rootfs_names() if x is not None]
+                overlay_names = [x.get_rootfs_name() for x in serv.get_slot_nodes() if x.uses_rootfs_overlay()]
+
+                for local_path, remote_path in files_to_copy:
+                    if local_path not in digests:
+                        digests[local_path] = self.artifact_digests.digest(local_path)
+                    digest = digests[local_path]
+                    stored_path = pjoin(store_dir, digest)
+                    slot_path = pjoin(remote_sim_dir, remote_path if remote_path else os.path.basename(local_path.rstrip('/')))
+
+                    if remote_path in rootfs_names and os.path.isfile(local_path):
+                        disk_images.add(local_path)
+                    if remote_path in overlay_names:
+                        # the overlay is backed by a hardlink to the stored
+                        # image in the slot dir, which is never written to.
+                        # the link pins the image: evicting it from the store
+                        # doesn't pull it from under an overlay
+                        backing_path = slot_path + ROOTFS_BACKING_SUFFIX
+                        link_commands.append(f"rm -rf {slot_path} {backing_path} && ln {stored_path} {backing_path} "
+                                             f"&& qemu-img create -q -f qcow2 -F raw -b {os.path.basename(backing_path)} {slot_path}")
+                        continue
+                    link = "cp -r --reflink=auto" if remote_path in rootfs_names else "cp -rl"
+                    link_commands.append(f"rm -rf {slot_path} && mkdir -p {os.path.dirname(slot_path)} && {link} {stored_path} {slot_path}")
+
+                    if remote_path == hwcfg.get_driver_tar_filename():
+                        if digest not in extracted_digests:
+                            extracted_digests.append(digest)
+                        link_commands.append(f"cp -rlf {stored_path}{EXTRACTED_SUFFIX}/. {remote_sim_dir}")
+
+            manifest = self.store_manifest
+            if manifest is None:
+                manifest = parse_manifest(run(manifest_command(store_dir)))
+            # identical files at different local paths are only sent once
+            missing = {digest: local_path for local_path, digest in digests.items() if digest not in manifest}
+            self.instance_logger(f"""Uploading {len(missing)} of {len(set(digests.values()))} distinct file(s), the rest are in the artifact store.""", debug=True)
+
+            publish_commands = []
+            uploaded_paths = {digest: pjoin(self.get_incoming_dir(digest), os.path.basename(local_path.rstrip('/'))) for digest, local_path in missing.items()}
+            # sizes and mtimes of what an interrupted infrasetup or
+            # --broadcastfanout already uploaded. rsync checks those itself
+            uploaded: Dict[str, Tuple[int, int]] = {}
+            if missing:
+                stat_output = run("mkdir -p " + " ".join(self.get_incoming_dir(digest) for digest in missing)
+                                  + " && stat -L -c '%n %s %Y' " + " ".join(uploaded_paths.values()) + " 2>/dev/null; true")
+                for line in stat_output.splitlines():
+                    fields = line.rsplit(maxsplit=2)
+                    if len(fields) == 3 and fields[1].isdigit() and fields[2].isdigit():
+                        uploaded[fields[0]] = (int(fields[1]), int(fields[2]))
+            for digest, local_path in missing.items():
+                incoming_dir = self.get_incoming_dir(digest)
+                uploaded_path = uploaded_paths[digest]
+                if local_path in disk_images:
+                    local_stat = os.stat(local_path)
+                    if uploaded.get(uploaded_path) != (local_stat.st_size, int(local_stat.st_mtime)):
+                        self.upload_disk_image(local_path, incoming_dir)
+                else:
+                    # -z --inplace
+                    rsync_cap = rsync_project(local_dir=local_path, remote_dir=incoming_dir + "/",
+                                ssh_opts="-o StrictHostKeyChecking=no", extra_opts="-L", capture=True)
+                    rootLogger.debug(rsync_cap)
+                    rootLogger.debug(rsync_cap.stderr)
+                # another manager may have published it meanwhile
+                publish_commands.append(f"{{ [ -e {pjoin(store_dir, digest)} ] || mv -T {uploaded_path} {pjoin(store_dir, digest)}; }} && rm -rf {incoming_dir}")
+            for digest in extracted_digests:
+                if digest + EXTRACTED_SUFFIX not in manifest:
+                    extracting_dir = self.get_incoming_dir(digest + EXTRACTED_SUFFIX)
+                    extracted_dir = pjoin(store_dir, digest + EXTRACTED_SUFFIX)
+                    publish_commands.append(f"rm -rf {extracting_dir} && mkdir -p {extracting_dir} && tar -xf {pjoin(store_dir, digest)} -C {extracting_dir} "
+                                            f"&& {{ [ -e {extracted_dir} ] || mv -T {extracting_dir} {extracted_dir}; }} && rm -rf {extracting_dir}")
+
+            used = sorted(set(digests.values()))
+            touch_command = "touch -c " + " ".join(pjoin(store_dir, digest) for digest in used)
+            run(" && ".join(publish_commands + link_commands + [touch_command]) + f" && ( {evict_command(store_dir, used)} )")
 
     def copy_switch_slot_infrastructure(self, switchslot: int) -> None:
         """ copy all the switch infrastructure to the remote node. """
@@ -226,6 +445,14 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             for local_path, remote_path in files_to_copy:
                 put(local_path, pjoin(remote_switch_dir, remote_path), mirror_local_mode=True)
 
+    def infrasetup_switches_instance(self, switches: Sequence[FireSimSwitchNode]) -> None:
+        """ Copy only the infrastructure of the given switches to this host,
+        e.g. when their configs changed because a neighboring host was
+        remapped. Other switch slots are left alone. """
+        if self.instance_assigned_switches():
+            for slotno, switch in enumerate(self.parent_node.switch_slots):
+                if switch in switches:
+                    self.copy_switch_slot_infrastructure(slotno)
 
     def start_switch_slot(self, switchslot: int) -> None:
         """ start a switch simulation. """
@@ -236,7 +463,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             assert switchslot < len(self.parent_node.switch_slots)
             switch = self.parent_node.switch_slots[switchslot]
             with cd(remote_switch_dir):
-                run(switch.get_switch_start_command(has_sudo()))
+                run(switch.get_switch_start_command(self.has_sudo()))
 
     def start_sim_slot(self, slotno: int) -> None:
         """ start a simulation. """
@@ -249,7 +476,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
 
             # make the local job results dir for this sim slot
             server.mkdir_and_prep_local_job_results_dir()
-            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and has_sudo()), f"+slotid={slotno}")
+            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and self.has_sudo()), f"+slotid={slotno}")
             put(sim_start_script_local_path, remote_sim_dir)
 
             with cd(remote_sim_dir):
@@ -264,7 +491,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             assert switchslot < len(self.parent_node.switch_slots)
             switch = self.parent_node.switch_slots[switchslot]
             with warn_only():
-                if has_sudo():
+                if self.has_sudo():
                     run("sudo " + switch.get_switch_kill_command())
                 else:
                     run(switch.get_switch_kill_command())
@@ -276,7 +503,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             assert slotno < len(self.parent_node.sim_slots), f"{slotno} can not index into sim_slots {len(self.parent_node.sim_slots)} on {self.parent_node.host}"
             server = self.parent_node.sim_slots[slotno]
             with warn_only():
-                if has_sudo():
+                if self.has_sudo():
                     run("sudo " + server.get_sim_kill_command(slotno))
                 else:
                     run(server.get_sim_kill_command(slotno))
@@ -290,7 +517,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
         return len(self.parent_node.switch_slots) != 0
 
     def remove_shm_files(self) -> None:
-        if has_sudo():
+        if self.has_sudo():
             run("sudo rm -rf /dev/shm/*")
         else:
             run("find /dev/shm -user $UID -exec rm -rf {} \;")
@@ -327,42 +554,84 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             # disconnect all NBDs
             self.disconnect_all_nbds_instance()
 
+    @staticmethod
+    def parse_screen_status(collect: str) -> Dict[str, List[str]]:
+        """ Parse the output of screen -ls into the sim slots and switches
+        running on a host. """
+        simdrivers = []
+        switches = []
+        for line in collect.splitlines():
+            if "(Detached)" in line or "(Attached)" in line:
+                line_stripped = line.strip()
+                if "fsim" in line:
+                    re_search_results = re.search('fsim([0-9][0-9]*)', line_stripped)
+                    assert re_search_results is not None
+                    line_stripped = re_search_results.group(0)
+                    line_stripped = line_stripped.replace('fsim', '')
+                    simdrivers.append(line_stripped)
+                elif "switch" in line:
+                    re_search_results = re.search('switch([0-9][0-9]*)', line_stripped)
+                    assert re_search_results is not None
+                    line_stripped = re_search_results.group(0)
+                    switches.append(line_stripped)
+        return {'switches': switches, 'simdrivers': simdrivers}
+
     def running_simulations(self) -> Dict[str, List[str]]:
         """ collect screen results from this host to see what's running on it.
         """
-        simdrivers = []
-        switches = []
         with settings(warn_only=True), hide('everything'):
             collect = run('screen -ls')
-            for line in collect.splitlines():
-                if "(Detached)" in line or "(Attached)" in line:
-                    line_stripped = line.strip()
-                    if "fsim" in line:
-                        re_search_results = re.search('fsim([0-9][0-9]*)', line_stripped)
-                        assert re_search_results is not None
-                        line_stripped = re_search_results.group(0)
-                        line_stripped = line_stripped.replace('fsim', '')
-                        simdrivers.append(line_stripped)
-                    elif "switch" in line:
-                        re_search_results = re.search('switch([0-9][0-9]*)', line_stripped)
-                        assert re_search_results is not None
-                        line_stripped = re_search_results.group(0)
-                        switches.append(line_stripped)
-        return {'switches': switches, 'simdrivers': simdrivers}
+        return self.parse_screen_status(collect)
+
+    def monitor_requires_remote_work(self,
+            prior_completed_jobs: List[str],
+            is_final_loop: bool,
+            is_networked: bool,
+            terminateoncompletion: bool,
+            screen_status: Dict[str, List[str]]) -> bool:
+        """ Return True if monitor_jobs_instance, given screen_status, would
+        do more on this host than report it and queue copy-backs: kill
+        switches or terminate the host. Otherwise it can run outside of a
+        fabric task. """
+        if is_final_loop:
+            return True
+        if not self.instance_assigned_simulations():
+            # switch-only hosts only report their switches until the final
+            # loop. hosts without anything mapped to them are left to the
+            # fabric task
+            return not self.instance_assigned_switches()
+
+        jobnames = [slot.get_job_name() for slot in self.parent_node.sim_slots]
+        if all([(job in prior_completed_jobs) for job in jobnames]):
+            return terminateoncompletion and not is_networked
+
+        # newly completed jobs are only queued for copy-back, unless they
+        # are the last ones on the host
+        now_completed = [jobname for slotno, jobname in enumerate(jobnames)
+                         if (str(slotno) not in screen_status['simdrivers']) or (jobname in prior_completed_jobs)]
+        if len(now_completed) < len(jobnames):
+            return False
+        return self.instance_assigned_switches() or (terminateoncompletion and not is_networked)
 
     def monitor_jobs_instance(self,
             prior_completed_jobs: List[str],
             is_final_loop: bool,
             is_networked: bool,
             terminateoncompletion: bool,
-            job_results_dir: str) -> Dict[str, Dict[str, bool]]:
-        """ Job monitoring for this host. """
+            job_results_dir: str,
+            copy_back_queue: CopyBackQueue,
+            screen_status: Optional[Dict[str, List[str]]] = None) -> Dict[str, Dict[str, bool]]:
+        """ Job monitoring for this host. Results of newly completed jobs
+        are copied back through copy_back_queue, and waited on before the
+        host's switches are killed or it is terminated. screen_status is the
+        result of running_simulations(), if it was already collected. """
         self.instance_logger(f"Final loop?: {is_final_loop} Is networked?: {is_networked} Terminateoncomplete: {terminateoncompletion}", debug=True)
         self.instance_logger(f"Prior completed jobs: {prior_completed_jobs}", debug=True)
 
         def do_terminate():
             if (not is_networked) or (is_networked and is_final_loop):
                 if terminateoncompletion:
+                    copy_back_queue.wait([self.parent_node.get_host()])
                     self.terminate_instance()
 
 
@@ -384,7 +653,9 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
                 return {'switches': {}, 'sims': {}}
             else:
                 # get the status of the switch sims
-                switchescompleteddict = {k: False for k in self.running_simulations()['switches']}
+                if screen_status is None:
+                    screen_status = self.running_simulations()
+                switchescompleteddict = {k: False for k in screen_status['switches']}
                 for switchsim in self.parent_node.switch_slots:
                     swname = switchsim.switch_builder.switch_binary_name()
                     if swname not in switchescompleteddict.keys():
@@ -414,7 +685,7 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
                 return {'sims': jobnames_to_completed, 'switches': {}}
 
             # at this point, all jobs are NOT completed. so, see how they're doing now:
-            instance_screen_status = self.running_simulations()
+            instance_screen_status = screen_status if screen_status is not None else self.running_simulations()
 
             switchescompleteddict = {k: False for k in instance_screen_status['switches']}
             slotsrunning = [x for x in instance_screen_status['simdrivers']]
@@ -431,18 +702,22 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             # fill in whether sims have terminated
             completed_jobs = prior_completed_jobs.copy() # create local copy to append to
             for slotno, jobname in enumerate(jobnames):
+                if copy_back_queue.is_in_flight(self.parent_node.get_host(), jobname):
+                    # its results are still being copied back
+                    continue
                 if (str(slotno) not in slotsrunning) and (jobname not in completed_jobs):
                     self.instance_logger(f"Slot {slotno}, Job {jobname} completed!")
                     completed_jobs.append(jobname)
 
-                    # this writes the job monitoring file
-                    sim_slots[slotno].copy_back_job_results_from_run(slotno, has_sudo())
+                    # this writes the job monitoring file once the copy is done
+                    copy_back_queue.submit(self.parent_node.get_host(), sim_slots[slotno], slotno, self.has_sudo())
 
             jobs_complete_dict = {job: job in completed_jobs for job in jobnames}
             now_all_jobs_complete = all(jobs_complete_dict.values())
             self.instance_logger(f"Now done?: {now_all_jobs_complete}", debug=True)
 
             if now_all_jobs_complete:
+                copy_back_queue.wait([self.parent_node.get_host()])
                 if self.instance_assigned_switches():
                     # we have switches running here, so kill them,
                     # then copy off their logs. this handles the case where you
@@ -545,6 +820,7 @@ class EC2InstanceDeployManager(InstanceDeployManager):
                 remote_kmsg("removing_xdma_start")
                 run('sudo rmmod xdma')
                 remote_kmsg("removing_xdma_end")
+            self.set_module_loaded('xdma', False)
 
             #self.instance_logger("Waiting 10 seconds after removing kernel modules (esp. xocl).")
             #time.sleep(10)
@@ -606,6 +882,7 @@ class EC2InstanceDeployManager(InstanceDeployManager):
             self.instance_logger("Loading XDMA Driver Kernel Module.")
             # TODO: can make these values automatically be chosen based on link lat
             run(f"sudo insmod /home/{os.environ['USER']}/xdma/linux_kernel_drivers/xdma/xdma.ko poll_mode=1")
+            self.set_module_loaded('xdma', True)
 
     def start_ila_server(self) -> None:
         """ start the vivado hw_server and virtual jtag on simulation instance. """
@@ -632,10 +909,12 @@ class EC2InstanceDeployManager(InstanceDeployManager):
         if self.instance_assigned_simulations():
             # This is a sim-host node.
 
+            # setup nbd/qcow infra. before copying, which creates any rootfs
+            # overlays with qemu-img
+            self.sim_node_qcow()
+
             # copy sim infrastructure
-            for slotno in range(len(self.parent_node.sim_slots)):
-                self.copy_sim_slot_infrastructure(slotno, uridir)
-                self.extract_driver_tarball(slotno)
+            self.copy_sim_infrastructure(uridir)
 
             if not metasim_enabled:
                 self.get_and_install_aws_fpga_sdk()
@@ -646,8 +925,6 @@ class EC2InstanceDeployManager(InstanceDeployManager):
                 # load xdma
                 self.load_xdma()
 
-            # setup nbd/qcow infra
-            self.sim_node_qcow()
             # load nbd module
             self.load_nbd_module()
 
@@ -734,9 +1011,7 @@ class VitisInstanceDeployManager(InstanceDeployManager):
             # This is a sim-host node.
 
             # copy sim infrastructure
-            for slotno in range(len(self.parent_node.sim_slots)):
-                self.copy_sim_slot_infrastructure(slotno, uridir)
-                self.extract_driver_tarball(slotno)
+            self.copy_sim_infrastructure(uridir)
 
             if not self.parent_node.metasimulation_enabled:
                 # clear/flash fpgas
@@ -768,7 +1043,7 @@ class VitisInstanceDeployManager(InstanceDeployManager):
 
             # make the local job results dir for this sim slot
             server.mkdir_and_prep_local_job_results_dir()
-            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and has_sudo()), extra_args)
+            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and self.has_sudo()), extra_args)
             put(sim_start_script_local_path, remote_sim_dir)
 
             with cd(remote_sim_dir):
@@ -801,10 +1076,11 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
         """ load the xdma kernel module. """
         if self.instance_assigned_simulations():
             # load xdma if unloaded
-            if run('lsmod | grep -wq xdma', warn_only=True).return_code != 0:
+            if not self.module_loaded('xdma'):
                 self.instance_logger("Loading XDMA Driver Kernel Module.")
                 # must be installed to this path on sim. machine
                 run(f"sudo insmod /lib/modules/$(uname -r)/extra/xdma.ko poll_mode=1", shell=True)
+                self.set_module_loaded('xdma', True)
             else:
                 self.instance_logger("XDMA Driver Kernel Module already loaded.")
 
@@ -812,9 +1088,10 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
         """ unload the xdma kernel module. """
         if self.instance_assigned_simulations():
             # unload xdma if loaded
-            if run('lsmod | grep -wq xdma', warn_only=True).return_code == 0:
+            if self.module_loaded('xdma'):
                 self.instance_logger("Unloading XDMA Driver Kernel Module.")
                 run(f"sudo rmmod xdma", shell=True)
+                self.set_module_loaded('xdma', False)
             else:
                 self.instance_logger("XDMA Driver Kernel Module already unloaded.")
 
@@ -866,9 +1143,7 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
             # This is a sim-host node.
 
             # copy sim infrastructure
-            for slotno in range(len(self.parent_node.sim_slots)):
-                self.copy_sim_slot_infrastructure(slotno, uridir)
-                self.extract_driver_tarball(slotno)
+            self.copy_sim_infrastructure(uridir)
 
             if not metasim_enabled:
                 # unload xdma driver
@@ -970,7 +1245,7 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
 
             # make the local job results dir for this sim slot
             server.mkdir_and_prep_local_job_results_dir()
-            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and has_sudo()), extra_args)
+            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and self.has_sudo()), extra_args)
             put(sim_start_script_local_path, remote_sim_dir)
 
             with cd(remote_sim_dir):
@@ -1015,20 +1290,22 @@ class XilinxVCU118InstanceDeployManager(InstanceDeployManager):
         """ load the xdma kernel module. """
         if self.instance_assigned_simulations():
             # load xdma if unloaded
-            if run('lsmod | grep -wq xdma', warn_only=True).return_code != 0:
+            if not self.module_loaded('xdma'):
                 self.instance_logger("Loading XDMA Driver Kernel Module.")
                 # must be installed to this path on sim. machine
                 run(f"sudo insmod /lib/modules/$(uname -r)/extra/xdma.ko poll_mode=1", shell=True)
+                self.set_module_loaded('xdma', True)
             else:
                 self.instance_logger("XDMA Driver Kernel Module already loaded.")
 
     def load_xvsec(self) -> None:
         """ load the xvsec kernel modules. """
         if self.instance_assigned_simulations():
-            if run('lsmod | grep -wq xvsec', warn_only=True).return_code != 0:
+            if not self.module_loaded('xvsec'):
                 self.instance_logger("Loading XVSEC Driver Kernel Module.")
                 # must be installed to this path on sim. machine
                 run(f"sudo insmod /lib/modules/$(uname -r)/updates/kernel/drivers/xvsec/xvsec.ko", shell=True)
+                self.set_module_loaded('xvsec', True)
             else:
                 self.instance_logger("XVSEC Driver Kernel Module already loaded.")
 
@@ -1069,9 +1346,7 @@ class XilinxVCU118InstanceDeployManager(InstanceDeployManager):
             # This is a sim-host node.
 
             # copy sim infrastructure
-            for slotno in range(len(self.parent_node.sim_slots)):
-                self.copy_sim_slot_infrastructure(slotno, uridir)
-                self.extract_driver_tarball(slotno)
+            self.copy_sim_infrastructure(uridir)
 
             if not self.parent_node.metasimulation_enabled:
                 # load xdma driver
@@ -1113,7 +1388,7 @@ class XilinxVCU118InstanceDeployManager(InstanceDeployManager):
 
             # make the local job results dir for this sim slot
             server.mkdir_and_prep_local_job_results_dir()
-            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and has_sudo()), extra_args)
+            sim_start_script_local_path = server.write_sim_start_script(slotno, (self.sim_command_requires_sudo() and self.has_sudo()), extra_args)
             put(sim_start_script_local_path, remote_sim_dir)
 
             with cd(remote_sim_dir):
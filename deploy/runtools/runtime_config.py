@@ -25,9 +25,12 @@ import json
 from awstools.awstools import aws_resource_names
 from awstools.afitools import get_firesim_deploy_quintuplet_for_agfi, firesim_description_to_tags
 from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+from runtools.firesim_topology_elements import CROSS_HOST_LINK_TRANSPORTS, FireSimLink, FireSimServerNode, FireSimSwitchNode
 from runtools.run_farm_deploy_managers import VitisInstanceDeployManager
 from runtools.workload import WorkloadConfig
 from runtools.run_farm import RunFarm
+from runtools.topology_snapshot import TopologySnapshotCache, WarningRecorder, manager_sources
+from runtools.utils import MacAddress
 from runtools.simulation_data_classes import TracerVConfig, AutoCounterConfig, HostDebugConfig, SynthPrintConfig
 from util.inheritors import inheritors
 from util.deepmerge import deep_merge
@@ -37,12 +40,12 @@ from util.io import downloadURI
 
 from typing import Optional, Dict, Any, List, Sequence, Tuple, TYPE_CHECKING
 import argparse # this is not within a if TYPE_CHECKING: scope so the `register_task` in FireSim can evaluate it's annotation
-if TYPE_CHECKING:
-    from runtools.utils import MacAddress
 
 LOCAL_DRIVERS_BASE = "../sim/output/"
 LOCAL_DRIVERS_GENERATED_SRC = "../sim/generated-src/"
 CUSTOM_RUNTIMECONFS_BASE = "../sim/custom-runtime-configs/"
+TOPOLOGY_SNAPSHOTS_DIR = "topology-snapshots/"
+SIM_PLUSARGS_FILENAME = "sim-plusargs"
 
 rootLogger = logging.getLogger()
 
@@ -323,8 +326,7 @@ class RuntimeHWConfig:
         """
         return self.additional_required_files
 
-    def get_boot_simulation_command(self,
-            slotid: int,
+    def get_sim_plusargs(self,
             all_macs: Sequence[MacAddress],
             all_rootfses: Sequence[Optional[str]],
             all_linklatencies: Sequence[int],
@@ -335,78 +337,82 @@ class RuntimeHWConfig:
             tracerv_config: TracerVConfig,
             autocounter_config: AutoCounterConfig,
             hostdebug_config: HostDebugConfig,
-            synthprint_config: SynthPrintConfig,
+            synthprint_config: SynthPrintConfig) -> List[str]:
+        """ return the per-slot driver arguments that go between +permissive
+        and +permissive-off, one per entry. There is one of most of these per
+        simulated node, so get_boot_simulation_command puts them in a file
+        the driver command line reads, rather than on the command line
+        itself. """
+
+        def array_to_plusargs(valuesarr: Sequence[Optional[Any]], plusarg: str) -> List[str]:
+            return [f"{plusarg}{index}={arg}" for index, arg in enumerate(valuesarr) if arg is not None]
+
+        def array_to_lognames(values: Sequence[Optional[Any]], prefix: str) -> List[str]:
+            return [f"+{prefix}{index}={prefix}{index}" for index, val in enumerate(values) if val is not None]
+
+        # TODO: supernode support (tracefile, trace-select.. etc)
+        plusargs = []
+        if profile_interval != -1:
+            plusargs.append(f"+profile-interval={profile_interval}")
+        if hostdebug_config.zero_out_dram:
+            plusargs.append("+zero-out-dram")
+        if hostdebug_config.disable_synth_asserts:
+            plusargs.append("+disable-asserts")
+        plusargs += array_to_plusargs(all_macs, "+macaddr")
+        plusargs += array_to_plusargs(all_rootfses, "+blkdev")
+        plusargs += array_to_lognames(all_macs, "niclog")
+        plusargs += array_to_lognames(all_rootfses, "blkdev-log")
+        if tracerv_config.enable:
+            plusargs.append("+tracefile=TRACEFILE")
+        plusargs += [f"+trace-select={tracerv_config.select}", f"+trace-start={tracerv_config.start}", f"+trace-end={tracerv_config.end}", f"+trace-output-format={tracerv_config.output_format}"]
+        # TODO supernode support
+        plusargs.append("+dwarf-file-name=" + all_bootbinaries[0] + "-dwarf")
+        plusargs += [f"+autocounter-readrate={autocounter_config.readrate}", "+autocounter-filename-base=AUTOCOUNTERFILE"]
+        if not synthprint_config.cycle_prefix:
+            plusargs.append("+print-no-cycle-prefix")
+        plusargs += [f"+print-start={synthprint_config.start}", f"+print-end={synthprint_config.end}"]
+        plusargs += array_to_plusargs(all_linklatencies, "+linklatency")
+        plusargs += array_to_plusargs(all_netbws, "+netbw")
+        plusargs += array_to_plusargs(all_shmemportnames, "+shmemportname")
+        return plusargs
+
+    def get_boot_simulation_command(self,
+            slotid: int,
+            sim_plusargs: List[str],
+            all_bootbinaries: List[str],
             sudo: bool,
             extra_plusargs: str,
             extra_args: str) -> str:
-        """ return the command used to boot the simulation. this has to have
+        """ return the commands used to boot the simulation, given the
+        arguments from get_sim_plusargs. this has to have
         some external params passed to it, because not everything is contained
         in a runtimehwconfig. TODO: maybe runtimehwconfig should be renamed to
         pre-built runtime config? It kinda contains a mix of pre-built and
         runtime parameters currently. """
 
-        # TODO: supernode support
-        tracefile = "+tracefile=TRACEFILE" if tracerv_config.enable else ""
-        autocounterfile = "+autocounter-filename-base=AUTOCOUNTERFILE"
+        # the plusargs are written to a file in the slot dir, which the
+        # shell expands onto the driver's command line at launch, just like
+        # the runtime conf. they are kept on one line: the expansion happens
+        # inside the script -c command, where a newline would end the driver
+        # call. extra_plusargs come after them, so they can still override
+        # the defaults
+        plusargs_file = "\n".join([f"cat > {SIM_PLUSARGS_FILENAME} << 'PLUSARGS'", " ".join(sim_plusargs), "PLUSARGS"])
 
         # this monstrosity boots the simulator, inside screen, inside script
         # the sed is in there to get rid of newlines in runtime confs
         driver = self.get_local_driver_binaryname()
         runtimeconf = self.get_local_runtimeconf_binaryname()
-
-        def array_to_plusargs(valuesarr: Sequence[Optional[Any]], plusarg: str) -> List[str]:
-            args = []
-            for index, arg in enumerate(valuesarr):
-                if arg is not None:
-                    args.append("""{}{}={}""".format(plusarg, index, arg))
-            return args
-
-        def array_to_lognames(values: Sequence[Optional[Any]], prefix: str) -> List[str]:
-            names = ["{}{}".format(prefix, i) if val is not None else None
-                     for (i, val) in enumerate(values)]
-            return array_to_plusargs(names, "+" + prefix)
-
-        command_macs = array_to_plusargs(all_macs, "+macaddr")
-        command_rootfses = array_to_plusargs(all_rootfses, "+blkdev")
-        command_linklatencies = array_to_plusargs(all_linklatencies, "+linklatency")
-        command_netbws = array_to_plusargs(all_netbws, "+netbw")
-        command_shmemportnames = array_to_plusargs(all_shmemportnames, "+shmemportname")
-
-        command_niclogs = array_to_lognames(all_macs, "niclog")
-        command_blkdev_logs = array_to_lognames(all_rootfses, "blkdev-log")
-
-        command_bootbinaries = array_to_plusargs(all_bootbinaries, "+prog")
-        zero_out_dram = "+zero-out-dram" if (hostdebug_config.zero_out_dram) else ""
-        disable_asserts = "+disable-asserts" if (hostdebug_config.disable_synth_asserts) else ""
-        print_cycle_prefix = "+print-no-cycle-prefix" if not synthprint_config.cycle_prefix else ""
-
-        # TODO supernode support
-        dwarf_file_name = "+dwarf-file-name=" + all_bootbinaries[0] + "-dwarf"
+        runtimeconf_args = f"$(sed \':a;N;$!ba;s/\\n/ /g\' {runtimeconf})" if runtimeconf else ""
 
         screen_name = "fsim{}".format(slotid)
 
-        # TODO: supernode support (tracefile, trace-select.. etc)
-        permissive_driver_args = []
-        permissive_driver_args += [f"$(sed \':a;N;$!ba;s/\\n/ /g\' {runtimeconf})"] if runtimeconf else []
-        if profile_interval != -1:
-            permissive_driver_args += [f"+profile-interval={profile_interval}"]
-        permissive_driver_args += [zero_out_dram]
-        permissive_driver_args += [disable_asserts]
-        permissive_driver_args += command_macs
-        permissive_driver_args += command_rootfses
-        permissive_driver_args += command_niclogs
-        permissive_driver_args += command_blkdev_logs
-        permissive_driver_args += [f"{tracefile}", f"+trace-select={tracerv_config.select}", f"+trace-start={tracerv_config.start}", f"+trace-end={tracerv_config.end}", f"+trace-output-format={tracerv_config.output_format}", dwarf_file_name]
-        permissive_driver_args += [f"+autocounter-readrate={autocounter_config.readrate}", autocounterfile]
-        permissive_driver_args += [print_cycle_prefix, f"+print-start={synthprint_config.start}", f"+print-end={synthprint_config.end}"]
-        permissive_driver_args += command_linklatencies
-        permissive_driver_args += command_netbws
-        permissive_driver_args += command_shmemportnames
-        driver_call = f"""{"sudo" if sudo else ""} ./{driver} +permissive {" ".join(permissive_driver_args)} {extra_plusargs} +permissive-off {" ".join(command_bootbinaries)} {extra_args} """
+        bootbinaries = " ".join(f"+prog{index}={binary}" for index, binary in enumerate(all_bootbinaries))
+
+        driver_call = f"""{"sudo" if sudo else ""} ./{driver} +permissive {runtimeconf_args} $(cat {SIM_PLUSARGS_FILENAME}) {extra_plusargs} +permissive-off {bootbinaries} {extra_args} """
         base_command = f"""script -f -c 'stty intr ^] && {driver_call} && stty intr ^c' uartlog"""
         screen_wrapped = f"""screen -S {screen_name} -d -m bash -c "{base_command}"; sleep 1"""
 
-        return screen_wrapped
+        return plusargs_file + "\n" + screen_wrapped
 
     def get_kill_simulation_command(self) -> str:
         driver = self.get_local_driver_binaryname()
@@ -603,17 +609,8 @@ class RuntimeBuildRecipeConfig(RuntimeHWConfig):
 
     def get_boot_simulation_command(self,
             slotid: int,
-            all_macs: Sequence[MacAddress],
-            all_rootfses: Sequence[Optional[str]],
-            all_linklatencies: Sequence[int],
-            all_netbws: Sequence[int],
-            profile_interval: int,
+            sim_plusargs: List[str],
             all_bootbinaries: List[str],
-            all_shmemportnames: List[str],
-            tracerv_config: TracerVConfig,
-            autocounter_config: AutoCounterConfig,
-            hostdebug_config: HostDebugConfig,
-            synthprint_config: SynthPrintConfig,
             sudo: bool,
             extra_plusargs: str,
             extra_args: str) -> str:
@@ -629,17 +626,8 @@ class RuntimeBuildRecipeConfig(RuntimeHWConfig):
         full_extra_args = " 2> metasim_stderr.out " + extra_args
         return super(RuntimeBuildRecipeConfig, self).get_boot_simulation_command(
             slotid,
-            all_macs,
-            all_rootfses,
-            all_linklatencies,
-            all_netbws,
-            profile_interval,
+            sim_plusargs,
             all_bootbinaries,
-            all_shmemportnames,
-            tracerv_config,
-            autocounter_config,
-            hostdebug_config,
-            synthprint_config,
             sudo,
             full_extra_plusargs,
             full_extra_args)
@@ -695,6 +683,25 @@ class RuntimeBuildRecipes(RuntimeHWDB):
         self.hwconf_dict = {s: RuntimeBuildRecipeConfig(s, v, metasim_host_simulator, metasimulation_only_plusargs, metasimulation_only_vcs_plusargs) for s, v in recipes_dict.items()}
 
 
+def load_runtime_config_dict(runtimeconfigfile: str, configoverridedata: str) -> Dict[str, Any]:
+    """ Load config_runtime.yaml, with the --overrideconfigdata override (if
+    any) applied. """
+    runtime_configfile = None
+    with open(runtimeconfigfile, "r") as yaml_file:
+        runtime_configfile = yaml.safe_load(yaml_file)
+
+    runtime_dict = runtime_configfile
+
+    # override parts of the runtime conf if specified
+    if configoverridedata != "":
+        ## handle overriding part of the runtime conf
+        configoverrideval = configoverridedata.split()
+        overridesection = configoverrideval[0]
+        overridefield = configoverrideval[1]
+        overridevalue = configoverrideval[2]
+        runtime_dict[overridesection][overridefield] = overridevalue
+    return runtime_dict
+
 class InnerRuntimeConfiguration:
     """ Pythonic version of config_runtime.yaml """
     run_farm_requested_name: str
@@ -714,31 +721,27 @@ class InnerRuntimeConfiguration:
     workload_name: str
     suffixtag: str
     terminateoncompletion: bool
+    rootfs_overlays: bool
     metasimulation_enabled: bool
     metasimulation_host_simulator: str
     metasimulation_only_plusargs: str
     metasimulation_only_vcs_plusargs: str
     default_plusarg_passthrough: str
+    switch_config_mode: str
+    cross_host_link_transport: str
+    same_host_link_transport: str
+    topology_diagram: str
+    topology_params: Dict[str, Any]
 
     def __init__(self, runtimeconfigfile: str, configoverridedata: str) -> None:
 
-        runtime_configfile = None
-        with open(runtimeconfigfile, "r") as yaml_file:
-            runtime_configfile = yaml.safe_load(yaml_file)
-
-        runtime_dict = runtime_configfile
+        runtime_dict = load_runtime_config_dict(runtimeconfigfile, configoverridedata)
 
-        # override parts of the runtime conf if specified
         if configoverridedata != "":
-            ## handle overriding part of the runtime conf
-            configoverrideval = configoverridedata.split()
-            overridesection = configoverrideval[0]
-            overridefield = configoverrideval[1]
-            overridevalue = configoverrideval[2]
+            overridesection, overridefield, overridevalue = configoverridedata.split()[:3]
             rootLogger.warning("Overriding part of the runtime config with: ")
             rootLogger.warning("""[{}]""".format(overridesection))
             rootLogger.warning(overridefield + "=" + overridevalue)
-            runtime_dict[overridesection][overridefield] = overridevalue
 
         def dict_assert(key_check, dict_name):
             assert key_check in dict_name, f"FAIL: missing {key_check} in runtime config."
@@ -777,11 +780,27 @@ class InnerRuntimeConfiguration:
 
         self.topology = runtime_dict['target_config']['topology']
         self.no_net_num_nodes = int(runtime_dict['target_config']['no_net_num_nodes'])
+        # optional: keyword arguments for parametric topologies (e.g. fat_tree)
+        self.topology_params = runtime_dict['target_config'].get('topology_params') or {}
+        assert isinstance(self.topology_params, dict), "topology_params must be a mapping of argument names to values"
         self.linklatency = int(runtime_dict['target_config']['link_latency'])
         self.switchinglatency = int(runtime_dict['target_config']['switching_latency'])
         self.netbandwidth = int(runtime_dict['target_config']['net_bandwidth'])
         self.profileinterval = int(runtime_dict['target_config']['profile_interval'])
         self.defaulthwconfig = runtime_dict['target_config']['default_hw_config']
+        # optional: compile_time (default) builds a switch binary per switch,
+        # runtime builds one generic binary that reads a config file per switch
+        self.switch_config_mode = runtime_dict['target_config'].get('switch_config_mode', 'compile_time')
+        assert self.switch_config_mode in ['compile_time', 'runtime'], f"Invalid switch_config_mode: {self.switch_config_mode}. Must be compile_time or runtime."
+        # optional: transports of links between switches on different hosts
+        # (tcp or tcp_tuned) and on the same host (shmem or unix)
+        self.cross_host_link_transport = runtime_dict['target_config'].get('cross_host_link_transport', 'tcp')
+        assert self.cross_host_link_transport in CROSS_HOST_LINK_TRANSPORTS, f"Invalid cross_host_link_transport: {self.cross_host_link_transport}. Must be one of {CROSS_HOST_LINK_TRANSPORTS}."
+        self.same_host_link_transport = runtime_dict['target_config'].get('same_host_link_transport', 'shmem')
+        assert self.same_host_link_transport in ['shmem', 'unix'], f"Invalid same_host_link_transport: {self.same_host_link_transport}. Must be shmem or unix."
+        # optional: auto (default), full, collapsed or none
+        self.topology_diagram = runtime_dict['target_config'].get('topology_diagram', 'auto')
+        assert self.topology_diagram in ['auto', 'full', 'collapsed', 'none'], f"Invalid topology_diagram: {self.topology_diagram}. Must be auto, full, collapsed or none."
 
         self.tracerv_config = TracerVConfig(runtime_dict.get('tracing', {}))
         self.autocounter_config = AutoCounterConfig(runtime_dict.get('autocounter', {}))
@@ -795,6 +814,7 @@ class InnerRuntimeConfiguration:
         # an extra tag to differentiate workloads with the same name in results names
         self.suffixtag = runtime_dict['workload']['suffix_tag'] if 'suffix_tag' in runtime_dict['workload'] else None
         self.terminateoncompletion = runtime_dict['workload']['terminate_on_completion'] == True
+        self.rootfs_overlays = runtime_dict['workload'].get('rootfs_overlays', False) == True
 
     def __str__(self) -> str:
         return pprint.pformat(vars(self))
@@ -810,6 +830,8 @@ class RuntimeConfig:
     workload: WorkloadConfig
     firesim_topology_with_passes: FireSimTopologyWithPasses
     runtime_build_recipes: RuntimeBuildRecipes
+    # warnings logged by phase one
+    warnings: WarningRecorder
 
     def __init__(self, args: argparse.Namespace) -> None:
         """ This reads runtime configuration files, massages them into formats that
@@ -818,6 +840,31 @@ class RuntimeConfig:
 
         self.args = args
 
+        # if none of the inputs to phase one changed since a previous command,
+        # reuse its results instead of rebuilding and remapping the topology
+        snapshot_cache = None
+        if not args.notopologysnapshot:
+            snapshot_cache = TopologySnapshotCache(TOPOLOGY_SNAPSHOTS_DIR)
+            snapshot_key = snapshot_cache.key_for_inputs(*self.topology_snapshot_inputs())
+            snapshot = snapshot_cache.fetch(snapshot_key)
+            if snapshot is not None:
+                self.restore_topology_snapshot(snapshot)
+                rootLogger.debug(f"Reusing topology snapshot {snapshot_cache.entry_path(snapshot_key)}")
+                return
+
+        self.warnings = WarningRecorder()
+        rootLogger.addHandler(self.warnings)
+        try:
+            self.construct_topology(args)
+        finally:
+            rootLogger.removeHandler(self.warnings)
+
+        if snapshot_cache is not None:
+            snapshot_cache.store(snapshot_key, self.topology_snapshot())
+
+    def construct_topology(self, args: argparse.Namespace) -> None:
+        """ Read the config files and run phase one, everything a topology
+        snapshot stands in for. """
         # construct pythonic db of hardware configurations available to us at
         # runtime.
         self.runtimehwdb = RuntimeHWDB(args.hwdbconfigfile)
@@ -836,7 +883,7 @@ class RuntimeConfig:
         # to a server
         if args.task != 'enumeratefpgas':
             self.workload = WorkloadConfig(self.innerconf.workload_name, self.launch_time,
-                                           self.innerconf.suffixtag)
+                                           self.innerconf.suffixtag, self.innerconf.rootfs_overlays)
         else:
             self.workload = WorkloadConfig('dummy.json', self.launch_time,
                                            self.innerconf.suffixtag)
@@ -855,7 +902,62 @@ class RuntimeConfig:
             self.innerconf.terminateoncompletion,
             self.runtime_build_recipes,
             self.innerconf.metasimulation_enabled,
-            self.innerconf.default_plusarg_passthrough)
+            self.innerconf.default_plusarg_passthrough,
+            self.innerconf.switch_config_mode,
+            self.innerconf.topology_diagram,
+            self.innerconf.topology_params,
+            self.innerconf.cross_host_link_transport,
+            self.innerconf.same_host_link_transport)
+
+    def topology_snapshot_inputs(self) -> Tuple[List[str], List[str]]:
+        """ Return the files and other values that phase one depends on. """
+        runtime_dict = load_runtime_config_dict(self.args.runtimeconfigfile, self.args.overrideconfigdata)
+        workload_name = runtime_dict['workload']['workload_name'] if self.args.task != 'enumeratefpgas' else 'dummy.json'
+        # user_topology.py, the passes and everything they use
+        sources = manager_sources(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        paths = [self.args.runtimeconfigfile,
+                 self.args.hwdbconfigfile,
+                 self.args.buildrecipesconfigfile,
+                 runtime_dict['run_farm']['base_recipe'],
+                 WorkloadConfig.workloadinputs + workload_name] + sources
+        extra = [self.args.overrideconfigdata,
+                 os.environ.get('USER', ''),
+                 os.environ.get('FIRESIM_RUNFARM_PREFIX', '')]
+        return paths, extra
+
+    def topology_snapshot(self) -> Dict[str, Any]:
+        """ Everything constructed by __init__, for TopologySnapshotCache. """
+        return {
+            'runtimehwdb': self.runtimehwdb,
+            'innerconf': self.innerconf,
+            'runtime_build_recipes': self.runtime_build_recipes,
+            'workload': self.workload,
+            'firesim_topology_with_passes': self.firesim_topology_with_passes,
+            'next_mac_alloc': MacAddress.next_mac_to_allocate(),
+            'next_link_id': FireSimLink.next_unique_link_identifier,
+            'servers_created': FireSimServerNode.SERVERS_CREATED,
+            'switches_created': FireSimSwitchNode.SWITCHES_CREATED,
+            'warnings': self.warnings.records,
+        }
+
+    def restore_topology_snapshot(self, snapshot: Dict[str, Any]) -> None:
+        self.runtimehwdb = snapshot['runtimehwdb']
+        self.innerconf = snapshot['innerconf']
+        self.runtime_build_recipes = snapshot['runtime_build_recipes']
+        self.run_farm = self.innerconf.run_farm_dispatcher
+        self.workload = snapshot['workload']
+        self.firesim_topology_with_passes = snapshot['firesim_topology_with_passes']
+        # ids handed out after this continue from where phase one left off
+        MacAddress.next_mac_alloc = snapshot['next_mac_alloc']
+        FireSimLink.next_unique_link_identifier = snapshot['next_link_id']
+        FireSimServerNode.SERVERS_CREATED = snapshot['servers_created']
+        FireSimSwitchNode.SWITCHES_CREATED = snapshot['switches_created']
+        self.warnings = WarningRecorder()
+        self.warnings.records = snapshot['warnings']
+        for level, message in self.warnings.records:
+            rootLogger.log(level, message)
+        # results go to a directory named for this command's launch time
+        self.workload.set_launch_time(self.launch_time, self.innerconf.suffixtag)
 
     def launch_run_farm(self) -> None:
         """ directly called by top-level launchrunfarm command. """
@@ -880,12 +982,17 @@ class RuntimeConfig:
 
         self.run_farm.terminate_run_farm(terminate_some_dict, self.args.forceterminate)
 
+    def lost_hosts(self) -> List[str]:
+        """ Run farm hosts given with --losthost, whose simulations and
+        switches should be remapped onto spare hosts. """
+        return self.args.losthost or []
+
     def infrasetup(self) -> None:
         """ directly called by top-level infrasetup command. """
         # set this to True if you want to use mock boto3 instances for testing
         # the manager.
         use_mock_instances_for_testing = False
-        self.firesim_topology_with_passes.infrasetup_passes(use_mock_instances_for_testing)
+        self.firesim_topology_with_passes.infrasetup_passes(use_mock_instances_for_testing, self.lost_hosts(), self.args.broadcastfanout)
 
     def build_driver(self) -> None:
         """ directly called by top-level builddriver command. """
@@ -899,12 +1006,12 @@ class RuntimeConfig:
     def boot(self) -> None:
         """ directly called by top-level boot command. """
         use_mock_instances_for_testing = False
-        self.firesim_topology_with_passes.boot_simulation_passes(use_mock_instances_for_testing)
+        self.firesim_topology_with_passes.boot_simulation_passes(use_mock_instances_for_testing, lost_hosts=self.lost_hosts())
 
     def kill(self) -> None:
         use_mock_instances_for_testing = False
-        self.firesim_topology_with_passes.kill_simulation_passes(use_mock_instances_for_testing)
+        self.firesim_topology_with_passes.kill_simulation_passes(use_mock_instances_for_testing, lost_hosts=self.lost_hosts())
 
     def run_workload(self) -> None:
         use_mock_instances_for_testing = False
-        self.firesim_topology_with_passes.run_workload_passes(use_mock_instances_for_testing)
+        self.firesim_topology_with_passes.run_workload_passes(use_mock_instances_for_testing, self.lost_hosts())
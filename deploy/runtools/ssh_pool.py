@@ -0,0 +1,205 @@
+""" Run commands on many run farm hosts over persistent, multiplexed SSH
+connections. """
+
+from __future__ import annotations
+
+import asyncio
+import atexit
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+from fabric.api import env # type: ignore
+from fabric.network import key_filenames # type: ignore
+
+from typing import Callable, Dict, List, Optional, Sequence, Set, TypeVar
+
+rootLogger = logging.getLogger()
+
+T = TypeVar('T')
+
+class RemoteResult(str):
+    """ Output of a remote command. Like the result of fabric's run(), this
+    is the command's stdout, with the exit code and stderr as attributes. """
+    return_code: int
+    stdout: str
+    stderr: str
+
+    def __new__(cls, stdout: str, stderr: str, return_code: int) -> RemoteResult:
+        result = super().__new__(cls, stdout.rstrip("\n"))
+        result.stdout = stdout.rstrip("\n")
+        result.stderr = stderr.rstrip("\n")
+        result.return_code = return_code
+        return result
+
+    @property
+    def succeeded(self) -> bool:
+        return self.return_code == 0
+
+    @property
+    def failed(self) -> bool:
+        return not self.succeeded
+
+class RemoteCommandError(Exception):
+    """ Raised when a remote operation fails and warn_only isn't set. """
+
+class SSHConnectionPool:
+    """ Keeps one OpenSSH connection (a ControlMaster) open per host for as
+    long as the manager runs, and multiplexes every operation on that host
+    over it.
+
+    Unlike fabric's @parallel, this doesn't fork a process per host, and a
+    host's connection is set up once rather than by every execute(). Since
+    the master connections are shared through sockets in control_dir, any
+    process (e.g. one forked by fabric) can use the pool as well.
+
+    Operations on a single host are the blocking run, put and rsync, which
+    take the same main options as their fabric counterparts. run_on_hosts
+    and call_on_hosts dispatch to many hosts at once with asyncio, at most
+    max_concurrency at a time. """
+    control_dir: str
+    max_concurrency: int
+    connected_hosts: Set[str]
+    # only the process that made the pool closes it, not forked children
+    owner_pid: int
+
+    def __init__(self, max_concurrency: int = 64) -> None:
+        # keep the path short, sockets are limited to ~100 chars
+        self.control_dir = tempfile.mkdtemp(prefix="fsssh-")
+        self.max_concurrency = max_concurrency
+        self.connected_hosts = set()
+        self.owner_pid = os.getpid()
+        atexit.register(self.close)
+
+    def ssh_options(self, master: bool = False) -> List[str]:
+        """ Options for every ssh, scp and rsync invocation. Only the
+        command that starts a host's master connection passes master. """
+        # ssh uses the first value given for an option. operations never
+        # start a master themselves (a backgrounded master would hold on to
+        # their output pipes), they fall back to a direct connection if
+        # there is none
+        options = ["-o", "ControlMaster=" + ("yes" if master else "no")]
+        options += [
+            "-o", f"ControlPath={self.control_dir}/%C",
+            # masters close when the manager exits (see close), or after
+            # they have been idle for a while if it doesn't get to
+            "-o", "ControlPersist=10m",
+            "-o", "BatchMode=yes",
+            "-o", f"ConnectTimeout={env.timeout}",
+            "-o", f"ConnectionAttempts={env.connection_attempts}",
+            "-o", "ServerAliveInterval=30",
+        ]
+        # log in the way fabric does, not only with the agent's keys
+        if env.user:
+            options += ["-o", f"User={env.user}"]
+        for key in key_filenames():
+            options += ["-o", f"IdentityFile={key}"]
+        if env.disable_known_hosts:
+            options += ["-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "LogLevel=ERROR"]
+        return options
+
+    def master_command(self, host: str) -> List[str]:
+        return ["ssh"] + self.ssh_options(master=True) + ["-N", "-f", host]
+
+    def connect(self, host: str) -> None:
+        """ Start the master connection to host, unless there is one. """
+        if host in self.connected_hosts:
+            return
+        proc = subprocess.run(self.master_command(host), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if proc.returncode == 0:
+            self.connected_hosts.add(host)
+
+    async def connect_async(self, host: str, semaphore: asyncio.Semaphore) -> None:
+        if host in self.connected_hosts:
+            return
+        async with semaphore:
+            proc = await asyncio.create_subprocess_exec(*self.master_command(host),
+                stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+            if await proc.wait() == 0:
+                self.connected_hosts.add(host)
+
+    def ssh_command(self, host: str, command: str, forward_agent: bool = False) -> List[str]:
+        return ["ssh"] + self.ssh_options() + (["-A"] if forward_agent else []) + [host, command]
+
+    def check(self, host: str, what: str, result: RemoteResult, warn_only: bool) -> RemoteResult:
+        if result.failed and not warn_only:
+            raise RemoteCommandError(f"[{host}] {what} failed with exit code {result.return_code}:\n{result.stderr}")
+        return result
+
+    def run(self, host: str, command: str, warn_only: bool = False, timeout: Optional[float] = None, forward_agent: bool = False) -> RemoteResult:
+        """ Run command in the default shell of host. Raises
+        subprocess.TimeoutExpired if it takes longer than timeout seconds.
+        With forward_agent, command can use the manager's ssh keys to reach
+        other hosts. """
+        self.connect(host)
+        proc = subprocess.run(self.ssh_command(host, command, forward_agent), stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=timeout)
+        rootLogger.debug(f"[{host}] run: {command}\n{proc.stdout}{proc.stderr}")
+        return self.check(host, command, RemoteResult(proc.stdout, proc.stderr, proc.returncode), warn_only)
+
+    def put(self, host: str, local_path: str, remote_path: str, mirror_local_mode: bool = False, warn_only: bool = False) -> RemoteResult:
+        """ Copy local_path to remote_path on host. """
+        self.connect(host)
+        command = ["scp", "-q", "-r"] + (["-p"] if mirror_local_mode else []) + self.ssh_options() + [local_path, f"{host}:{remote_path}"]
+        proc = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        return self.check(host, f"put {local_path}", RemoteResult(proc.stdout, proc.stderr, proc.returncode), warn_only)
+
+    def rsync(self, host: str, local_dir: str, remote_dir: str, extra_opts: str = "", warn_only: bool = False) -> RemoteResult:
+        """ rsync local_dir to remote_dir on host, with the same default
+        options as fabric's rsync_project. """
+        self.connect(host)
+        rsh = " ".join(["ssh"] + [shlex.quote(x) for x in self.ssh_options()])
+        command = ["rsync", "-pthrvz", "--rsh", rsh] + shlex.split(extra_opts) + [local_dir, f"{host}:{remote_dir}"]
+        proc = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        return self.check(host, f"rsync {local_dir}", RemoteResult(proc.stdout, proc.stderr, proc.returncode), warn_only)
+
+    def rsync_from(self, host: str, remote_path: str, local_dir: str, extra_opts: str = "", warn_only: bool = False) -> RemoteResult:
+        """ rsync remote_path on host into local_dir, like rsync_project
+        with upload=False. """
+        self.connect(host)
+        rsh = " ".join(["ssh"] + [shlex.quote(x) for x in self.ssh_options()])
+        command = ["rsync", "-pthrvz", "--rsh", rsh] + shlex.split(extra_opts) + [f"{host}:{remote_path}", local_dir]
+        proc = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+        rootLogger.debug(f"[{host}] rsync from {remote_path}:\n{proc.stdout}{proc.stderr}")
+        return self.check(host, f"rsync {remote_path}", RemoteResult(proc.stdout, proc.stderr, proc.returncode), warn_only)
+
+    async def run_async(self, host: str, command: str, warn_only: bool, semaphore: asyncio.Semaphore) -> RemoteResult:
+        async with semaphore:
+            proc = await asyncio.create_subprocess_exec(*self.ssh_command(host, command),
+                stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await proc.communicate()
+        assert proc.returncode is not None
+        result = RemoteResult(stdout.decode(errors="replace"), stderr.decode(errors="replace"), proc.returncode)
+        rootLogger.debug(f"[{host}] run: {command}\n{result.stdout}{result.stderr}")
+        return self.check(host, command, result, warn_only)
+
+    def run_on_hosts(self, hosts: Sequence[str], command: str, warn_only: bool = False) -> Dict[str, RemoteResult]:
+        """ Run command on all hosts at once. Return the results by host. """
+        async def run_all() -> List[RemoteResult]:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            await asyncio.gather(*[self.connect_async(host, semaphore) for host in hosts])
+            return await asyncio.gather(*[self.run_async(host, command, warn_only, semaphore) for host in hosts])
+        return dict(zip(hosts, asyncio.run(run_all())))
+
+    def call_on_hosts(self, hosts: Sequence[str], func: Callable[[str], T]) -> Dict[str, T]:
+        """ Call func(host) for all hosts at once, each on a worker thread.
+        func should only reach its host through the blocking methods of this
+        pool, not fabric, whose state is global. Return the results by host. """
+        async def call_all() -> List[T]:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            await asyncio.gather(*[self.connect_async(host, semaphore) for host in hosts])
+            async def call(host: str) -> T:
+                async with semaphore:
+                    return await asyncio.get_running_loop().run_in_executor(None, func, host)
+            return await asyncio.gather(*[call(host) for host in hosts])
+        return dict(zip(hosts, asyncio.run(call_all())))
+
+    def close(self) -> None:
+        """ Close all master connections. """
+        if os.getpid() != self.owner_pid:
+            return
+        for host in self.connected_hosts:
+            subprocess.run(["ssh"] + self.ssh_options() + ["-O", "exit", host], stdin=subprocess.DEVNULL, capture_output=True)
+        self.connected_hosts = set()
+        shutil.rmtree(self.control_dir, ignore_errors=True)
@@ -5,16 +5,114 @@ from __future__ import annotations
 
 import subprocess
 import random
-import string
 import logging
-from fabric.api import local # type: ignore
+import hashlib
+import fcntl
+import os
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
 
-from typing import TYPE_CHECKING
+from runtools.utils import SwitchingTable, get_local_shared_libraries
+
+from typing import Iterator, List, Optional, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from runtools.firesim_topology_elements import FireSimSwitchNode
 
 rootLogger = logging.getLogger()
 
+def report_switch_build_failure(switch_builder: AbstractSwitchToSwitchConfig) -> None:
+    """ Log the captured output of a failed switch build. """
+    logpath = switch_builder.switch_build_log_path()
+    rootLogger.info(f"Switch model build failed for switch {switch_builder.switch_binary_name()}. Build log ({logpath}):")
+    with open(logpath, "r") as logfile:
+        rootLogger.info(logfile.read())
+    rootLogger.info(f"""You can also re-run 'make' in the '{switch_builder.switch_build_dir()}' directory to debug this error.""")
+
+class SwitchBuildCache:
+    """ A local cache of built switch model binaries, keyed by a hash of
+    everything that goes into the build: the switch sources, Makefile and
+    generated switchconfig.h, the make target, and the compiler version.
+
+    Several manager processes may share a checkout (and so the cache), so:
+    entries are published with an atomic rename of a fully-written temp dir,
+    binaries are copied out under a shared lock, and LRU eviction (by entry
+    mtime, bumped on every hit) runs under an exclusive lock. """
+    cache_dir: str
+    max_entries: int
+    # compiler version string, computed once per manager invocation
+    compiler_id: Optional[str] = None
+
+    def __init__(self, cache_dir: str, max_entries: int = 128) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    @classmethod
+    def get_compiler_id(cls) -> str:
+        if cls.compiler_id is None:
+            try:
+                cls.compiler_id = subprocess.check_output([os.environ.get("CXX", "g++"), "--version"], text=True)
+            except (OSError, subprocess.CalledProcessError):
+                cls.compiler_id = ""
+        return cls.compiler_id
+
+    def key_for_build_dir(self, builddir: str, target: str) -> str:
+        """ Hash the sources in builddir that make target depends on. """
+        m = hashlib.sha256()
+        m.update(target.encode())
+        m.update(self.get_compiler_id().encode())
+        for filename in sorted(os.listdir(builddir)):
+            if filename == "Makefile" or filename.endswith((".h", ".cc")):
+                m.update(filename.encode())
+                with open(os.path.join(builddir, filename), "rb") as f:
+                    m.update(hashlib.sha256(f.read()).digest())
+        return m.hexdigest()
+
+    @contextmanager
+    def locked(self, lock_type: int) -> Iterator[None]:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lockfile:
+            fcntl.flock(lockfile, lock_type)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        """ Copy the cached binary for key to dest_path. Return False on a miss. """
+        entry = os.path.join(self.cache_dir, key)
+        with self.locked(fcntl.LOCK_SH):
+            if not os.path.isdir(entry):
+                return False
+            shutil.copy2(os.path.join(entry, "switch"), dest_path)
+            os.utime(entry)
+        return True
+
+    def store(self, key: str, binary_path: str) -> None:
+        """ Add a freshly built binary to the cache, then evict old entries. """
+        entry = os.path.join(self.cache_dir, key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmpdir = os.path.join(self.cache_dir, ".tmp-" + key + "-" + str(os.getpid()))
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        os.makedirs(tmpdir)
+        shutil.copy2(binary_path, os.path.join(tmpdir, "switch"))
+        try:
+            os.rename(tmpdir, entry)
+        except OSError:
+            # another manager published the same build first
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """ Drop least recently used entries beyond max_entries. """
+        with self.locked(fcntl.LOCK_EX):
+            entries = [os.path.join(self.cache_dir, x) for x in os.listdir(self.cache_dir) if not x.startswith(".")]
+            entries.sort(key=os.path.getmtime, reverse=True)
+            for stale in entries[self.max_entries:]:
+                rootLogger.debug("Evicting switch build cache entry " + stale)
+                shutil.rmtree(stale, ignore_errors=True)
+
 class AbstractSwitchToSwitchConfig:
     """ This class is responsible for providing functions that take a FireSimSwitchNode
     and emit the correct config header to produce an actual switch simulator binary
@@ -29,7 +127,7 @@ class AbstractSwitchToSwitchConfig:
         self.fsimswitchnode = fsimswitchnode
         # this lets us run many builds in parallel without conflict across
         # parallel experiments which may have overlapping switch ids
-        self.build_disambiguate = ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(64))
+        self.build_disambiguate = format(random.getrandbits(256), '064X')
 
     def emit_init_for_uplink(self, uplinkno: int) -> str:
         """ Emit an init for a switch to talk to it's uplink."""
@@ -38,12 +136,16 @@ class AbstractSwitchToSwitchConfig:
         upperswitch = linkobj.get_uplink_side()
 
         target_local_portno = len(self.fsimswitchnode.downlinks) + uplinkno
-        if linkobj.link_crosses_hosts():
+        transport = linkobj.get_transport()
+        if transport == 'unix':
+            return "new UnixClientPort(" + str(target_local_portno) + ', "' + linkobj.link_hostserver_socket_path() + '");\n'
+        elif transport in ['tcp', 'tcp_tuned']:
             uplinkhostip = linkobj.link_hostserver_host() #upperswitch.host_instance.get_private_ip()
             uplinkhostport = linkobj.link_hostserver_port()
 
             return "new SocketClientPort(" + str(target_local_portno) +  \
-                    ", \"" + uplinkhostip + "\", " + str(uplinkhostport) + ");\n"
+                    ", \"" + uplinkhostip + "\", " + str(uplinkhostport) + \
+                    (", true" if transport == 'tcp_tuned' else "") + ");\n"
 
         else:
             linkbasename = linkobj.get_global_link_id()
@@ -53,11 +155,14 @@ class AbstractSwitchToSwitchConfig:
         """ emit an init for the specified downlink. """
         downlinkobj = self.fsimswitchnode.downlinks[downlinkno]
         downlink = downlinkobj.get_downlink_side()
-        if downlinkobj.link_crosses_hosts():
+        transport = downlinkobj.get_transport()
+        if transport == 'unix':
+            return "new UnixServerPort(" + str(downlinkno) + ', "' + downlinkobj.link_hostserver_socket_path() + '");\n'
+        elif transport in ['tcp', 'tcp_tuned']:
             hostport = downlinkobj.link_hostserver_port()
             # create a SocketServerPort
             return "new SocketServerPort(" + str(downlinkno) + ", " + \
-                    str(hostport)  + ");\n"
+                    str(hostport) + (", true" if transport == 'tcp_tuned' else "") + ");\n"
         else:
             linkbasename = downlinkobj.get_global_link_id()
             return "new ShmemPort(" + str(downlinkno) + ', "' + linkbasename + '", false);\n'
@@ -73,27 +178,41 @@ class AbstractSwitchToSwitchConfig:
 
     # produce mac2port array portion of config
     def get_mac2port(self) -> str:
-        """ This takes a python array that represents the mac to port mapping,
-        and converts it to a C++ array """
-
-        mac2port_pythonarray = self.fsimswitchnode.switch_table
-        assert mac2port_pythonarray is not None
+        """ This takes the switch's MAC to port table (either a SwitchingTable
+        or a plain sequence of ports) and converts it to a C++ array """
 
-        commaseparated = ""
-        for elem in mac2port_pythonarray:
-            commaseparated += str(elem) + ", "
+        mac2port_array = self.get_switching_table().to_array()
 
-        #remove extraneous ", "
-        commaseparated = commaseparated[:-2]
-        commaseparated = "{" + commaseparated + "};"
+        commaseparated = "{" + ", ".join(map(str, mac2port_array)) + "};"
 
         retstr = """
     #ifdef MACPORTSCONFIG
     uint16_t mac2port[{}]  {}
+    uint64_t flow_hash_salt = {};
     #endif
-    """.format(len(mac2port_pythonarray), commaseparated)
+    """.format(len(mac2port_array), commaseparated, self.get_flow_hash_salt())
         return retstr
 
+    def get_switching_table(self) -> SwitchingTable:
+        """ Return the switch's MAC to port table as a SwitchingTable. A plain
+        sequence of ports uses port num downlinks for "any uplink", as the
+        switch model used to, so those entries become ANY_UPLINK. """
+        switch_table = self.fsimswitchnode.switch_table
+        assert switch_table is not None
+
+        if isinstance(switch_table, SwitchingTable):
+            return switch_table
+        numdownlinks = len(self.fsimswitchnode.downlinks)
+        return SwitchingTable.from_ports(
+            [SwitchingTable.ANY_UPLINK if port == numdownlinks else port for port in switch_table],
+            SwitchingTable.ANY_UPLINK)
+
+    def get_flow_hash_salt(self) -> int:
+        """ Seed for the switch model's uplink selection hash. It differs per
+        switch so that switches at different levels of the topology do not
+        pick uplinks in lockstep. """
+        return self.fsimswitchnode.switch_id_internal
+
     def get_header(self) -> str:
         """ Produce file header. """
         retstr = """// THIS FILE IS MACHINE GENERATED. SEE deploy/buildtools/switchmodelconfig.py
@@ -135,44 +254,81 @@ class AbstractSwitchToSwitchConfig:
     def switch_binary_name(self) -> str:
         return "switch" + str(self.fsimswitchnode.switch_id_internal)
 
-    def buildswitch(self) -> None:
-        """ Generate the config file, build the switch."""
+    def switch_build_dir(self) -> str:
+        """ get the local dir this switch is built in. """
+        return self.switch_build_local_dir() + self.switch_binary_name() + "-" + self.build_disambiguate + "-build/"
 
-        configfile = self.emit_switch_configfile()
-        binaryname = self.switch_binary_name()
+    def switch_build_log_path(self) -> str:
+        """ get the local path of the captured build output for this switch. """
+        return self.switch_build_dir() + "build.log"
 
+    def copy_switch_sources(self, switchbuilddir: str) -> None:
+        """ Populate switchbuilddir with the switch model sources. """
         switchorigdir = self.switch_build_local_dir()
-        switchbuilddir = switchorigdir + binaryname + "-" + self.build_disambiguate + "-build/"
-
-        rootLogger.info("Building switch model binary for switch " + str(self.switch_binary_name()))
+        os.makedirs(switchbuilddir, exist_ok=True)
+        for filename in os.listdir(switchorigdir):
+            if filename == "Makefile" or filename.endswith((".h", ".cc")):
+                shutil.copy(switchorigdir + filename, switchbuilddir)
+
+    def run_make(self, switchbuilddir: str, target: str, logpath: str) -> bool:
+        """ Build target in switchbuilddir, capturing all output in logpath.
+        Return True on success. """
+        with open(logpath, "w") as logfile:
+            result = subprocess.run(["make", target], cwd=switchbuilddir, stdout=logfile, stderr=subprocess.STDOUT)
+        return result.returncode == 0
+
+    def prepare_switch_build(self) -> None:
+        """ Generate the config file and set up the build dir. This allocates
+        host ports for links that cross hosts, so it must not run
+        concurrently with other switches' prepare_switch_build. """
+        configfile = self.emit_switch_configfile()
+        switchbuilddir = self.switch_build_dir()
 
         rootLogger.debug(str(configfile))
 
-        def local_logged(command: str) -> None:
-            """ Run local command with logging. """
-            localcap = local(command, capture=True)
-            rootLogger.debug(localcap)
-            rootLogger.debug(localcap.stderr)
-
         # make a build dir for this switch
-        local_logged("mkdir -p " + switchbuilddir)
-        local_logged("cp " + switchorigdir + "*.h " + switchbuilddir)
-        local_logged("cp " + switchorigdir + "*.cc " + switchbuilddir)
-        local_logged("cp " + switchorigdir + "Makefile " + switchbuilddir)
+        self.copy_switch_sources(switchbuilddir)
+        with open(switchbuilddir + "switchconfig.h", "w") as text_file:
+            text_file.write(configfile)
+
+    def compile_switch(self) -> bool:
+        """ Build the switch binary in the dir set up by prepare_switch_build.
+        Safe to run concurrently for different switches. Return True on
+        success, otherwise see switch_build_log_path(). """
+        binaryname = self.switch_binary_name()
+        switchbuilddir = self.switch_build_dir()
 
-        text_file = open(switchbuilddir + "switchconfig.h", "w")
-        text_file.write(configfile)
-        text_file.close()
-        local_logged("cd " + switchbuilddir + " && make")
-        local_logged("mv " + switchbuilddir + "switch " + switchbuilddir + binaryname)
+        build_cache = self.switch_build_cache()
+        cache_key = build_cache.key_for_build_dir(switchbuilddir, "switch")
+        if build_cache.fetch(cache_key, switchbuilddir + binaryname):
+            rootLogger.info("Reusing cached switch model binary for switch " + binaryname)
+            return True
 
-    def get_switch_simulation_command(self, sudo: bool) -> str:
-        """ Return the command to boot the switch."""
+        rootLogger.info("Building switch model binary for switch " + binaryname)
+        if not self.run_make(switchbuilddir, "switch", self.switch_build_log_path()):
+            return False
+        os.rename(switchbuilddir + "switch", switchbuilddir + binaryname)
+        build_cache.store(cache_key, switchbuilddir + binaryname)
+        return True
+
+    def buildswitch(self) -> None:
+        """ Generate the config file, build the switch."""
+        self.prepare_switch_build()
+        if not self.compile_switch():
+            report_switch_build_failure(self)
+            sys.exit(1)
+
+    def get_switch_simulation_args(self) -> str:
+        """ Return the command line arguments passed to the switch binary. """
         switchlatency = self.fsimswitchnode.switch_switching_latency
         linklatency = self.fsimswitchnode.switch_link_latency
         bandwidth = self.fsimswitchnode.switch_bandwidth
+        return "{} {} {}".format(linklatency, switchlatency, bandwidth)
+
+    def get_switch_simulation_command(self, sudo: bool) -> str:
+        """ Return the command to boot the switch."""
         # insert gdb -ex run --args between sudo and ./ below to start switches in gdb
-        return """screen -S {} -d -m bash -c "script -f -c '{} ./{} {} {} {}' switchlog"; sleep 1""".format(self.switch_binary_name(), "sudo" if sudo else "", self.switch_binary_name(), linklatency, switchlatency, bandwidth)
+        return """screen -S {} -d -m bash -c "script -f -c '{} ./{} {}' switchlog"; sleep 1""".format(self.switch_binary_name(), "sudo" if sudo else "", self.switch_binary_name(), self.get_switch_simulation_args())
 
     def kill_switch_simulation_command(self) -> str:
         """ Return the command to kill the switch. """
@@ -182,9 +338,133 @@ class AbstractSwitchToSwitchConfig:
         """ get local build dir of the switch. """
         return "../target-design/switch/"
 
+    def switch_build_cache(self) -> SwitchBuildCache:
+        """ get the local cache of previously built switch binaries. """
+        return SwitchBuildCache(self.switch_build_local_dir() + "switch-build-cache/")
+
     def switch_binary_local_path(self) -> str:
         """ return the full local path where the switch binary lives. """
-        binaryname = self.switch_binary_name()
-        switchorigdir = self.switch_build_local_dir()
-        switchbuilddir = switchorigdir + binaryname + "-" + self.build_disambiguate + "-build/"
-        return switchbuilddir + self.switch_binary_name()
+        return self.switch_build_dir() + self.switch_binary_name()
+
+    def get_required_files_local_paths(self) -> List[Tuple[str, str]]:
+        """ Return (local path, remote name) pairs of everything a switch slot
+        needs to run this switch. An empty remote name keeps the local name. """
+        binary = self.switch_binary_local_path()
+        return [(binary, '')] + get_local_shared_libraries(binary)
+
+
+class RuntimeSwitchToSwitchConfig(AbstractSwitchToSwitchConfig):
+    """ Instead of compiling a switchconfig.h into a binary per switch, emit a
+    small config file per switch that the generic switch-runtime binary (see
+    target-design/switch/runtimeconfig.h) reads at startup.
+
+    The generic binary is built at most once per manager invocation and shared
+    by all switches. It is copied to each switch slot under the per-switch
+    binary name, so starting/killing/monitoring switches works the same way
+    as with compile-time configs. """
+    # shared by all switches built by this manager process
+    shared_build_disambiguate: str = format(random.getrandbits(256), '064X')
+    shared_build_lock: threading.Lock = threading.Lock()
+    shared_build_succeeded: Optional[bool] = None
+
+    def emit_runtime_init_for_uplink(self, uplinkno: int) -> str:
+        """ Emit the config line for a switch to talk to its uplink. """
+        linkobj = self.fsimswitchnode.uplinks[uplinkno]
+        target_local_portno = len(self.fsimswitchnode.downlinks) + uplinkno
+        transport = linkobj.get_transport()
+        if transport == 'unix':
+            return "unixclient {} {}".format(target_local_portno, linkobj.link_hostserver_socket_path())
+        elif transport == 'tcp':
+            return "client {} {} {}".format(target_local_portno, linkobj.link_hostserver_host(), linkobj.link_hostserver_port())
+        elif transport == 'tcp_tuned':
+            return "client {} {} {} tuned".format(target_local_portno, linkobj.link_hostserver_host(), linkobj.link_hostserver_port())
+        else:
+            return "shmem {} {} 1".format(target_local_portno, linkobj.get_global_link_id())
+
+    def emit_runtime_init_for_downlink(self, downlinkno: int) -> str:
+        """ Emit the config line for the specified downlink. """
+        downlinkobj = self.fsimswitchnode.downlinks[downlinkno]
+        transport = downlinkobj.get_transport()
+        if transport == 'unix':
+            return "unixserver {} {}".format(downlinkno, downlinkobj.link_hostserver_socket_path())
+        elif transport == 'tcp':
+            return "server {} {}".format(downlinkno, downlinkobj.link_hostserver_port())
+        elif transport == 'tcp_tuned':
+            return "server {} {} tuned".format(downlinkno, downlinkobj.link_hostserver_port())
+        else:
+            return "shmem {} {} 0".format(downlinkno, downlinkobj.get_global_link_id())
+
+    def emit_switch_configfile(self) -> str:
+        """ Produce the runtime config file for this switch. """
+        numdownlinks = len(self.fsimswitchnode.downlinks)
+        numuplinks = len(self.fsimswitchnode.uplinks)
+
+        lines = ["# THIS FILE IS MACHINE GENERATED. SEE deploy/runtools/switch_model_config.py"]
+        lines.append("ports {} {}".format(numdownlinks, numuplinks))
+        for downlinkno in range(numdownlinks):
+            lines.append(self.emit_runtime_init_for_downlink(downlinkno))
+        for uplinkno in range(numuplinks):
+            lines.append(self.emit_runtime_init_for_uplink(uplinkno))
+
+        switch_table = self.get_switching_table()
+        lines.append("hashsalt {}".format(self.get_flow_hash_salt()))
+        lines.append("mactable {} {}".format(len(switch_table), switch_table.default_port))
+        for lo, hi, port in switch_table.port_ranges():
+            lines.append("range {} {} {}".format(lo, hi, port))
+        return "\n".join(lines) + "\n"
+
+    def switch_config_name(self) -> str:
+        return self.switch_binary_name() + ".conf"
+
+    def shared_build_dir(self) -> str:
+        """ Local dir holding the generic binary and all switch config files. """
+        return self.switch_build_local_dir() + "switch-runtime-" + RuntimeSwitchToSwitchConfig.shared_build_disambiguate + "-build/"
+
+    def switch_build_dir(self) -> str:
+        return self.shared_build_dir()
+
+    def switch_build_log_path(self) -> str:
+        return self.shared_build_dir() + "build.log"
+
+    def prepare_switch_build(self) -> None:
+        """ Write this switch's config file next to the generic binary. """
+        switchbuilddir = self.shared_build_dir()
+        rootLogger.info("Writing switch model config for switch " + str(self.switch_binary_name()))
+        configfile = self.emit_switch_configfile()
+        rootLogger.debug(configfile)
+        os.makedirs(switchbuilddir, exist_ok=True)
+        with open(switchbuilddir + self.switch_config_name(), "w") as text_file:
+            text_file.write(configfile)
+
+    def compile_switch(self) -> bool:
+        """ Build the generic switch binary, the first time any switch asks
+        for it. Concurrent callers wait for that one build. """
+        with RuntimeSwitchToSwitchConfig.shared_build_lock:
+            if RuntimeSwitchToSwitchConfig.shared_build_succeeded is None:
+                switchbuilddir = self.shared_build_dir()
+                self.copy_switch_sources(switchbuilddir)
+
+                build_cache = self.switch_build_cache()
+                cache_key = build_cache.key_for_build_dir(switchbuilddir, "switch-runtime")
+                if build_cache.fetch(cache_key, self.switch_binary_local_path()):
+                    rootLogger.info("Reusing cached generic switch model binary")
+                    RuntimeSwitchToSwitchConfig.shared_build_succeeded = True
+                else:
+                    rootLogger.info("Building generic switch model binary")
+                    succeeded = self.run_make(switchbuilddir, "switch-runtime", self.switch_build_log_path())
+                    if succeeded:
+                        build_cache.store(cache_key, self.switch_binary_local_path())
+                    RuntimeSwitchToSwitchConfig.shared_build_succeeded = succeeded
+            return RuntimeSwitchToSwitchConfig.shared_build_succeeded
+
+    def get_switch_simulation_args(self) -> str:
+        return super().get_switch_simulation_args() + " " + self.switch_config_name()
+
+    def switch_binary_local_path(self) -> str:
+        return self.shared_build_dir() + "switch-runtime"
+
+    def get_required_files_local_paths(self) -> List[Tuple[str, str]]:
+        binary = self.switch_binary_local_path()
+        all_paths = [(binary, self.switch_binary_name()),
+                     (self.shared_build_dir() + self.switch_config_name(), '')]
+        return all_paths + get_local_shared_libraries(binary)
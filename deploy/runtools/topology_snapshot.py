@@ -0,0 +1,198 @@
+""" A cache of fully mapped topologies (the state of RuntimeConfig after the
+phase one passes), so that manager commands run against unchanged config
+files don't need to redo phase one. """
+
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+import pickle
+import sys
+
+from runtools.firesim_topology_elements import FireSimNode, FireSimLink
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+rootLogger = logging.getLogger()
+
+# the manager's python packages, relative to deploy/. their code decides
+# what a snapshot contains, so it is part of every snapshot's key
+MANAGER_PACKAGES = ['awstools', 'buildtools', 'runtools', 'util']
+
+def manager_sources(deploy_dir: str) -> List[str]:
+    """ Return the paths of the manager's python sources, in a stable order. """
+    sources = [os.path.join(deploy_dir, "firesim")]
+    for package in MANAGER_PACKAGES:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(deploy_dir, package)):
+            dirnames[:] = sorted(x for x in dirnames if x != "__pycache__")
+            sources += [os.path.join(dirpath, x) for x in sorted(filenames) if x.endswith(".py")]
+    return sources
+
+class WarningRecorder(logging.Handler):
+    """ Collects the warnings logged while phase one runs, so that commands
+    that reuse its snapshot log them too. """
+    records: List[Tuple[int, str]]
+
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append((record.levelno, record.getMessage()))
+
+def slotted_state(obj: Any) -> Dict[str, Any]:
+    """ Return the set slots of a __slots__ object as a dict. """
+    state = {}
+    for klass in type(obj).__mro__:
+        for slot in getattr(klass, '__slots__', ()):
+            if hasattr(obj, slot):
+                state[slot] = getattr(obj, slot)
+    return state
+
+class FlatGraphPickler(pickle.Pickler):
+    """ Pickler that stores topology nodes and links as references into a
+    flat table instead of inline.
+
+    Pickling the graph normally recurses one level per hop between nodes,
+    which overflows the stack on large topologies. Here a node or link
+    is only a (table index, class) reference wherever it appears, and the
+    table of their states (which in turn only holds references to other
+    nodes and links) is pickled after the rest of the snapshot. """
+    graph_objects: List[Any]
+    graph_ids: Dict[int, int]
+    # persistent_id is called for every object pickled, so cache which
+    # types are graph types rather than going through the ABC isinstance
+    graph_types: Dict[type, bool]
+
+    def __init__(self, file: Any) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.graph_objects = []
+        self.graph_ids = {}
+        self.graph_types = {}
+
+    def persistent_id(self, obj: Any) -> Optional[Any]:
+        objtype = type(obj)
+        is_graph_type = self.graph_types.get(objtype)
+        if is_graph_type is None:
+            is_graph_type = self.graph_types[objtype] = issubclass(objtype, (FireSimNode, FireSimLink))
+        if not is_graph_type:
+            return None
+        index = self.graph_ids.get(id(obj))
+        if index is None:
+            index = len(self.graph_objects)
+            self.graph_ids[id(obj)] = index
+            self.graph_objects.append(obj)
+        return (index, type(obj))
+
+    def dump_with_graph(self, obj: Any) -> None:
+        self.dump(obj)
+        # states may reference more nodes and links, which get appended to
+        # graph_objects as they are found, so dump them in batches until no
+        # new ones turn up
+        done = 0
+        while done < len(self.graph_objects):
+            batch = [slotted_state(x) for x in self.graph_objects[done:]]
+            done += len(batch)
+            self.dump(batch)
+
+class FlatGraphUnpickler(pickle.Unpickler):
+    """ Inverse of FlatGraphPickler. """
+    graph_objects: Dict[int, Any]
+
+    def __init__(self, file: Any) -> None:
+        super().__init__(file)
+        self.graph_objects = {}
+
+    def persistent_load(self, pid: Any) -> Any:
+        index, klass = pid
+        if index not in self.graph_objects:
+            self.graph_objects[index] = klass.__new__(klass)
+        return self.graph_objects[index]
+
+    def load_with_graph(self) -> Any:
+        obj = self.load()
+        index = 0
+        while index < len(self.graph_objects):
+            for state in self.load():
+                for slot, value in state.items():
+                    setattr(self.graph_objects[index], slot, value)
+                index += 1
+        return obj
+
+class TopologySnapshotCache:
+    """ A local cache of pickled phase one results, keyed by a hash of every
+    file phase one reads.
+
+    Entries are published with an atomic rename, so concurrent managers
+    sharing a checkout only ever see complete snapshots. Least recently
+    used entries (by mtime, bumped on every hit) beyond max_entries are
+    removed. """
+    cache_dir: str
+    max_entries: int
+
+    def __init__(self, cache_dir: str, max_entries: int = 8) -> None:
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def key_for_inputs(self, paths: Sequence[str], extra: Sequence[str]) -> str:
+        """ Hash the contents of paths and the extra strings. Raises if any
+        of the paths is missing. """
+        m = hashlib.sha256()
+        m.update(sys.version.encode())
+        for path in paths:
+            m.update(path.encode())
+            with open(path, "rb") as f:
+                m.update(hashlib.sha256(f.read()).digest())
+        for value in extra:
+            m.update(b"\0" + value.encode())
+        return m.hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def fetch(self, key: str) -> Optional[Any]:
+        """ Return the snapshot stored for key, or None on a miss. """
+        entry = self.entry_path(key)
+        try:
+            with open(entry, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            snapshot = FlatGraphUnpickler(io.BytesIO(data)).load_with_graph()
+        except Exception as e:
+            # e.g. a snapshot of classes that have since changed shape
+            rootLogger.debug(f"Ignoring unreadable topology snapshot {entry}: {e}")
+            return None
+        os.utime(entry)
+        return snapshot
+
+    def store(self, key: str, snapshot: Any) -> bool:
+        """ Add a snapshot to the cache, then evict old entries. Return False
+        if the snapshot can't be pickled. """
+        buf = io.BytesIO()
+        try:
+            FlatGraphPickler(buf).dump_with_graph(snapshot)
+        except (pickle.PicklingError, AttributeError, TypeError, RecursionError) as e:
+            rootLogger.debug(f"Not caching topology snapshot: {e}")
+            return False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmppath = os.path.join(self.cache_dir, ".tmp-" + key + "-" + str(os.getpid()))
+        with open(tmppath, "wb") as f:
+            f.write(buf.getvalue())
+        os.replace(tmppath, self.entry_path(key))
+        self.evict()
+        return True
+
+    def evict(self) -> None:
+        """ Drop least recently used entries beyond max_entries. """
+        entries = [os.path.join(self.cache_dir, x) for x in os.listdir(self.cache_dir) if x.endswith(".pickle")]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for stale in entries[self.max_entries:]:
+            rootLogger.debug("Evicting topology snapshot " + stale)
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
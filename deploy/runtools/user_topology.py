@@ -3,6 +3,8 @@ from UserToplogies and thus can instantiate your topology. """
 
 from __future__ import annotations
 
+import math
+
 from runtools.firesim_topology_elements import FireSimSwitchNode, FireSimServerNode, FireSimSuperNodeServerNode, FireSimDummyServerNode, FireSimNode
 
 from typing import Optional, Union, Callable, Sequence, TYPE_CHECKING, cast, List, Any
@@ -144,6 +146,127 @@ class UserTopologies:
 
         self.custom_mapper = custom_mapper
 
+    # Parametric generators. These are selected like any other topology, with
+    # their arguments given in target_config.topology_params in
+    # config_runtime.yaml, and use the min-cut mapper so that they can be
+    # deployed on any run farm with enough slots.
+
+    def fat_tree(self, k: int) -> None:
+        """ k-ary fat tree as described in
+        http://ccr.sigcomm.org/online/files/p63-alfares.pdf
+
+        (k/2)^2 core switches and k pods of k/2 aggregation and k/2 edge
+        switches, with k/2 servers per edge switch, for k^3/4 servers. """
+        assert k >= 2 and k % 2 == 0, "fat_tree k must be even"
+        half = k // 2
+        coreswitches = [FireSimSwitchNode() for x in range(half * half)]
+        self.roots = coreswitches
+        for pod in range(k):
+            aggrswitches = [FireSimSwitchNode() for x in range(half)]
+            edgeswitches = [FireSimSwitchNode() for x in range(half)]
+            for aggrno, aggr in enumerate(aggrswitches):
+                for core in coreswitches[aggrno * half:(aggrno + 1) * half]:
+                    core.add_downlink(aggr)
+                aggr.add_downlinks(edgeswitches)
+            for edge in edgeswitches:
+                edge.add_downlinks([FireSimServerNode() for x in range(half)])
+        self.custom_mapper = 'mapping_min_cut_partition'
+
+    def leaf_spine(self, num_leaves: int, servers_per_leaf: int, oversubscription: float = 1.0) -> None:
+        """ Two-tier leaf-spine network where every leaf connects to every
+        spine. There are just enough spines that the ratio of server-facing to
+        spine-facing ports on each leaf is at most oversubscription (e.g. 3.0
+        for 3:1). """
+        assert oversubscription > 0, "leaf_spine oversubscription must be positive"
+        num_spines = max(1, math.ceil(servers_per_leaf / oversubscription))
+        spineswitches = [FireSimSwitchNode() for x in range(num_spines)]
+        self.roots = spineswitches
+        leafswitches = [FireSimSwitchNode() for x in range(num_leaves)]
+        for spine in spineswitches:
+            spine.add_downlinks(leafswitches)
+        for leaf in leafswitches:
+            leaf.add_downlinks([FireSimServerNode() for x in range(servers_per_leaf)])
+        self.custom_mapper = 'mapping_min_cut_partition'
+
+    def torus(self, dims: Sequence[int], servers_per_switch: int = 1) -> None:
+        """ 2D/3D (or any dimension) torus of switches, e.g. dims [8, 8],
+        with servers_per_switch servers attached to each switch. See
+        add_switch_graph_links for how the links are oriented. """
+        assert len(dims) > 0 and all(x >= 1 for x in dims), "torus dims must be positive"
+        numswitches = math.prod(dims)
+        switches = [FireSimSwitchNode() for x in range(numswitches)]
+        for switch in switches:
+            switch.add_downlinks([FireSimServerNode() for x in range(servers_per_switch)])
+
+        neighbors: List[List[int]] = [[] for x in range(numswitches)]
+        stride = 1
+        for dimsize in dims:
+            for switchno in range(numswitches):
+                coord = (switchno // stride) % dimsize
+                base = switchno - coord * stride
+                for step in (1, -1):
+                    neighbor = base + ((coord + step) % dimsize) * stride
+                    if neighbor != switchno and neighbor not in neighbors[switchno]:
+                        neighbors[switchno].append(neighbor)
+            stride *= dimsize
+
+        self.add_switch_graph_links(switches, neighbors)
+        self.custom_mapper = 'mapping_min_cut_partition'
+
+    def dragonfly(self, a: int, p: int, h: int, num_groups: Optional[int] = None) -> None:
+        """ Dragonfly as described in https://doi.org/10.1109/ISCA.2008.19:
+        groups of a fully connected routers with p servers each, where every
+        router has h global links and every pair of groups is joined by one
+        global link. num_groups defaults to the maximum, a * h + 1. """
+        maxgroups = a * h + 1
+        if num_groups is None:
+            num_groups = maxgroups
+        assert 1 <= num_groups <= maxgroups, f"dragonfly supports at most a * h + 1 = {maxgroups} groups"
+        routers = [FireSimSwitchNode() for x in range(num_groups * a)]
+        for router in routers:
+            router.add_downlinks([FireSimServerNode() for x in range(p)])
+
+        neighbors: List[List[int]] = [[] for x in range(len(routers))]
+        for group in range(num_groups):
+            for r in range(a):
+                neighbors[group * a + r].extend(group * a + x for x in range(a) if x != r)
+        # global link l of a group (l in [0, a * h)) is on router l // h and
+        # leads to the group l + 1 groups further on
+        for group in range(num_groups):
+            for othergroup in range(group + 1, num_groups):
+                r0 = group * a + ((othergroup - group - 1) % num_groups) // h
+                r1 = othergroup * a + ((group - othergroup - 1) % num_groups) // h
+                neighbors[r0].append(r1)
+                neighbors[r1].append(r0)
+
+        self.add_switch_graph_links(routers, neighbors)
+        self.custom_mapper = 'mapping_min_cut_partition'
+
+    def add_switch_graph_links(self, switches: List[FireSimSwitchNode], neighbors: List[List[int]]) -> None:
+        """ Build an arbitrary connected switch graph, given each switch's
+        neighbor indices, in the uplink/downlink form the rest of the manager
+        expects: switches are numbered in BFS order from switches[0], which
+        becomes the only root, and every link points at the switch numbered
+        later.
+
+        So each switch's first uplink leads towards the root along the BFS
+        tree, which is what switch models flood broadcasts over, and the
+        switching tables route unicast traffic up*/down* (up towards the root
+        until the destination is reachable going down). """
+        rank = {0: 0}
+        order = [0]
+        for switchno in order:
+            for neighbor in neighbors[switchno]:
+                if neighbor not in rank:
+                    rank[neighbor] = len(order)
+                    order.append(neighbor)
+        assert len(order) == len(switches), "switch graph is not connected"
+
+        for switchno in order:
+            later = sorted(set(x for x in neighbors[switchno] if rank[x] > rank[switchno]), key=lambda x: rank[x])
+            switches[switchno].add_downlinks([switches[x] for x in later])
+        self.roots = [switches[0]]
+
     def example_multilink(self) -> None:
         self.roots = [FireSimSwitchNode()]
         midswitch = FireSimSwitchNode()
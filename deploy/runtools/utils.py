@@ -4,12 +4,14 @@ from __future__ import annotations
 
 import lddwrap
 import logging
+from array import array
+from bisect import bisect_left, bisect_right
 from os import fspath
 from os.path import realpath
 from pathlib import Path
 from fabric.api import run, warn_only, hide # type: ignore
 
-from typing import List, Tuple, Type
+from typing import Iterable, Iterator, List, Sequence, Tuple, Type
 
 rootLogger = logging.getLogger()
 
@@ -408,16 +410,17 @@ class MacAddress():
     >>> mac.as_int_no_prefix()
     3
     """
+    # one of these per server, so only the allocated int is stored
+    __slots__ = ('mac_without_prefix_as_int',)
+
     next_mac_alloc: int = 2
     eecs_mac_prefix: int = 0x00126d000000
     mac_without_prefix_as_int: int
-    mac_as_int: int
 
     def __init__(self) -> None:
         """ Allocate a new mac address, store it, then increment nextmacalloc."""
         assert MacAddress.next_mac_alloc < 2**24, "Too many MAC addresses allocated"
         self.mac_without_prefix_as_int = MacAddress.next_mac_alloc
-        self.mac_as_int = MacAddress.eecs_mac_prefix + MacAddress.next_mac_alloc
 
         # increment for next call
         MacAddress.next_mac_alloc += 1
@@ -427,6 +430,11 @@ class MacAddress():
         Used by the MAC tables in switch models."""
         return self.mac_without_prefix_as_int
 
+    @property
+    def mac_as_int(self) -> int:
+        """ Return the MAC address as an int, with the prefix. """
+        return MacAddress.eecs_mac_prefix + self.mac_without_prefix_as_int
+
     def __str__(self) -> str:
         """ Return the MAC address in the "regular format": colon separated,
         show all leading zeroes."""
@@ -450,3 +458,169 @@ class MacAddress():
         return cls.next_mac_alloc
 
 
+def merge_mac_ranges(ranges: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """ Sort [lo, hi) MAC ranges and coalesce adjacent/overlapping ones.
+
+    >>> merge_mac_ranges([(6, 8), (2, 4), (4, 5), (7, 9)])
+    [(2, 5), (6, 9)]
+    """
+    merged: List[Tuple[int, int]] = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+def intersect_mac_ranges(a: List[Tuple[int, int]], b: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """ Intersect two merged lists of [lo, hi) MAC ranges.
+
+    >>> intersect_mac_ranges([(2, 6), (8, 12)], [(4, 10)])
+    [(4, 6), (8, 10)]
+    """
+    out = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        lo = max(a[i][0], b[j][0])
+        hi = min(a[i][1], b[j][1])
+        if lo < hi:
+            out.append((lo, hi))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return out
+
+def subtract_mac_ranges(a: List[Tuple[int, int]], b: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """ Remove the MACs in b from a, both merged lists of [lo, hi) ranges.
+
+    >>> subtract_mac_ranges([(2, 12)], [(4, 6), (8, 9)])
+    [(2, 4), (6, 8), (9, 12)]
+    """
+    out = []
+    j = 0
+    for lo, hi in a:
+        while j < len(b) and b[j][1] <= lo:
+            j += 1
+        k = j
+        while k < len(b) and b[k][0] < hi:
+            if b[k][0] > lo:
+                out.append((lo, b[k][0]))
+            lo = max(lo, b[k][1])
+            k += 1
+        if lo < hi:
+            out.append((lo, hi))
+    return out
+
+
+class SwitchingTable():
+    """ A MAC address (without prefix) -> switch port table, stored as sorted,
+    non-overlapping [lo, hi) ranges of MACs. MACs not covered by any range
+    go to default_port. Since MACs are handed out in DFS order, each downlink
+    port of a tree-like topology typically needs a single range.
+
+    Iterating/indexing behaves like the dense list of ports that the switch
+    model consumes, so code written for a plain list of ints keeps working.
+
+    >>> tab = SwitchingTable(10, 2)
+    >>> tab.add_range(2, 6, 0)
+    >>> tab.add_range(6, 10, 1)
+    >>> list(tab)
+    [2, 2, 0, 0, 0, 0, 1, 1, 1, 1]
+    >>> tab[7]
+    1
+    >>> tab.add_range(4, 8, 3)
+    >>> tab.port_ranges()
+    [(2, 4, 0), (4, 8, 3), (8, 10, 1)]
+    >>> str(tab)
+    '[2, 4):0, [4, 8):3, [8, 10):1, *:2'
+    """
+    # port number the switch model reads as "hash across all uplinks"
+    ANY_UPLINK: int = 0xFFFE
+
+    num_entries: int
+    default_port: int
+    range_starts: List[int]
+    range_ends: List[int]
+    range_ports: List[int]
+
+    def __init__(self, num_entries: int, default_port: int) -> None:
+        self.num_entries = num_entries
+        self.default_port = default_port
+        self.range_starts = []
+        self.range_ends = []
+        self.range_ports = []
+
+    @classmethod
+    def from_ports(cls: Type[SwitchingTable], ports: Sequence[int], default_port: int) -> SwitchingTable:
+        """ Build a table from a dense sequence with one port per MAC.
+
+        >>> str(SwitchingTable.from_ports([2, 2, 0, 0, 1, 2], 2))
+        '[2, 4):0, [4, 5):1, *:2'
+        """
+        table = cls(len(ports), default_port)
+        lo = 0
+        for mac in range(1, len(ports) + 1):
+            if mac == len(ports) or ports[mac] != ports[lo]:
+                if ports[lo] != default_port:
+                    table.add_range(lo, mac, ports[lo])
+                lo = mac
+        return table
+
+    def add_range(self, lo: int, hi: int, port: int) -> None:
+        """ Map MACs [lo, hi) to port, overriding overlapping earlier ranges. """
+        assert 0 <= lo <= hi <= self.num_entries, f"MAC range [{lo}, {hi}) outside of table of size {self.num_entries}"
+        if lo == hi:
+            return
+        # existing ranges [first, last) overlap [lo, hi)
+        first = bisect_right(self.range_ends, lo)
+        last = bisect_left(self.range_starts, hi)
+
+        starts = [lo]
+        ends = [hi]
+        ports = [port]
+        if first < last:
+            if self.range_starts[first] < lo:
+                starts.insert(0, self.range_starts[first])
+                ends.insert(0, lo)
+                ports.insert(0, self.range_ports[first])
+            if self.range_ends[last - 1] > hi:
+                starts.append(hi)
+                ends.append(self.range_ends[last - 1])
+                ports.append(self.range_ports[last - 1])
+
+        self.range_starts[first:last] = starts
+        self.range_ends[first:last] = ends
+        self.range_ports[first:last] = ports
+
+    def port_ranges(self) -> List[Tuple[int, int, int]]:
+        """ Return the (lo, hi, port) ranges that are not mapped to the
+        default port, in MAC order. """
+        return list(zip(self.range_starts, self.range_ends, self.range_ports))
+
+    def to_array(self) -> array:
+        """ Expand into a dense uint16 array indexed by MAC, for consumers
+        (like the compile-time switch config) that need one entry per MAC. """
+        dense = array('H', [self.default_port]) * self.num_entries
+        for lo, hi, port in self.port_ranges():
+            dense[lo:hi] = array('H', [port]) * (hi - lo)
+        return dense
+
+    def __len__(self) -> int:
+        return self.num_entries
+
+    def __getitem__(self, mac: int) -> int:
+        if not 0 <= mac < self.num_entries:
+            raise IndexError(f"MAC {mac} outside of table of size {self.num_entries}")
+        index = bisect_right(self.range_starts, mac) - 1
+        if index >= 0 and mac < self.range_ends[index]:
+            return self.range_ports[index]
+        return self.default_port
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_array())
+
+    def __str__(self) -> str:
+        entries = [f"[{lo}, {hi}):{port}" for lo, hi, port in self.port_ranges()]
+        entries.append(f"*:{self.default_port}")
+        return ", ".join(entries)
@@ -17,6 +17,10 @@ class JobConfig:
     This essentially describes the local pieces that need to be fed to
     simulations and the remote outputs that need to be copied back. """
 
+    # uniform workloads create one of these per simulation, so jobs are kept
+    # small and share the workload's lists and paths where they can
+    __slots__ = ('parent_workload', 'jobname', 'outputs', 'simoutputs', 'siminputs', 'bootbinary', 'rootfs')
+
     filesystemsuffix: str = ".ext2"
     parent_workload: WorkloadConfig
     jobname: str
@@ -31,12 +35,14 @@ class JobConfig:
         self.jobname = singlejob_dict.get("name", self.parent_workload.workload_name + str(index))
         # ignore files, command, we assume they are used only to build rootfses
         # eventually this functionality will be merged into the manager too
-        joboutputs = singlejob_dict.get("outputs", [])
-        self.outputs = joboutputs + self.parent_workload.common_outputs
-        simoutputs = singlejob_dict.get("simulation_outputs", [])
-        self.simoutputs = simoutputs + self.parent_workload.common_simulation_outputs
-        siminputs = singlejob_dict.get("simulation_inputs", [])
-        self.siminputs = siminputs + self.parent_workload.common_simulation_inputs
+        # these are never modified, so jobs without their own entries just
+        # reference the workload's lists
+        joboutputs: List[str] = singlejob_dict.get("outputs", [])
+        self.outputs = joboutputs + self.parent_workload.common_outputs if joboutputs else self.parent_workload.common_outputs
+        simoutputs: List[str] = singlejob_dict.get("simulation_outputs", [])
+        self.simoutputs = simoutputs + self.parent_workload.common_simulation_outputs if simoutputs else self.parent_workload.common_simulation_outputs
+        siminputs: List[str] = singlejob_dict.get("simulation_inputs", [])
+        self.siminputs = siminputs + self.parent_workload.common_simulation_inputs if siminputs else self.parent_workload.common_simulation_inputs
 
         if singlejob_dict.get("bootbinary") is not None:
             self.bootbinary = singlejob_dict["bootbinary"]
@@ -55,12 +61,9 @@ class JobConfig:
             if self.parent_workload.derive_rootfs:
                 # No explicit workload rootfs, derive path from job name
                 self.rootfs = self.parent_workload.workload_input_base_dir + self.jobname + self.filesystemsuffix
-            elif self.parent_workload.common_rootfs is None:
-                # Don't include a rootfs
-                self.rootfs = None
             else:
-                # Explicit rootfs path from workload
-                self.rootfs = self.parent_workload.workload_input_base_dir + self.parent_workload.common_rootfs
+                # Explicit rootfs path from workload, or None for no rootfs
+                self.rootfs = self.parent_workload.common_rootfs_path
 
     def bootbinary_path(self) -> str:
         return self.parent_workload.workload_input_base_dir + self.bootbinary
@@ -87,21 +90,26 @@ class WorkloadConfig:
     workloadoutputs: str = 'results-workloads/'
     workloadfilename: str
     common_rootfs: Optional[str]
+    common_rootfs_path: Optional[str]
     derive_rootfs: bool
     common_bootbinary: str
     workload_name: str
-    common_outputs: str
+    common_outputs: List[str]
     common_simulation_outputs: List[str]
     common_simulation_inputs: List[str]
     workload_input_base_dir: str
     uniform_mode: bool
+    # give jobs qcow2 overlays of their rootfs instead of copies, see
+    # FireSimServerNode.uses_rootfs_overlay
+    rootfs_overlays: bool
     jobs: List[JobConfig]
     post_run_hook: str
     job_results_dir: str
     job_monitoring_dir: str
 
-    def __init__(self, workloadfilename: str, launch_time: str, suffixtag: str) -> None:
+    def __init__(self, workloadfilename: str, launch_time: str, suffixtag: str, rootfs_overlays: bool = False) -> None:
         self.workloadfilename = self.workloadinputs + workloadfilename
+        self.rootfs_overlays = rootfs_overlays
         workloadjson = None
         with open(self.workloadfilename) as json_data:
             workloadjson = json.load(json_data)
@@ -125,12 +133,21 @@ class WorkloadConfig:
 
         # rootfses, bootbinaries live here
         self.workload_input_base_dir = self.workloadinputs + self.workload_name + '/'
+        # shared by every job that inherits the workload rootfs
+        self.common_rootfs_path = None if self.common_rootfs is None else self.workload_input_base_dir + self.common_rootfs
         self.uniform_mode = workloadjson.get("workloads") is None
         if not self.uniform_mode:
             self.jobs = [JobConfig(job, self) for job in workloadjson.get("workloads")]
 
         self.post_run_hook = workloadjson.get("post_run_hook")
 
+        self.set_launch_time(launch_time, suffixtag)
+
+        #import code
+        #code.interact(local=locals())
+
+    def set_launch_time(self, launch_time: str, suffixtag: str) -> None:
+        """ Set the results directories for a run launched at launch_time. """
         appendsuffix = ""
         if suffixtag:
             appendsuffix = "-" + suffixtag
@@ -144,9 +161,6 @@ class WorkloadConfig:
         # hidden dir to keep job monitoring information
         self.job_monitoring_dir = self.job_results_dir + ".monitoring-dir/"
 
-        #import code
-        #code.interact(local=locals())
-
     def get_job(self, index: int) -> JobConfig:
         if not self.uniform_mode:
             return self.jobs[index]
@@ -3,6 +3,7 @@ from dataclasses import dataclass
 import pytest
 from pytest_mock import MockerFixture
 import os
+import stat
 from os.path import dirname
 from pathlib import Path
 
@@ -29,6 +30,11 @@ def aws_test_credentials():
     os.environ['AWS_DEFAULT_REGION'] = 'us-west-2'
 
 
+def pytest_addoption(parser):
+    parser.addoption("--run-benchmarks", action="store_true", default=False,
+                     help="also run every phase one scaling benchmark, with its timing checks")
+
+
 # Point moto to JSON of AMI's to load for various EC2 queries
 # The builtin AMI JSON doesn't have the FPGA Development AMI
 # This can't really be done as a fixture because it needs to be defined at moto import time
@@ -83,3 +89,46 @@ def task_mocker(mocker: MockerFixture):
 
     return TaskMocker(mocker)
 
+# stands in for ssh: runs the command locally, as if every host were this
+# machine. host "unreachable" fails like ssh does, with exit code 255
+FAKE_SSH = """#!/bin/sh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -o) shift 2 ;;
+        -N|-f) shift ;;
+        -O) exit 0 ;;
+        *) break ;;
+    esac
+done
+host="$1"
+shift
+echo "$host" >> "$FAKE_SSH_LOG"
+if [ "$host" = "unreachable" ]; then
+    echo "ssh: connect to host unreachable: No route to host" >&2
+    exit 255
+fi
+[ $# -eq 0 ] && exit 0
+# like a real ssh, killing it ends the remote command
+setsid sh -c "$*" &
+child=$!
+trap 'kill -- -$child; exit 143' TERM
+wait $child
+"""
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    """ An SSHConnectionPool whose ssh runs everything on this machine,
+    logging the hosts it connects to in FAKE_SSH_LOG. """
+    from runtools.ssh_pool import SSHConnectionPool
+
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    ssh = bindir / "ssh"
+    ssh.write_text(FAKE_SSH)
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_SSH_LOG", str(tmp_path / "ssh.log"))
+    pool = SSHConnectionPool(max_concurrency=2)
+    yield pool
+    pool.close()
+    assert not os.path.exists(pool.control_dir)
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import threading
+import time
+
+from runtools.artifact_broadcast import ArtifactBroadcast
+
+def test_artifact_broadcast(mocker):
+    hosts = [f"10.0.0.{i}" for i in range(32)]
+    uploads = []
+    # (source host, host) of every host to host copy
+    forwards = []
+    # hosts that had the whole file, and copies running from each source
+    holders = set()
+    sending = {None: 0}
+    max_sending = {None: 0}
+    lock = threading.Lock()
+    def transfer(source_host, host, ok):
+        with lock:
+            sending[source_host] = sending.get(source_host, 0) + 1
+            max_sending[source_host] = max(max_sending.get(source_host, 0), sending[source_host])
+        time.sleep(0.05)
+        with lock:
+            sending[source_host] -= 1
+            if ok:
+                holders.add(host)
+        return ok
+    def upload(local_path, host, dest_dir):
+        with lock:
+            uploads.append(host)
+        return transfer(None, host, True)
+    def forward(source_host, source_path, host, dest_dir):
+        assert source_path == f"/staging/{source_host}/driver.tar.gz"
+        with lock:
+            # only hosts that already have the whole file forward it
+            assert source_host in holders
+            forwards.append((source_host, host))
+        # one host is unreachable from the others
+        return transfer(source_host, host, host != "10.0.0.31")
+
+    broadcast = ArtifactBroadcast(mocker.Mock(max_concurrency=64), fanout=2)
+    mocker.patch.object(broadcast, "upload", side_effect=upload)
+    mocker.patch.object(broadcast, "forward", side_effect=forward)
+    broadcast.run({"/local/driver.tar.gz": {host: f"/staging/{host}" for host in hosts}})
+
+    received = broadcast.received["/local/driver.tar.gz"]
+    assert sorted(received) == sorted(holders)
+    # every host is sent the file once
+    assert sorted(uploads + [host for _, host in forwards]) == sorted(hosts)
+    assert ("10.0.0.31" in received) == ("10.0.0.31" in uploads)
+    assert len(received) >= len(hosts) - 1
+    # the manager sends at most fanout copies at once, and every holder
+    # one copy at a time
+    assert max_sending[None] <= 2
+    assert all(count == 1 for source_host, count in max_sending.items() if source_host is not None)
+
+    # the copies form a tree rooted at the manager's uploads, in which
+    # hosts that were forwarded the file forward it further, so most hosts
+    # get it from other hosts rather than from the manager
+    depth = {host: 1 for host in uploads}
+    for source_host, host in forwards:
+        depth[host] = depth[source_host] + 1
+    assert max(depth.values()) >= 3
+    assert len(forwards) > len(uploads)
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import os
+
+from runtools.run_farm_deploy_managers import InstanceDeployManager
+from runtools.host_capabilities import HostCapabilities, PROBED_MODULES, probe_command, parse_probe_output
+
+def test_host_capability_probe(pool, mocker, tmp_path):
+    output = pool.run("localhost", probe_command(str(tmp_path / "not" / "there")))
+    capabilities = parse_probe_output(output)
+    assert capabilities.shell == os.environ.get("SHELL", "")
+    assert capabilities.kernel == os.uname().release
+    assert capabilities.sim_dir_free_kb is not None and capabilities.sim_dir_free_kb > 0
+    assert capabilities.modules <= set(PROBED_MODULES)
+
+    # deploy managers use the probed capabilities instead of asking the host
+    run = mocker.patch("runtools.run_farm_deploy_managers.run")
+    probe_sudo = mocker.patch("runtools.run_farm_deploy_managers.probe_sudo")
+    idm = mocker.Mock()
+    idm.parent_node.capabilities = HostCapabilities(shell="/bin/bash", sudo=True, kernel="", sim_dir_free_kb=None, modules={'nbd'})
+    assert InstanceDeployManager.has_sudo(idm)
+    assert InstanceDeployManager.module_loaded(idm, 'nbd')
+    assert not InstanceDeployManager.module_loaded(idm, 'xdma')
+    InstanceDeployManager.set_module_loaded(idm, 'xdma', True)
+    assert idm.parent_node.capabilities.modules == {'nbd', 'xdma'}
+    run.assert_not_called()
+    probe_sudo.assert_not_called()
+
+    idm.parent_node.capabilities = None
+    InstanceDeployManager.has_sudo(idm)
+    probe_sudo.assert_called_once()
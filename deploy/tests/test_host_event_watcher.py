@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import stat
+
+from runtools.host_event_watcher import HostEventWatcher
+
+SCREEN_LS = """There are screens on:
+	1234.fsim0	(Detached)
+	1240.fsim2	(Detached)
+	1250.switch3	(Detached)
+3 Sockets in /run/screen/S-centos.
+"""
+
+def test_host_event_watcher(pool, tmp_path, monkeypatch):
+    screen_ls = tmp_path / "screen-ls"
+    screen_ls.write_text(SCREEN_LS)
+    screen = tmp_path / "bin" / "screen"
+    screen.write_text(f"#!/bin/sh\ncat {screen_ls}\n")
+    screen.chmod(screen.stat().st_mode | stat.S_IEXEC)
+
+    watcher = HostEventWatcher(pool, ["a", "b"])
+    watcher.start()
+    try:
+        # what is running when watching starts is not a change
+        assert not watcher.wait(3)
+        assert watcher.screens == {"a": ["fsim0", "fsim2", "switch3"], "b": ["fsim0", "fsim2", "switch3"]}
+
+        screen_ls.write_text(SCREEN_LS.replace("1240.fsim2", "1240.notasim"))
+        assert watcher.wait(10)
+        assert ["fsim0", "switch3"] in watcher.screens.values()
+    finally:
+        watcher.stop()
+
+def test_host_event_watcher_keeps_changes_between_waits(pool):
+    watcher = HostEventWatcher(pool, [])
+    # reported while nobody waits, e.g. between two polls
+    watcher.notify()
+    assert watcher.wait(0)
+    assert not watcher.wait(0)
+    watcher.notify()
+    watcher.notify()
+    assert watcher.wait(0)
+    assert not watcher.wait(0.1)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+
+from runtools.pass_manager import PassManager
+
+
+class Recorder:
+    """ Passes that log their calls. """
+    def __init__(self) -> None:
+        self.calls = []
+
+    def make_macs(self) -> None:
+        self.calls.append('make_macs')
+
+    def make_tables(self) -> None:
+        self.calls.append('make_tables')
+
+    def fetch(self, dir) -> None:
+        self.calls.append(('fetch', dir))
+
+    def build(self, servers) -> None:
+        self.calls.append(('build', servers))
+
+
+def make_pass_manager(recorder: Recorder) -> PassManager:
+    pass_manager = PassManager()
+    pass_manager.add_pass(recorder.make_tables, requires=['macs'], provides=['tables'])
+    pass_manager.add_pass(recorder.make_macs, provides=['macs'])
+    pass_manager.add_pass(recorder.fetch, requires=['dir'], provides=['fetched'])
+    pass_manager.add_pass(recorder.build, requires=['fetched', 'tables', 'servers'], provides=['built'])
+    return pass_manager
+
+
+def test_passes_run_after_dependencies_and_only_when_inputs_change():
+    recorder = Recorder()
+    pass_manager = make_pass_manager(recorder)
+
+    pass_manager.run('make_tables')
+    assert recorder.calls == ['make_macs', 'make_tables']
+
+    pass_manager.run('build', dir='a', servers=[1, 2])
+    assert recorder.calls[2:] == [('fetch', 'a'), ('build', [1, 2])]
+    assert set(pass_manager.timings) == {'make_macs', 'make_tables', 'fetch', 'build'}
+
+    # nothing changed
+    pass_manager.run('build', dir='a', servers=[1, 2])
+    assert len(recorder.calls) == 4
+
+    # only the pass reading the changed input reruns
+    pass_manager.run('build', dir='a', servers=[3])
+    assert recorder.calls[4:] == [('build', [3])]
+
+    # and everything downstream of a changed artifact
+    pass_manager.invalidate('macs')
+    pass_manager.run('build', dir='a', servers=[3])
+    assert recorder.calls[5:] == ['make_tables', ('build', [3])]
+
+
+def test_missing_input_and_duplicate_producer():
+    recorder = Recorder()
+    pass_manager = make_pass_manager(recorder)
+    with pytest.raises(AssertionError, match="requires input dir"):
+        pass_manager.run('fetch')
+
+    def other_macs() -> None:
+        pass
+    with pytest.raises(AssertionError, match="provided by both"):
+        pass_manager.add_pass(other_macs, provides=['macs'])
+
+
+def test_threadsafe_passes_overlap_other_passes():
+    # the threadsafe pass waits for the inline one to start, which would
+    # deadlock if they ran one after the other
+    inline_started = threading.Event()
+    threads = {}
+
+    def slow_build() -> None:
+        threads['slow_build'] = threading.current_thread()
+        assert inline_started.wait(timeout=10)
+
+    def inline_pass() -> None:
+        threads['inline_pass'] = threading.current_thread()
+        inline_started.set()
+
+    def last_pass() -> None:
+        pass
+
+    pass_manager = PassManager(max_workers=2)
+    pass_manager.add_pass(slow_build, provides=['binaries'], threadsafe=True)
+    pass_manager.add_pass(inline_pass, provides=['drivers'])
+    pass_manager.add_pass(last_pass, requires=['binaries', 'drivers'])
+    pass_manager.run('last_pass')
+
+    assert threads['inline_pass'] is threading.current_thread()
+    assert threads['slow_build'] is not threading.current_thread()
+    assert pass_manager.is_current('last_pass')
+
+
+def test_failing_threadsafe_pass_propagates():
+    def failing() -> None:
+        raise SystemExit(1)
+
+    pass_manager = PassManager()
+    pass_manager.add_pass(failing, threadsafe=True)
+    with pytest.raises(SystemExit):
+        pass_manager.run('failing')
+    assert not pass_manager.is_current('failing')
@@ -0,0 +1,141 @@
+""" Scaling benchmark for FireSimTopologyWithPasses.phase_one_passes().
+
+Each case builds a topology against an ExternallyProvisioned run farm with
+just enough hosts, times every phase one pass and records the peak Python
+memory allocated, then compares against phase_one_benchmark_baseline.json.
+
+Timings depend on the machine and its load, so they are only checked with
+--run-benchmarks. Peak memory does not, so the default test run checks it
+for SMOKE_CASE, which keeps CI gating phase one's memory use without timing
+anything. To record a new baseline after an intentional change, run:
+
+    FIRESIM_UPDATE_BENCHMARK_BASELINE=1 pytest tests/test_phase_one_benchmark.py --run-benchmarks
+"""
+
+from __future__ import annotations
+
+import gc
+import json
+import math
+import os
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+from runtools.run_farm import ExternallyProvisioned
+from runtools.simulation_data_classes import TracerVConfig, AutoCounterConfig, HostDebugConfig, SynthPrintConfig
+from runtools.workload import WorkloadConfig
+
+from typing import Any, Dict, Tuple
+
+BASELINE_PATH = Path(__file__).parent / "phase_one_benchmark_baseline.json"
+
+# a pass regresses if it is this many times slower than its baseline (plus
+# TIME_SLACK_S, so that very short passes do not fail on timer noise), or if
+# phase one's peak memory grows this many times
+TIME_TOLERANCE = 3.0
+TIME_SLACK_S = 0.05
+MEMORY_TOLERANCE = 1.5
+
+# the case whose peak memory the default test run checks
+SMOKE_CASE = "leaf_spine_512"
+
+# name: (topology, topology_params, slots per host)
+CASES: Dict[str, Tuple[str, Dict[str, Any], int]] = {
+    "leaf_spine_8": ("leaf_spine", dict(num_leaves=1, servers_per_leaf=8, oversubscription=8), 8),
+    "leaf_spine_64": ("leaf_spine", dict(num_leaves=8, servers_per_leaf=8, oversubscription=8), 8),
+    "leaf_spine_512": ("leaf_spine", dict(num_leaves=64, servers_per_leaf=8, oversubscription=4), 8),
+    "leaf_spine_4096": ("leaf_spine", dict(num_leaves=512, servers_per_leaf=8, oversubscription=4), 8),
+    "fat_tree_26ary": ("fat_tree", dict(k=26), 16),
+}
+
+
+def make_run_farm(num_hosts: int, slots_per_host: int) -> ExternallyProvisioned:
+    args = {
+        "default_platform": "EC2InstanceDeployManager",
+        "default_simulation_dir": "/home/centos",
+        "run_farm_host_specs": [{"bench_spec": {"num_fpgas": slots_per_host, "num_metasims": 0, "use_for_switch_only": False}}],
+        "run_farm_hosts_to_use": [{f"10.0.{x // 256}.{x % 256}": "bench_spec"} for x in range(num_hosts)],
+    }
+    return ExternallyProvisioned(args, False)
+
+
+def run_phase_one(topology: str, params: Dict[str, Any], slots_per_host: int, mocker: Any) -> FireSimTopologyWithPasses:
+    """ Construct the topology with passes, which runs phase one. """
+    # hosts for the largest unit of one switch and its servers per host
+    num_servers = {
+        "leaf_spine": lambda: params["num_leaves"] * params["servers_per_leaf"],
+        "fat_tree": lambda: params["k"] ** 3 // 4,
+    }[topology]()
+    num_hosts = math.ceil(num_servers / (slots_per_host // 2)) + 1
+    hwdb = mocker.MagicMock()
+    workload = WorkloadConfig("bench.json", "benchmark", "")
+    return FireSimTopologyWithPasses(
+        topology, 0, make_run_farm(num_hosts, slots_per_host), hwdb, "bench_hwconfig",
+        workload, 6405, 10, 200, -1,
+        TracerVConfig({}), AutoCounterConfig({}), HostDebugConfig({}), SynthPrintConfig({}),
+        False, mocker.MagicMock(), False, "",
+        'compile_time', 'none', params)
+
+
+def load_baseline() -> Dict[str, Any]:
+    if BASELINE_PATH.exists():
+        return json.loads(BASELINE_PATH.read_text())
+    return {}
+
+
+@pytest.mark.parametrize("case", list(CASES.keys()))
+def test_phase_one_benchmark(case, request, mocker, monkeypatch, tmp_path):
+    topology, params, slots_per_host = CASES[case]
+    run_benchmarks = request.config.getoption("--run-benchmarks")
+    if not run_benchmarks and case != SMOKE_CASE:
+        pytest.skip("benchmark, use --run-benchmarks")
+
+    # a uniform workload with a qcow2 rootfs, so NBD allocation does work
+    (tmp_path / "bench.json").write_text(json.dumps({"benchmark_name": "bench", "common_bootbinary": "bench-bin", "common_rootfs": "bench.qcow2"}))
+    monkeypatch.setattr(WorkloadConfig, "workloadinputs", str(tmp_path) + "/")
+    # RunFarm looks up the default simulation dir from $USER
+    monkeypatch.setenv("USER", os.environ.get("USER", "centos"))
+
+    # timings come from an untraced run, since tracemalloc slows everything down.
+    # like timeit, keep the cyclic GC out of the timed region: otherwise a
+    # full collection over garbage left behind by earlier tests lands in
+    # whichever pass happens to trigger it
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        passes = run_phase_one(topology, params, slots_per_host, mocker)
+        timings = dict(passes.pass_timings)
+        timings["total"] = time.perf_counter() - start
+    finally:
+        gc.enable()
+    del passes
+
+    tracemalloc.start()
+    try:
+        run_phase_one(topology, params, slots_per_host, mocker)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = {"timings_s": {k: round(v, 4) for k, v in timings.items()}, "peak_memory_bytes": peak_bytes}
+
+    baseline = load_baseline()
+    if run_benchmarks and os.environ.get("FIRESIM_UPDATE_BENCHMARK_BASELINE"):
+        baseline[case] = result
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=4, sort_keys=True) + "\n")
+        return
+
+    if case not in baseline:
+        pytest.skip(f"no baseline recorded for {case}")
+    expected = baseline[case]
+    if run_benchmarks:
+        for passname, seconds in timings.items():
+            limit = expected["timings_s"].get(passname, 0.0) * TIME_TOLERANCE + TIME_SLACK_S
+            assert seconds <= limit, f"{case}: {passname} took {seconds:.3f}s, baseline {expected['timings_s'].get(passname)}s"
+    memory_limit = expected["peak_memory_bytes"] * MEMORY_TOLERANCE
+    assert peak_bytes <= memory_limit, f"{case}: phase one peak memory {peak_bytes} bytes, baseline {expected['peak_memory_bytes']} bytes"
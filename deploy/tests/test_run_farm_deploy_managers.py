@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import subprocess
+import tarfile
+import threading
+import pytest
+
+from runtools.run_farm_deploy_managers import InstanceDeployManager, CopyBackQueue
+from runtools.ssh_pool import RemoteCommandError
+from runtools.artifact_store import ArtifactDigestCache, EXTRACTED_SUFFIX, parse_manifest
+from runtools.host_capabilities import HostCapabilities
+
+def make_sim_host(mocker, tmp_path, overlays=False, rootfs_symlink=False):
+    """ Mock a host with three slots sharing a driver tarball, runtime
+    conf and rootfs. Its "remote" is this machine. With rootfs_symlink, the
+    rootfs is a link to an image with a different name, like the ones
+    workloads point at built images with. """
+    rootfs_suffix = ".qcow2" if overlays else ""
+    local_dir = tmp_path / "local"
+    local_dir.mkdir()
+    (local_dir / "runtime.conf").write_text("conf")
+    # mostly holes, like a real rootfs
+    rootfs_image = local_dir / "rootfs.img"
+    if rootfs_symlink:
+        (local_dir / "images").mkdir()
+        rootfs_image = local_dir / "images" / "br-base-bin.img"
+        (local_dir / "rootfs.img").symlink_to(rootfs_image)
+    with open(rootfs_image, "wb") as f:
+        f.truncate(64 << 20)
+        f.seek(-6, os.SEEK_END)
+        f.write(b"rootfs")
+    (local_dir / "driver").write_text("driver")
+    with tarfile.open(local_dir / "bundle.tar.gz", "w:gz") as tar:
+        tar.add(local_dir / "driver", arcname="FireSim-f1")
+    sim_dir = tmp_path / "remote"
+
+    slots = []
+    for slotno in range(3):
+        serv = mocker.Mock()
+        serv.get_slot_nodes.return_value = [serv]
+        serv.uses_rootfs_overlay.return_value = overlays
+        serv.get_required_files_local_paths.return_value = [
+            (str(local_dir / "rootfs.img"), f"job{slotno}-rootfs.img{rootfs_suffix}"),
+            (str(local_dir / "bundle.tar.gz"), "driver-bundle.tar.gz"),
+        ]
+        hwcfg = serv.get_resolved_server_hardware_config.return_value
+        hwcfg.get_local_uri_paths.return_value = [(str(local_dir / "runtime.conf"), "")]
+        hwcfg.get_driver_tar_filename.return_value = "driver-bundle.tar.gz"
+        serv.get_all_rootfs_names.return_value = [f"job{slotno}-rootfs.img{rootfs_suffix}"]
+        serv.get_rootfs_name.return_value = f"job{slotno}-rootfs.img{rootfs_suffix}"
+        slots.append(serv)
+
+    idm = mocker.Mock()
+    idm.parent_node.sim_slots = slots
+    idm.parent_node.get_sim_dir.return_value = str(sim_dir)
+    idm.parent_node.capabilities = HostCapabilities(shell="/bin/bash", sudo=False, kernel="", sim_dir_free_kb=None, has_zstd=True)
+    idm.get_artifact_store_dir.side_effect = lambda: InstanceDeployManager.get_artifact_store_dir(idm)
+    idm.get_incoming_dir.side_effect = lambda digest: InstanceDeployManager.get_incoming_dir(idm, digest)
+    idm.artifact_digests = ArtifactDigestCache(str(tmp_path / "digests.json"))
+    idm.store_manifest = None
+    idm.get_sim_slot_files.side_effect = lambda slotno, uridir: InstanceDeployManager.get_sim_slot_files(idm, slotno, uridir)
+    idm.upload_disk_image.side_effect = lambda local_path, remote_dir: InstanceDeployManager.upload_disk_image(idm, local_path, remote_dir)
+    idm.get_remote_sim_dir_for_slot.side_effect = lambda slotno: InstanceDeployManager.get_remote_sim_dir_for_slot(idm, slotno)
+
+    def rsync_project(local_dir, remote_dir, **kwargs):
+        subprocess.run(["cp", "-rL", local_dir, remote_dir], check=True)
+        return mocker.Mock()
+    mocks = {}
+    mocks['rsync'] = mocker.patch("runtools.run_farm_deploy_managers.rsync_project", side_effect=rsync_project)
+    mocker.patch("runtools.image_transfer.fabric_ssh_command", return_value="sh -c")
+    mocks['local'] = mocker.patch("runtools.run_farm_deploy_managers.local", side_effect=lambda cmd, shell: subprocess.run(cmd, shell=True, executable=shell, check=True))
+    mocker.patch("runtools.run_farm_deploy_managers.run", side_effect=lambda cmd, **kwargs: subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True).stdout)
+
+    return idm, local_dir, sim_dir, mocks
+
+def test_copy_sim_infrastructure_uses_artifact_store(mocker, tmp_path):
+    idm, local_dir, sim_dir, mocks = make_sim_host(mocker, tmp_path)
+    rsync = mocks['rsync']
+    local = mocks['local']
+    InstanceDeployManager.copy_sim_infrastructure(idm, "uridir")
+
+    # each distinct file crosses the network once, the rootfs compressed
+    assert sorted(call.kwargs['local_dir'] for call in rsync.call_args_list) == sorted(str(local_dir / f) for f in ["bundle.tar.gz", "runtime.conf"])
+    assert len(local.call_args_list) == 1 and "zstd" in local.call_args.args[0]
+    inodes = {}
+    for slotno in range(3):
+        slot_dir = sim_dir / f"sim_slot_{slotno}"
+        assert (slot_dir / "runtime.conf").read_text() == "conf"
+        assert (slot_dir / "FireSim-f1").read_text() == "driver"
+        rootfs = slot_dir / f"job{slotno}-rootfs.img"
+        assert rootfs.stat().st_size == 64 << 20
+        assert rootfs.read_bytes()[-6:] == b"rootfs"
+        # holes are kept
+        assert rootfs.stat().st_blocks * 512 < 1 << 20
+        for name in ["runtime.conf", "FireSim-f1", "driver-bundle.tar.gz", f"job{slotno}-rootfs.img"]:
+            inodes.setdefault(name.replace(f"job{slotno}", "job"), set()).add(os.stat(slot_dir / name).st_ino)
+    # shared files are hardlinks, rootfses are copies of their own
+    assert len(inodes["runtime.conf"]) == 1
+    assert len(inodes["FireSim-f1"]) == 1
+    assert len(inodes["driver-bundle.tar.gz"]) == 1
+    assert len(inodes["job-rootfs.img"]) == 3
+
+    # nothing is sent again, and infrasetup can run over the old files
+    rsync.reset_mock()
+    InstanceDeployManager.copy_sim_infrastructure(idm, "uridir")
+    rsync.assert_not_called()
+    assert (sim_dir / "sim_slot_2" / "FireSim-f1").read_text() == "driver"
+    assert not os.listdir(sim_dir / "artifact_store" / ".incoming")
+
+    # only the changed file is, and the old one is evicted
+    (local_dir / "runtime.conf").write_text("conf2")
+    mocker.patch("runtools.artifact_store.ARTIFACT_STORE_MAX_ENTRIES", 0)
+    InstanceDeployManager.copy_sim_infrastructure(idm, "uridir")
+    assert [call.kwargs['local_dir'] for call in rsync.call_args_list] == [str(local_dir / "runtime.conf")]
+    assert (sim_dir / "sim_slot_1" / "runtime.conf").read_text() == "conf2"
+    # 3 files, the extracted tarball and the empty incoming dir
+    assert len(os.listdir(sim_dir / "artifact_store")) == 3 + 1 + 1
+
+def test_copy_sim_infrastructure_symlinked_rootfs(mocker, tmp_path):
+    idm, local_dir, sim_dir, mocks = make_sim_host(mocker, tmp_path, rootfs_symlink=True)
+    InstanceDeployManager.copy_sim_infrastructure(idm, "uridir")
+
+    assert len(mocks['local'].call_args_list) == 1 and "zstd" in mocks['local'].call_args.args[0]
+    for slotno in range(3):
+        rootfs = sim_dir / f"sim_slot_{slotno}" / f"job{slotno}-rootfs.img"
+        assert not rootfs.is_symlink()
+        assert rootfs.read_bytes()[-6:] == b"rootfs"
+
+def test_artifact_digest_cache(mocker, tmp_path):
+    (tmp_path / "dir" / "sub").mkdir(parents=True)
+    (tmp_path / "dir" / "sub" / "a").write_text("a")
+    (tmp_path / "file").write_text("a")
+    cache = ArtifactDigestCache(str(tmp_path / "digests.json"))
+    file_digest = cache.digest(str(tmp_path / "file"))
+    dir_digest = cache.digest(str(tmp_path / "dir"))
+    assert file_digest != dir_digest
+    cache.save()
+
+    # digests of unchanged files come from the cache file
+    sha256 = mocker.patch("runtools.artifact_store.hashlib.sha256", wraps=hashlib.sha256)
+    cache = ArtifactDigestCache(str(tmp_path / "digests.json"))
+    assert cache.digest(str(tmp_path / "file")) == file_digest
+    sha256.assert_not_called()
+    assert cache.digest(str(tmp_path / "dir")) == dir_digest
+    (tmp_path / "dir" / "sub" / "a").chmod(0o755)
+    assert cache.digest(str(tmp_path / "dir")) != dir_digest
+
+def test_parse_manifest():
+    digest = "ab" * 32
+    listing = f"{digest}\n{digest}{EXTRACTED_SUFFIX}\n{'cd' * 31}\n{digest}.tmp\n"
+    # interrupted uploads are not entries
+    assert parse_manifest(listing) == {digest, digest + EXTRACTED_SUFFIX}
+
+def test_copy_sim_infrastructure_rootfs_overlays(mocker, tmp_path, monkeypatch):
+    # stands in for qemu-img create -q -f qcow2 -F raw -b BACKING OVERLAY
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    qemu_img = bindir / "qemu-img"
+    qemu_img.write_text('#!/bin/sh\necho "backing $8" > "$9"\n')
+    qemu_img.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    idm, local_dir, sim_dir, mocks = make_sim_host(mocker, tmp_path, overlays=True)
+
+    InstanceDeployManager.copy_sim_infrastructure(idm, "uridir")
+
+    # the image is sent once, and every slot's overlay is backed by a link
+    # to it
+    assert len(mocks['local'].call_args_list) == 1
+    store_dir = sim_dir / "artifact_store"
+    stored = store_dir / idm.artifact_digests.digest(str(local_dir / "rootfs.img"))
+    assert stored.read_bytes()[-6:] == b"rootfs"
+    for slotno in range(3):
+        overlay = sim_dir / f"sim_slot_{slotno}" / f"job{slotno}-rootfs.img.qcow2"
+        assert overlay.read_text().split() == ["backing", f"job{slotno}-rootfs.img.qcow2.backing"]
+        assert os.stat(f"{overlay}.backing").st_ino == stored.stat().st_ino
+
+    # evicting the image from the store leaves the overlays' backing files
+    stored.unlink()
+    assert (sim_dir / "sim_slot_0" / "job0-rootfs.img.qcow2.backing").read_bytes()[-6:] == b"rootfs"
+
+def test_infrasetup_switches_copies_only_changed_switches(mocker):
+    idm = mocker.Mock()
+    changed, unchanged = mocker.Mock(), mocker.Mock()
+    idm.parent_node.switch_slots = [unchanged, changed]
+    idm.instance_assigned_switches.return_value = True
+
+    InstanceDeployManager.infrasetup_switches_instance(idm, [changed])
+    idm.copy_switch_slot_infrastructure.assert_called_once_with(1)
+
+SCREEN_LS = """There are screens on:
+	1234.fsim0	(Detached)
+	1240.fsim2	(Detached)
+	1250.switch3	(Detached)
+3 Sockets in /run/screen/S-centos.
+"""
+
+def test_monitor_polling_without_fabric(mocker):
+    status = InstanceDeployManager.parse_screen_status(SCREEN_LS)
+    assert status == {'switches': ['switch3'], 'simdrivers': ['0', '2']}
+
+    idm = mocker.Mock()
+    idm.instance_assigned_simulations.return_value = True
+    idm.parent_node.sim_slots = [mocker.Mock(**{'get_job_name.return_value': f"job{i}"}) for i in range(3)]
+    def requires_remote_work(prior_completed_jobs, is_final_loop=False, is_networked=True, terminateoncompletion=False):
+        return InstanceDeployManager.monitor_requires_remote_work(idm, prior_completed_jobs, is_final_loop, is_networked, terminateoncompletion, status)
+
+    idm.instance_assigned_switches.return_value = False
+    # job1 just finished, its results are only queued for copy-back
+    assert not requires_remote_work([])
+    # unless it is the last job on a host with switches to kill
+    assert not requires_remote_work(["job0", "job2"])
+    idm.instance_assigned_switches.return_value = True
+    assert requires_remote_work(["job0", "job2"])
+    # nothing new to do
+    assert not requires_remote_work(["job1"])
+    assert requires_remote_work(["job1"], is_final_loop=True)
+    # all jobs were done before, the host may still have to be terminated
+    assert not requires_remote_work(["job0", "job1", "job2"], terminateoncompletion=True)
+    assert requires_remote_work(["job0", "job1", "job2"], is_networked=False, terminateoncompletion=True)
+
+    idm.instance_assigned_simulations.return_value = False
+    idm.instance_assigned_switches.return_value = True
+    assert not requires_remote_work([])
+
+def test_copy_back_queue(mocker):
+    # slots 0-4 are on host a, slot 5 on host b
+    running = {"a": 0, "b": 0}
+    max_running = {"a": 0, "b": 0}
+    lock = threading.Lock()
+    # the first WORKERS_PER_HOST copies on a and the copy on b can only get
+    # past this if they all run at once
+    all_started = threading.Barrier(CopyBackQueue.WORKERS_PER_HOST + 1)
+    release = threading.Event()
+    def copy_back(slotno, sudo, ssh_pool):
+        host = "b" if slotno == 5 else "a"
+        with lock:
+            running[host] += 1
+            max_running[host] = max(max_running[host], running[host])
+        if slotno != 4:
+            all_started.wait(timeout=10)
+        assert release.wait(timeout=10)
+        with lock:
+            running[host] -= 1
+        if slotno == 5:
+            raise RemoteCommandError("copy failed")
+
+    on_copied = mocker.Mock()
+    queue = CopyBackQueue(mocker.Mock(), on_copied=on_copied)
+    servers = []
+    for slotno in range(6):
+        server = mocker.Mock(**{'copy_back_job_results_from_run.side_effect': copy_back, 'get_job_name.return_value': f"job{slotno}"})
+        server.get_slot_nodes.return_value = [server]
+        servers.append(server)
+    for slotno, server in enumerate(servers[:5]):
+        queue.submit("a", server, slotno, False)
+    queue.submit("b", servers[5], 5, False)
+    # jobs are in flight until their results are copied back
+    assert queue.is_in_flight("a", "job0") and not queue.is_in_flight("b", "job0")
+    for server in servers:
+        server.write_job_complete_file.assert_not_called()
+    assert queue.has_outstanding("a")
+    release.set()
+
+    queue.wait(["a"])
+    assert not queue.has_outstanding("a")
+    assert not all_started.broken
+    assert max_running["a"] <= CopyBackQueue.WORKERS_PER_HOST
+    for server in servers[:5]:
+        server.write_job_complete_file.assert_called_once()
+    with pytest.raises(RemoteCommandError):
+        queue.shutdown()
+    # a failed copy doesn't mark its job complete, and isn't queued again
+    servers[5].write_job_complete_file.assert_not_called()
+    # every successful copy wakes up the monitor
+    assert on_copied.call_count == 5
+    assert queue.is_in_flight("b", "job5")
+    assert not queue.is_in_flight("a", "job0")
+
+def test_monitor_skips_jobs_in_flight(mocker):
+    idm = mocker.Mock()
+    idm.instance_assigned_simulations.return_value = True
+    idm.instance_assigned_switches.return_value = False
+    idm.parent_node.get_host.return_value = "a"
+    idm.parent_node.sim_slots = [mocker.Mock(**{'get_job_name.return_value': f"job{i}"}) for i in range(3)]
+    queue = mocker.Mock()
+    queue.is_in_flight.side_effect = lambda host, jobname: jobname == "job0"
+    status = {'switches': [], 'simdrivers': ['2']}
+
+    # job0 is still being copied back: not complete, and not queued again
+    state = InstanceDeployManager.monitor_jobs_instance(idm, [], False, False, False, "results", queue, status)
+    assert state['sims'] == {"job0": False, "job1": True, "job2": False}
+    queue.submit.assert_called_once_with("a", idm.parent_node.sim_slots[1], 1, idm.has_sudo.return_value)
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import pytest
+
+from runtools.ssh_pool import RemoteCommandError
+
+def test_run_on_hosts(pool, tmp_path):
+    hosts = [f"10.0.0.{i}" for i in range(5)] + ["unreachable"]
+    results = pool.run_on_hosts(hosts, "echo out; echo err >&2; exit 3", warn_only=True)
+    assert list(results.keys()) == hosts
+    for host in hosts[:-1]:
+        assert results[host] == "out"
+        assert results[host].stderr == "err"
+        assert results[host].return_code == 3
+    assert results["unreachable"].return_code == 255
+    # every host is connected once, then reused
+    assert pool.connected_hosts == set(hosts[:-1])
+    pool.run_on_hosts(hosts[:-1], "true")
+    log = (tmp_path / "ssh.log").read_text().split()
+    assert log.count("10.0.0.0") == 3
+
+    with pytest.raises(RemoteCommandError):
+        pool.run("10.0.0.0", "exit 1")
+
+def test_call_on_hosts(pool):
+    hosts = ["a", "b", "c"]
+    results = pool.call_on_hosts(hosts, lambda host: pool.run(host, f"echo {host}{host}"))
+    assert results == {"a": "aa", "b": "bb", "c": "cc"}
+
+def test_ssh_options_use_fabric_login(pool, monkeypatch, tmp_path):
+    from fabric.api import env
+
+    key = tmp_path / "firesim.pem"
+    key.write_text("")
+    monkeypatch.setattr(env, "user", "centos")
+    monkeypatch.setattr(env, "key_filename", str(key))
+    options = pool.ssh_options()
+    assert options[options.index("User=centos") - 1] == "-o"
+    assert f"IdentityFile={key}" in options
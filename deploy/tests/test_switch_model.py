@@ -0,0 +1,93 @@
+import os
+
+from runtools.switch_model_config import SwitchBuildCache
+
+
+def make_build_dir(path, config):
+    path.mkdir()
+    (path / "switch.cc").write_text("int main() {}\n")
+    (path / "Makefile").write_text("all: switch\n")
+    (path / "switchconfig.h").write_text(config)
+    (path / "switchlog").write_text("not a source\n")
+    return path
+
+
+def test_build_cache_key_tracks_sources(tmp_path):
+    cache = SwitchBuildCache(str(tmp_path / "cache"))
+    a = make_build_dir(tmp_path / "a", "#define NUMPORTS 2\n")
+    b = make_build_dir(tmp_path / "b", "#define NUMPORTS 2\n")
+    c = make_build_dir(tmp_path / "c", "#define NUMPORTS 3\n")
+    (b / "switchlog").write_text("different non-source files are ignored\n")
+
+    assert cache.key_for_build_dir(str(a), "switch") == cache.key_for_build_dir(str(b), "switch")
+    assert cache.key_for_build_dir(str(a), "switch") != cache.key_for_build_dir(str(c), "switch")
+    assert cache.key_for_build_dir(str(a), "switch") != cache.key_for_build_dir(str(a), "switch-runtime")
+
+
+def test_build_cache_hit_and_lru_eviction(tmp_path):
+    cache = SwitchBuildCache(str(tmp_path / "cache"), max_entries=2)
+    binary = tmp_path / "switch0"
+    binary.write_bytes(b"\x7fELF")
+    dest = str(tmp_path / "out")
+
+    assert not cache.fetch("k1", dest)
+    cache.store("k1", str(binary))
+    assert cache.fetch("k1", dest)
+    assert open(dest, "rb").read() == b"\x7fELF"
+
+    cache.store("k2", str(binary))
+    # make k1 the least recently used entry, then overflow the cache
+    os.utime(tmp_path / "cache" / "k1", (0, 0))
+    cache.store("k3", str(binary))
+
+    assert not cache.fetch("k1", dest)
+    assert cache.fetch("k2", dest)
+    assert cache.fetch("k3", dest)
+
+    # publishing an entry that already exists keeps the existing one
+    cache.store("k3", str(binary))
+    assert sorted(x for x in os.listdir(tmp_path / "cache") if not x.startswith(".")) == ["k2", "k3"]
+
+
+def test_parallel_switch_builds_report_first_failure(mocker, tmp_path):
+    import pytest
+    from unittest.mock import MagicMock
+    from runtools.firesim_topology_core import FireSimTopology
+    from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+    from runtools.switch_model_config import AbstractSwitchToSwitchConfig
+
+    srcdir = tmp_path / "switch"
+    srcdir.mkdir()
+    (srcdir / "switch.cc").write_text("int main() {}\n")
+    (srcdir / "Makefile").write_text("all: switch\n")
+    mocker.patch.object(AbstractSwitchToSwitchConfig, "switch_build_local_dir", return_value=str(srcdir) + "/")
+
+    topol = FireSimTopology('example_16config', 4)
+    passes = FireSimTopologyWithPasses.__new__(FireSimTopologyWithPasses)
+    passes.firesimtopol = topol
+    passes.pass_assign_mac_addresses()
+    passes.pass_compute_switching_tables()
+    host = MagicMock()
+    for node in topol.get_dfs_order():
+        node.assign_host_instance(host)
+    failing = topol.get_dfs_order_switches()[1].switch_builder
+
+    def fake_make(self, switchbuilddir, target, logpath):
+        with open(logpath, "w") as logfile:
+            logfile.write(f"log for {self.switch_binary_name()}\n")
+        if self is failing:
+            return False
+        with open(switchbuilddir + "switch", "w") as binary:
+            binary.write("binary")
+        return True
+    mocker.patch.object(AbstractSwitchToSwitchConfig, "run_make", fake_make)
+    logger = mocker.patch("runtools.switch_model_config.rootLogger")
+
+    with pytest.raises(SystemExit):
+        passes.pass_build_required_switches()
+
+    logged = [str(c.args[0]) for c in logger.info.call_args_list]
+    assert f"log for {failing.switch_binary_name()}\n" in logged
+    for switch in topol.get_dfs_order_switches():
+        if switch.switch_builder is not failing:
+            assert os.path.exists(switch.switch_builder.switch_binary_local_path())
@@ -0,0 +1,547 @@
+from __future__ import annotations
+
+import os
+import pytest
+import subprocess
+from collections import Counter
+
+from runtools.firesim_topology_core import FireSimTopology, FireSimTopologyIndex
+from runtools.firesim_topology_elements import FireSimServerNode, FireSimSwitchNode
+
+from typing import List, TYPE_CHECKING
+if TYPE_CHECKING:
+    from runtools.firesim_topology_elements import FireSimNode
+
+
+def reference_dfs_order(roots: List[FireSimNode]) -> List[FireSimNode]:
+    """ The original (quadratic) FireSimTopology.get_dfs_order, kept here as
+    the ordering reference for the cached index. """
+    stack = list(roots)
+    retlist: List[FireSimNode] = []
+    visitedonce = set()
+    while stack:
+        nextup = stack[0]
+        if nextup in visitedonce:
+            if nextup not in retlist:
+                retlist.append(stack.pop(0))
+            else:
+                stack.pop(0)
+        else:
+            visitedonce.add(nextup)
+            stack = list(map(lambda x: x.get_downlink_side(), nextup.downlinks)) + stack
+    return retlist
+
+
+@pytest.mark.parametrize('topology_name', [
+    'example_8config',
+    'example_64config',
+    'example_multilink_32',
+    'example_cross_links',
+    'small_hierarchy_8sims',
+    'clos_2_8_2',
+    'fat_tree_4ary',
+    'supernode_example_16config',
+    'dual_example_8config',
+    'no_net_config',
+])
+def test_dfs_order_matches_reference(topology_name):
+    topol = FireSimTopology(topology_name, 4)
+    assert topol.get_dfs_order() == reference_dfs_order(topol.roots)
+    assert topol.get_dfs_order_switches() == [x for x in reference_dfs_order(topol.roots) if isinstance(x, FireSimSwitchNode)]
+    assert topol.get_dfs_order_servers() == [x for x in reference_dfs_order(topol.roots) if isinstance(x, FireSimServerNode)]
+
+
+def test_bfs_order_visits_each_node_once_by_depth():
+    topol = FireSimTopology('clos_2_8_2', 4)
+    bfs = topol.get_bfs_order()
+
+    assert len(bfs) == len(set(bfs))
+    assert set(bfs) == set(topol.get_dfs_order())
+    # both roots, then the leaf switches they share, then the servers
+    assert bfs[:2] == topol.roots
+    assert all(isinstance(x, FireSimSwitchNode) for x in bfs[:4])
+    assert all(isinstance(x, FireSimServerNode) for x in bfs[4:])
+
+
+def test_adjacency():
+    topol = FireSimTopology('clos_2_8_2', 4)
+    leaf = topol.get_children(topol.roots[0])[0]
+
+    assert topol.get_parents(leaf) == topol.roots
+    assert len(topol.get_children(leaf)) == 8
+    assert topol.get_parents(topol.roots[0]) == []
+
+
+def test_index_invalidated_by_new_links():
+    topol = FireSimTopology('example_8config', 4)
+    index = topol.get_index()
+    assert topol.get_index() is index
+
+    newserver = FireSimServerNode()
+    topol.roots[0].add_downlinks([newserver])
+
+    assert topol.get_index() is not index
+    assert topol.get_dfs_order_servers()[-1] is newserver
+    assert topol.get_dfs_order() == reference_dfs_order(topol.roots)
+
+
+def run_switching_table_passes(topol: FireSimTopology) -> None:
+    from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+    # only the MAC/table passes, without building a run farm
+    passes = FireSimTopologyWithPasses.__new__(FireSimTopologyWithPasses)
+    passes.firesimtopol = topol
+    passes.pass_assign_mac_addresses()
+    passes.pass_compute_switching_tables()
+
+
+def reference_switching_table(switch: FireSimSwitchNode, num_macs: int) -> List[int]:
+    """ Dense table as the pass used to build it, one entry per MAC. """
+    def reachable_macs(node: FireSimNode) -> List[int]:
+        if isinstance(node, FireSimServerNode):
+            return [node.get_mac_address().as_int_no_prefix()]
+        return [mac for link in node.downlinks for mac in reachable_macs(link.get_downlink_side())]
+
+    from runtools.utils import SwitchingTable
+    # every uplink of these topologies can reach every MAC
+    switchtab = [SwitchingTable.ANY_UPLINK] * num_macs
+    for port_no, link in enumerate(switch.downlinks):
+        for mac in reachable_macs(link.get_downlink_side()):
+            switchtab[mac] = port_no
+    return switchtab
+
+
+@pytest.mark.parametrize('topology_name', [
+    'example_64config',
+    'example_multilink_32',
+    'example_cross_links',
+    'small_hierarchy_8sims',
+    'clos_8_8_16',
+    'fat_tree_4ary',
+])
+def test_switching_tables_match_dense_reference(topology_name):
+    from runtools.utils import MacAddress, SwitchingTable
+
+    topol = FireSimTopology(topology_name, 4)
+    run_switching_table_passes(topol)
+    num_macs = MacAddress.next_mac_to_allocate()
+
+    for switch in topol.get_dfs_order_switches():
+        assert isinstance(switch.switch_table, SwitchingTable)
+        assert list(switch.switch_table) == reference_switching_table(switch, num_macs)
+        # one contiguous range per downlink port
+        assert len(switch.switch_table.port_ranges()) <= len(switch.downlinks)
+        assert switch.switch_builder.get_mac2port() is not None
+
+
+def test_switching_tables_use_only_uplinks_that_reach_a_mac():
+    from runtools.utils import SwitchingTable
+
+    topol = FireSimTopology('example_8config', 4)
+    # root A reaches both leaves, root B only the second one
+    rootA, rootB = FireSimSwitchNode(), FireSimSwitchNode()
+    leaves = [FireSimSwitchNode(), FireSimSwitchNode()]
+    leaves[0].add_downlinks([FireSimServerNode() for x in range(2)])
+    leaves[1].add_downlinks([FireSimServerNode() for x in range(2)])
+    rootA.add_downlinks(leaves)
+    rootB.add_downlinks([leaves[1]])
+    topol.roots = [rootA, rootB]
+    run_switching_table_passes(topol)
+
+    first_leaf_macs = [x.get_mac_address().as_int_no_prefix() for x in topol.get_children(leaves[0])]
+    # MACs behind the first leaf are only reachable through rootA, uplink port 2
+    assert [leaves[1].switch_table[mac] for mac in first_leaf_macs] == [2, 2]
+    assert leaves[1].switch_table.default_port == SwitchingTable.ANY_UPLINK
+    # rootA is the only uplink of the first leaf, every MAC it lacks goes there
+    assert leaves[0].switch_table.port_ranges() == [(first_leaf_macs[0], first_leaf_macs[0] + 1, 0), (first_leaf_macs[1], first_leaf_macs[1] + 1, 1)]
+
+
+def test_runtime_switch_config_matches_compile_time_config(mocker):
+    from runtools.switch_model_config import AbstractSwitchToSwitchConfig, RuntimeSwitchToSwitchConfig
+
+    topol = FireSimTopology('example_8config', 4)
+    run_switching_table_passes(topol)
+    host = mocker.MagicMock()
+    for node in topol.get_dfs_order():
+        node.assign_host_instance(host)
+
+    switch = topol.roots[0]
+    switch.switch_builder = RuntimeSwitchToSwitchConfig(switch)
+    config = switch.switch_builder.emit_switch_configfile().splitlines()
+
+    assert config[1] == "ports 8 0"
+    assert config[2] == f"shmem 0 {switch.downlinks[0].get_global_link_id()} 0"
+    assert config[10] == f"hashsalt {switch.switch_id_internal}"
+    assert config[11] == "mactable 10 65534"
+    assert config[12:] == [f"range {mac} {mac + 1} {mac - 2}" for mac in range(2, 10)]
+    assert switch.switch_builder.get_switch_simulation_args().endswith(f" {switch.switch_builder.switch_binary_name()}.conf")
+
+    # the mac table the runtime binary builds from the ranges is the
+    # compile-time mac2port array
+    compile_time = AbstractSwitchToSwitchConfig(switch)
+    assert "#define NUMPORTS 8" in compile_time.emit_switch_configfile()
+    numentries, default_port = map(int, config[11].split()[1:])
+    mac2port = [default_port] * numentries
+    for line in config[12:]:
+        lo, hi, port = map(int, line.split()[1:])
+        mac2port[lo:hi] = [port] * (hi - lo)
+    assert mac2port == list(compile_time.get_switching_table().to_array())
+    assert f"flow_hash_salt = {switch.switch_id_internal};" in compile_time.get_mac2port()
+
+
+def test_collapsed_topology_diagram(mocker, tmp_path, monkeypatch):
+    from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+
+    monkeypatch.chdir(tmp_path)
+    popen = mocker.patch("runtools.firesim_topology_with_passes.subprocess.Popen")
+    topol = FireSimTopology('clos_8_8_16', 4)
+    host = mocker.MagicMock()
+    for node in topol.get_dfs_order():
+        node.assign_host_instance(host)
+    passes = FireSimTopologyWithPasses.__new__(FireSimTopologyWithPasses)
+    passes.firesimtopol = topol
+    passes.user_topology_name = 'clos_8_8_16'
+    passes.topology_diagram = 'auto'
+    passes.pass_create_topology_diagram()
+
+    # 8 spines, 16 leaves and 128 servers are drawn as one node per tier
+    source = (tmp_path / "generated-topology-diagrams" / "firesim_topologyclos_8_8_16.gv").read_text()
+    assert source.count(" -> ") == 2
+    assert "[label=x8]" in source and "[label=x16]" in source
+    assert "8 x FireSimSwitchNode on 1 host(s)" in source
+    # rendering is left to a dot process that is not waited on
+    assert popen.call_args.args[0][0] == "dot"
+    assert popen.return_value.wait.call_count == 0
+
+
+class FakeHost:
+    def __init__(self, max_sims: int) -> None:
+        self.MAX_SIM_SLOTS_ALLOWED = max_sims
+        self.switch_slots: List[FireSimSwitchNode] = []
+        self.sim_slots: List[FireSimServerNode] = []
+
+    def add_switch(self, switch: FireSimSwitchNode) -> None:
+        self.switch_slots.append(switch)
+        switch.assign_host_instance(self)
+
+    def add_simulation(self, server: FireSimServerNode) -> None:
+        assert len(self.sim_slots) < self.MAX_SIM_SLOTS_ALLOWED
+        self.sim_slots.append(server)
+        server.assign_host_instance(self)
+
+
+class FakeRunFarm:
+    """ Just the mapping API of RunFarm, over a {handle: (max sims, count)} dict. """
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.allocated: List[FakeHost] = []
+
+    def get_available_sim_host_handles(self):
+        consumed = Counter(h.MAX_SIM_SLOTS_ALLOWED for h in self.allocated)
+        return sorted((sims, handle) for handle, (sims, count) in self.hosts.items() if sims and consumed[sims] < count)
+
+    def get_smallest_sim_host_handle(self, num_sims):
+        raise Exception
+
+    def get_switch_only_host_handle(self):
+        return "switch_only"
+
+    def allocate_sim_host(self, handle):
+        self.allocated.append(FakeHost(self.hosts[handle][0]))
+        return self.allocated[-1]
+
+
+@pytest.mark.parametrize('topology_name,hosts,expected_hosts,expected_cross_host_links', [
+    # two 2-sim leaves per 4-slot host, root joins the first host
+    ('small_hierarchy_8sims', {"four": (4, 4)}, 2, 2),
+    # the larger host holds every simulation
+    ('small_hierarchy_8sims', {"four": (4, 4), "eight": (8, 1)}, 1, 0),
+    ('example_64config', {"eight": (8, 8)}, 8, 7),
+    ('clos_2_8_2', {"eight": (8, 2)}, 2, 2),
+])
+def test_min_cut_partition_mapping(topology_name, hosts, expected_hosts, expected_cross_host_links):
+    from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+
+    topol = FireSimTopology(topology_name, 4)
+    passes = FireSimTopologyWithPasses.__new__(FireSimTopologyWithPasses)
+    passes.firesimtopol = topol
+    passes.run_farm = FakeRunFarm(hosts)
+    passes.mapping_min_cut_partition()
+
+    assert len(passes.run_farm.allocated) == expected_hosts
+    assert sum(len(h.sim_slots) for h in passes.run_farm.allocated) == len(topol.get_dfs_order_servers())
+    assert passes.count_cross_host_links()[0] == expected_cross_host_links
+
+
+@pytest.mark.parametrize('topology_name,params,num_servers,num_switches', [
+    ('fat_tree', dict(k=4), 16, 20),
+    ('leaf_spine', dict(num_leaves=4, servers_per_leaf=6, oversubscription=3), 24, 6),
+    ('torus', dict(dims=[3, 4]), 12, 12),
+    ('torus', dict(dims=[2, 2, 2], servers_per_switch=2), 16, 8),
+    ('dragonfly', dict(a=4, p=2, h=2), 72, 36),
+])
+def test_parametric_topologies_route_every_pair(topology_name, params, num_servers, num_switches):
+    from runtools.utils import SwitchingTable
+
+    topol = FireSimTopology(topology_name, 4, params)
+    servers = topol.get_dfs_order_servers()
+    assert len(servers) == num_servers
+    assert len(topol.get_dfs_order_switches()) == num_switches
+    assert topol.custom_mapper == 'mapping_min_cut_partition'
+    run_switching_table_passes(topol)
+
+    # walk every src -> dst path, trying every uplink where the table hashes
+    for dst in servers:
+        mac = dst.get_mac_address().as_int_no_prefix()
+        frontier = {src.uplinks[0].get_uplink_side() for src in servers}
+        for hop in range(2 * num_switches):
+            nextfrontier = set()
+            for switch in frontier:
+                port = switch.switch_table[mac]
+                if port == SwitchingTable.ANY_UPLINK:
+                    nextnodes = [x.get_uplink_side() for x in switch.uplinks]
+                elif port < len(switch.downlinks):
+                    nextnodes = [switch.downlinks[port].get_downlink_side()]
+                else:
+                    nextnodes = [switch.uplinks[port - len(switch.downlinks)].get_uplink_side()]
+                assert nextnodes, "no route"
+                nextfrontier.update(x for x in nextnodes if x is not dst)
+            frontier = nextfrontier
+            if not frontier:
+                break
+        assert not frontier, f"packets for {mac} loop"
+
+
+def test_topology_nodes_are_compact_and_pickle():
+    import pickle
+
+    topol = FireSimTopology('example_16config', 4)
+    run_switching_table_passes(topol)
+    nodes = topol.get_dfs_order()
+    links = [link for node in nodes for link in node.downlinks]
+    for obj in nodes + links + [nodes[0].get_mac_address()]:
+        assert not hasattr(obj, '__dict__'), type(obj).__name__
+
+    copied_nodes = FireSimTopologyIndex(tuple(pickle.loads(pickle.dumps(topol.roots)))).dfs_order
+    assert len(copied_nodes) == len(nodes)
+    for orig, copy in zip(nodes, copied_nodes):
+        assert type(orig) is type(copy)
+        assert [l.get_global_link_id() for l in orig.downlinks] == [l.get_global_link_id() for l in copy.downlinks]
+        if isinstance(orig, FireSimServerNode):
+            assert str(orig.get_mac_address()) == str(copy.get_mac_address())
+        else:
+            assert list(orig.switch_table) == list(copy.switch_table)
+            assert copy.switch_builder.fsimswitchnode is copy
+
+
+@pytest.mark.parametrize('lost_host', ['10.0.0.0', '10.0.0.3'])
+def test_remap_lost_host(lost_host, mocker, monkeypatch):
+    from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+    from runtools.run_farm import ExternallyProvisioned
+
+    monkeypatch.setenv("USER", "centos")
+    args = {
+        "default_platform": "EC2InstanceDeployManager",
+        "default_simulation_dir": "/home/centos",
+        "run_farm_host_specs": [{"eight_fpgas_spec": {"num_fpgas": 8, "num_metasims": 0, "use_for_switch_only": False}}],
+        "run_farm_hosts_to_use": [{f"10.0.0.{x}": "eight_fpgas_spec"} for x in range(4)],
+    }
+    passes = FireSimTopologyWithPasses.__new__(FireSimTopologyWithPasses)
+    passes.firesimtopol = FireSimTopology('leaf_spine', 4, dict(num_leaves=4, servers_per_leaf=4, oversubscription=2))
+    passes.run_farm = ExternallyProvisioned(args, False)
+    passes.mapping_min_cut_partition()
+    # 10.0.0.3 has both spines and two leaves, 10.0.0.0 the other two leaves
+    assert [(len(x.sim_slots), len(x.switch_slots)) for x in passes.run_farm.get_all_host_nodes()] == [(8, 2), (0, 0), (0, 0), (8, 4)]
+
+    nodes = passes.firesimtopol.get_dfs_order()
+    passes.pass_allocate_switch_ports()
+    hosts_before = {node: node.get_host_instance().get_host() for node in nodes}
+    ports_before = {link: link.port for node in nodes for link in node.downlinks}
+    allocate_nbds = mocker.patch.object(FireSimServerNode, 'allocate_nbds', autospec=True)
+
+    replacements, changed_switches = passes.pass_remap_lost_hosts([lost_host])
+
+    assert [x.get_host() for x in replacements] == ['10.0.0.1']
+    moved = [node for node in nodes if hosts_before[node] == lost_host]
+    for node in nodes:
+        assert node.get_host_instance().get_host() == ('10.0.0.1' if node in moved else hosts_before[node])
+    assert passes.run_farm.lookup_by_host(lost_host).sim_slots == []
+    assert passes.get_run_farm_ips([lost_host]) == [f"10.0.0.{x}" for x in range(4) if f"10.0.0.{x}" != lost_host]
+    assert {call.args[0] for call in allocate_nbds.call_args_list} == {x for x in moved if isinstance(x, FireSimServerNode)}
+
+    # only links served from the lost host get new ports, on the replacement
+    for link, port in ports_before.items():
+        if link.get_uplink_side() not in moved:
+            assert link.port == port
+    if lost_host == '10.0.0.0':
+        # the moved leaves' uplinks are still served by the spines
+        assert set(changed_switches) == set(x for x in moved if isinstance(x, FireSimSwitchNode))
+    else:
+        # the leaves left on 10.0.0.0 now connect to spines on 10.0.0.1
+        assert set(changed_switches) == set(passes.firesimtopol.get_dfs_order_switches())
+
+    # remapping again is a no-op
+    assert passes.pass_remap_lost_hosts([lost_host]) == ([], [])
+
+
+def test_supernode_sim_start_command(mocker, monkeypatch, tmp_path):
+    from runtools.run_farm import ExternallyProvisioned
+    from runtools.runtime_config import RuntimeHWConfig, SIM_PLUSARGS_FILENAME
+    from runtools.simulation_data_classes import TracerVConfig, AutoCounterConfig, HostDebugConfig, SynthPrintConfig
+
+    monkeypatch.setenv("USER", "centos")
+    run_farm = ExternallyProvisioned({
+        "default_platform": "EC2InstanceDeployManager",
+        "default_simulation_dir": "/home/centos",
+        "run_farm_host_specs": [{"one_fpga_spec": {"num_fpgas": 1, "num_metasims": 0, "use_for_switch_only": False}}],
+        "run_farm_hosts_to_use": [{"10.0.0.1": "one_fpga_spec"}],
+    }, False)
+    host = run_farm.get_all_host_nodes()[0]
+
+    topol = FireSimTopology('supernode_example_4config', 4)
+    run_switching_table_passes(topol)
+    hwconfig = RuntimeHWConfig("supernode_cfg", {"agfi": "agfi-0", "custom_runtime_config": None,
+                                                  "deploy_quintuplet_override": "f1-firesim-FireSim-SupernodeConfig-F90MHz_BaseF1Config"})
+    nodes = [x for x in topol.get_dfs_order_servers()]
+    supernode = nodes[0]
+    assert supernode.get_slot_nodes() == nodes
+    for index, node in enumerate(nodes):
+        node.assign_host_instance(host)
+        node.server_hardware_config = hwconfig
+        node.server_link_latency = 6405
+        node.server_bw_max = 200
+        job = mocker.MagicMock()
+        job.jobname = f"job{index}"
+        job.rootfs_path.return_value = f"/images/job{index}.qcow2"
+        job.bootbinary_path.return_value = f"/images/job{index}-bin"
+        node.job = job
+    supernode.server_profile_interval = -1
+    supernode.tracerv_config = TracerVConfig({})
+    supernode.autocounter_config = AutoCounterConfig({})
+    supernode.hostdebug_config = HostDebugConfig({})
+    supernode.synthprint_config = SynthPrintConfig({})
+    supernode.plusarg_passthrough = "+linklatency0=1"
+    supernode.allocate_nbds()
+
+    script = supernode.get_sim_start_command(0, False, "+slotid=0").splitlines()
+
+    # every sibling's rootfs is attached by one remote command
+    attach = [x for x in script if "qemu-nbd" in x]
+    assert len(attach) == 1 and attach[0].startswith("sudo sh -c ")
+    assert [f"/dev/nbd{x}" in attach[0] for x in range(4)] == [True] * 4
+    # per-node arguments go to the plusargs file, not the driver command
+    start = script.index(f"cat > {SIM_PLUSARGS_FILENAME} << 'PLUSARGS'")
+    end = script.index("PLUSARGS")
+    assert end == start + 2
+    plusargs = script[start + 1].split()
+    assert [x for x in plusargs if x.startswith("+macaddr")] == [f"+macaddr{x}={nodes[x].get_mac_address()}" for x in range(4)]
+    assert [x for x in plusargs if x.startswith("+blkdev")][:4] == [f"+blkdev{x}=/dev/nbd{x}" for x in range(4)]
+    assert "+permissive-off" not in plusargs and not [x for x in plusargs if x.startswith("+prog")]
+    command = script[end + 1]
+    assert "macaddr" not in command
+    # passthrough plusargs come after the defaults so they can override
+    # them, and the boot binaries are only read once +permissive is off
+    progs = " ".join(f"+prog{x}=job{x}-job{x}-bin" for x in range(4))
+    assert f"$(cat {SIM_PLUSARGS_FILENAME}) +linklatency0=1 +slotid=0 +permissive-off {progs}" in command
+
+    # run the start script, with screen running its command in the
+    # foreground and a driver that records its arguments
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    (bindir / "screen").write_text('#!/bin/sh\nwhile [ "$1" != "-m" ]; do shift; done\nshift\nexec "$@"\n')
+    driver = tmp_path / hwconfig.get_local_driver_binaryname()
+    driver.write_text('#!/bin/sh\nprintf "%s\\n" "$@" > argv\n')
+    for stub in [bindir / "screen", driver]:
+        stub.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    subprocess.run(["bash", "-c", "\n".join(script[start:])], cwd=tmp_path, check=True, capture_output=True)
+    argv = (tmp_path / "argv").read_text().split()
+    assert argv[0] == "+permissive"
+    assert argv[1:-7] == plusargs
+    assert argv[-7:] == ["+linklatency0=1", "+slotid=0", "+permissive-off"] + progs.split()
+
+
+def test_link_transports(monkeypatch):
+    from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+    from runtools.run_farm import ExternallyProvisioned
+    from runtools.switch_model_config import RuntimeSwitchToSwitchConfig
+
+    monkeypatch.setenv("USER", "centos")
+    args = {
+        "default_platform": "EC2InstanceDeployManager",
+        "default_simulation_dir": "/home/centos",
+        "run_farm_host_specs": [{"eight_fpgas_spec": {"num_fpgas": 8, "num_metasims": 0, "use_for_switch_only": False}}],
+        "run_farm_hosts_to_use": [{f"10.0.0.{x}": "eight_fpgas_spec"} for x in range(4)],
+    }
+    passes = FireSimTopologyWithPasses.__new__(FireSimTopologyWithPasses)
+    passes.firesimtopol = FireSimTopology('leaf_spine', 4, dict(num_leaves=4, servers_per_leaf=4, oversubscription=2))
+    passes.run_farm = ExternallyProvisioned(args, False)
+    passes.mapping_min_cut_partition()
+    passes.cross_host_link_transport = 'tcp_tuned'
+    passes.same_host_link_transport = 'unix'
+    passes.pass_assign_link_transports()
+
+    spine = passes.firesimtopol.roots[0]
+    spine.switch_builder = RuntimeSwitchToSwitchConfig(spine)
+    spine_host = spine.get_host_instance()
+    for node in passes.firesimtopol.get_dfs_order():
+        if isinstance(node, FireSimServerNode):
+            assert node.uplinks[0].get_transport() == 'shmem'
+    config = spine.switch_builder.emit_switch_configfile().splitlines()
+    ports = config[2:2 + len(spine.downlinks)]
+    # unix sockets are numbered apart from the TCP ports
+    tcp_ports = iter(range(10000, 11000))
+    unix_ids = iter(range(1000))
+    for portno, link in enumerate(spine.downlinks):
+        if link.get_downlink_side().get_host_instance() is spine_host:
+            assert ports[portno] == f"unixserver {portno} /home/centos/link-{next(unix_ids)}.sock"
+        else:
+            assert ports[portno] == f"server {portno} {next(tcp_ports)} tuned"
+    assert {x.split()[0] for x in ports} == {'unixserver', 'server'}
+
+    leaf = spine.downlinks[0].get_downlink_side()
+    link = spine.downlinks[0]
+    leaf.switch_builder = RuntimeSwitchToSwitchConfig(leaf)
+    uplink_line = leaf.switch_builder.emit_switch_configfile().splitlines()[2 + len(leaf.downlinks)]
+    if link.get_transport() == 'unix':
+        assert uplink_line == f"unixclient {len(leaf.downlinks)} {link.link_hostserver_socket_path()}"
+    else:
+        assert uplink_line == f"client {len(leaf.downlinks)} {spine_host.get_host()} {link.port} tuned"
+
+    # links that cross hosts can't use a same host transport
+    cross_host_link = next(x for x in spine.downlinks if x.link_crosses_hosts())
+    cross_host_link.transport = 'unix'
+    with pytest.raises(SystemExit):
+        passes.pass_assign_link_transports()
+
+
+@pytest.mark.parametrize("platform,overlay", [("EC2InstanceDeployManager", True), ("VitisInstanceDeployManager", False)])
+def test_rootfs_overlays(platform, overlay, mocker, monkeypatch):
+    from runtools.run_farm import ExternallyProvisioned
+
+    monkeypatch.setenv("USER", "centos")
+    run_farm = ExternallyProvisioned({
+        "default_platform": platform,
+        "default_simulation_dir": "/home/centos",
+        "run_farm_host_specs": [{"one_fpga_spec": {"num_fpgas": 1, "num_metasims": 0, "use_for_switch_only": False}}],
+        "run_farm_hosts_to_use": [{"10.0.0.1": "one_fpga_spec"}],
+    }, False)
+    host = run_farm.get_all_host_nodes()[0]
+
+    node = FireSimServerNode()
+    job = mocker.MagicMock()
+    job.jobname = "linux-uniform0"
+    job.rootfs_path.return_value = "/images/br-base.img"
+    job.parent_workload.rootfs_overlays = True
+    node.job = job
+    # overlays are attached with NBD, which depends on the host
+    assert node.get_rootfs_name() == "linux-uniform0-br-base.img"
+    node.assign_host_instance(host)
+    assert node.uses_rootfs_overlay() == overlay
+    assert node.qcow2_support_required() == overlay
+    assert node.get_rootfs_name() == "linux-uniform0-br-base.img" + (".qcow2" if overlay else "")
+
+    job.parent_workload.rootfs_overlays = False
+    assert not node.uses_rootfs_overlay()
+    job.rootfs_path.return_value = "/images/br-base.qcow2"
+    job.parent_workload.rootfs_overlays = True
+    assert not node.uses_rootfs_overlay()
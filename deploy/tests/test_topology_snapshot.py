@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import pytest
+import yaml
+
+import logging
+
+from runtools.firesim_topology_elements import FireSimLink, FireSimServerNode, FireSimSwitchNode
+from runtools.firesim_topology_with_passes import FireSimTopologyWithPasses
+from runtools.runtime_config import RuntimeConfig
+from runtools.topology_snapshot import TopologySnapshotCache, manager_sources
+from runtools.utils import MacAddress
+from runtools.workload import WorkloadConfig
+
+SAMPLE_CONFIGS = Path(__file__).parent.parent / "sample-backup-configs"
+
+
+@pytest.fixture
+def runtime_args(tmp_path, monkeypatch):
+    """ Config files for a 512 server leaf_spine on an externally provisioned
+    run farm. Returns a function that builds the command line args. """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("USER", "centos")
+
+    recipe = {
+        "run_farm_type": "ExternallyProvisioned",
+        "args": {
+            "default_platform": "EC2InstanceDeployManager",
+            "default_simulation_dir": "/home/centos",
+            "run_farm_host_specs": [{"eight_fpgas_spec": {"num_fpgas": 8, "num_metasims": 0, "use_for_switch_only": False}}],
+            "run_farm_hosts_to_use": [{f"10.0.0.{x}": "eight_fpgas_spec"} for x in range(130)],
+        },
+    }
+    (tmp_path / "run_farm.yaml").write_text(yaml.safe_dump(recipe))
+
+    runtime = yaml.safe_load((SAMPLE_CONFIGS / "sample_config_runtime.yaml").read_text())
+    runtime["run_farm"] = {"base_recipe": str(tmp_path / "run_farm.yaml")}
+    runtime["target_config"]["topology"] = "leaf_spine"
+    runtime["target_config"]["topology_params"] = {"num_leaves": 128, "servers_per_leaf": 4, "oversubscription": 4}
+    runtime["target_config"]["topology_diagram"] = "none"
+    runtime["target_config"]["default_hw_config"] = "firesim_rocket_quadcore_nic_l2_llc4mb_ddr3"
+    runtime["workload"]["workload_name"] = "snapshot.json"
+    (tmp_path / "config_runtime.yaml").write_text(yaml.safe_dump(runtime))
+
+    workloads = tmp_path / "workloads"
+    workloads.mkdir()
+    (workloads / "snapshot.json").write_text(json.dumps({"benchmark_name": "snapshot", "common_bootbinary": "bbl", "common_rootfs": "snapshot.qcow2"}))
+    monkeypatch.setattr(WorkloadConfig, "workloadinputs", str(workloads) + "/")
+
+    def make_args(**overrides):
+        args = dict(task="infrasetup",
+                    runtimeconfigfile=str(tmp_path / "config_runtime.yaml"),
+                    hwdbconfigfile=str(SAMPLE_CONFIGS / "sample_config_hwdb.yaml"),
+                    buildrecipesconfigfile=str(SAMPLE_CONFIGS / "sample_config_build_recipes.yaml"),
+                    overrideconfigdata="",
+                    notopologysnapshot=False)
+        args.update(overrides)
+        return argparse.Namespace(**args)
+    return make_args
+
+
+def topology_summary(config: RuntimeConfig):
+    """ What phase one decided, in a form that can be compared across two
+    separately constructed configs. """
+    summary = []
+    for node in config.firesim_topology_with_passes.firesimtopol.get_dfs_order():
+        host = node.get_host_instance()
+        assert host.run_farm is config.run_farm
+        entry = [type(node).__name__, host.get_host(), [link.get_global_link_id() for link in node.downlinks]]
+        if hasattr(node, "job"):
+            assert node in host.sim_slots
+            entry += [str(node.get_mac_address()), node.get_job_name(), node.get_resolved_server_hardware_config().name,
+                      node.get_resolved_server_hardware_config() is config.runtimehwdb.get_runtimehwconfig_from_name(node.get_resolved_server_hardware_config().name)]
+        else:
+            assert node in host.switch_slots
+            entry += [list(node.switch_table), node.switch_builder.fsimswitchnode is node]
+        summary.append(entry)
+    return summary
+
+
+def test_runtime_config_reuses_topology_snapshot(runtime_args, mocker, tmp_path):
+    phase_one = mocker.spy(FireSimTopologyWithPasses, "phase_one_passes")
+    mocker.patch("runtools.runtime_config.strftime", side_effect=["first-launch", "second-launch", "third-launch", "fourth-launch"])
+
+    first = RuntimeConfig(runtime_args())
+    assert phase_one.call_count == 1
+    assert len(list((tmp_path / "topology-snapshots").glob("*.pickle"))) == 1
+
+    second = RuntimeConfig(runtime_args())
+    assert phase_one.call_count == 1
+    assert topology_summary(second) == topology_summary(first)
+    assert "second-launch" in second.workload.job_results_dir
+    assert second.firesim_topology_with_passes.workload is second.workload
+
+    # any change to the inputs of phase one means a rebuild
+    (tmp_path / "workloads" / "snapshot.json").write_text(json.dumps({"benchmark_name": "snapshot", "common_bootbinary": "bbl-v2"}))
+    RuntimeConfig(runtime_args())
+    assert phase_one.call_count == 2
+
+    RuntimeConfig(runtime_args(notopologysnapshot=True))
+    assert phase_one.call_count == 3
+    assert len(list((tmp_path / "topology-snapshots").glob("*.pickle"))) == 2
+
+
+def test_topology_snapshot_restores_ids_and_warnings(runtime_args, caplog):
+    # a runtime config override logs warnings
+    args = runtime_args(overrideconfigdata="target_config link_latency 6405")
+    with caplog.at_level(logging.WARNING):
+        RuntimeConfig(args)
+    first_warnings = [(r.levelno, r.getMessage()) for r in caplog.records]
+    assert first_warnings
+    counters = [MacAddress.next_mac_to_allocate(), FireSimLink.next_unique_link_identifier,
+                FireSimServerNode.SERVERS_CREATED, FireSimSwitchNode.SWITCHES_CREATED]
+
+    # as if this were a new manager process
+    MacAddress.reset_allocator()
+    FireSimLink.next_unique_link_identifier = 0
+    FireSimServerNode.SERVERS_CREATED = 0
+    FireSimSwitchNode.SWITCHES_CREATED = 0
+    caplog.clear()
+    with caplog.at_level(logging.WARNING):
+        RuntimeConfig(args)
+    assert [(r.levelno, r.getMessage()) for r in caplog.records] == first_warnings
+    assert [MacAddress.next_mac_to_allocate(), FireSimLink.next_unique_link_identifier,
+            FireSimServerNode.SERVERS_CREATED, FireSimSwitchNode.SWITCHES_CREATED] == counters
+
+
+def test_topology_snapshot_key_covers_manager_sources():
+    deploy_dir = Path(__file__).parent.parent
+    sources = manager_sources(str(deploy_dir))
+    for path in ["firesim", "runtools/runtime_config.py", "util/deepmerge.py", "awstools/awstools.py", "buildtools/bitbuilder.py"]:
+        assert str(deploy_dir / path) in sources
+
+
+def test_unreadable_topology_snapshot_is_a_miss(tmp_path):
+    cache = TopologySnapshotCache(str(tmp_path))
+    assert cache.fetch("missing") is None
+    (tmp_path / "corrupt.pickle").write_bytes(b"not a pickle")
+    assert cache.fetch("corrupt") is None
+
+    assert cache.store("ok", {"a": [1, 2]})
+    assert cache.fetch("ok") == {"a": [1, 2]}
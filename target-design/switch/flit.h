@@ -4,6 +4,9 @@
 #include <stdlib.h>
 
 #define BROADCAST_ADJUSTED (0xffff)
+// mac2port entry for MACs reachable through every uplink, see
+// SwitchingTable.ANY_UPLINK in deploy/runtools/utils.py
+#define ANY_UPLINK (0xfffe)
 
 /* ----------------------------------------------------
  * buffer flit operations
@@ -61,8 +64,45 @@ void write_last_flit(uint8_t *send_buf, int tokenid, int is_last) {
   *lrv |= (((uint64_t)is_last) << bitoffset);
 }
 
-/* get dest mac from flit, then get port from mac */
-uint16_t get_port_from_flit(uint64_t flit, int current_port) {
+static inline uint64_t mix64(uint64_t x) {
+  x ^= x >> 33;
+  x *= 0xff51afd7ed558ccdULL;
+  x ^= x >> 33;
+  x *= 0xc4ceb9fe1a85ec53ULL;
+  x ^= x >> 33;
+  return x;
+}
+
+/* hash the flow of the packet in flits dat[0, numflits), so that every
+ * packet of a flow takes the same uplink and arrives in order. unfragmented
+ * IPv4 TCP/UDP packets hash the 5-tuple, other IPv4 packets the addresses
+ * and protocol, and anything else the src/dst MACs. flow_hash_salt differs per switch so that
+ * switches at different levels of the topology do not make correlated
+ * choices. */
+uint64_t flow_hash(uint64_t *dat, int numflits) {
+  // flit 0: 2 bytes padding, dst MAC. flit 1: src MAC, ethertype
+  uint16_t ethertype = __builtin_bswap16((dat[1] >> 48) & 0xFFFF);
+  uint64_t key;
+
+  // IPv4 header without options starts in flit 2
+  if (numflits >= 5 && ethertype == 0x0800 && (dat[2] & 0xFF) == 0x45) {
+    uint8_t proto = (dat[3] >> 8) & 0xFF;
+    uint16_t frag = __builtin_bswap16((dat[2] >> 48) & 0xFFFF) & 0x3FFF;
+    // flit 3 ends with the src IP, flit 4 holds the dst IP then L4 ports
+    uint64_t ports_and_dst = dat[4];
+    if (frag || (proto != 6 && proto != 17)) {
+      ports_and_dst &= 0xFFFFFFFF;
+    }
+    key = mix64((dat[3] >> 32) | ((uint64_t)proto << 32)) ^ ports_and_dst;
+  } else {
+    key = mix64(dat[0] >> 16) ^ (dat[1] & 0xFFFFFFFFFFFFULL);
+  }
+  return mix64(key ^ mix64(flow_hash_salt));
+}
+
+/* get dest mac from flit, then get port from mac. hash selects among the
+ * uplinks for MACs that can be reached through any of them. */
+uint16_t get_port_from_flit(uint64_t flit, uint64_t hash) {
   uint16_t is_multicast = (flit >> 16) & 0x1;
   uint16_t flit_low = (flit >> 48) & 0xFFFF; // indicates dest
   uint16_t sendport = (__builtin_bswap16(flit_low));
@@ -77,11 +117,13 @@ uint16_t get_port_from_flit(uint64_t flit, int current_port) {
   // so we can just look up the port in the mac2port table
   sendport = mac2port[sendport];
 
-  if (sendport == NUMDOWNLINKS) {
-    // this has been mapped to "any uplink", so pick one
-    int randval = rand() % NUMUPLINKS;
-    sendport = randval + NUMDOWNLINKS;
-    //        printf("sending to random uplink.\n");
+  if (sendport == ANY_UPLINK) {
+    if (NUMUPLINKS == 0) {
+      // unknown destination at a top-level switch, flood it
+      return BROADCAST_ADJUSTED;
+    }
+    // all uplinks lead to this MAC, spread flows across them
+    sendport = NUMDOWNLINKS + hash % NUMUPLINKS;
     //        printf("port: %04x\n", sendport);
   }
   // printf("port: %04x\n", sendport);
@@ -0,0 +1,162 @@
+#ifndef __RUNTIMECONFIG_H
+#define __RUNTIMECONFIG_H
+
+// Loads the switch configuration at startup instead of compiling it in via
+// switchconfig.h, so that a single switch binary can be used for every switch
+// in a topology. Only used when built with -DSWITCH_RUNTIME_CONFIG.
+//
+// The config file is emitted by deploy/runtools/switch_model_config.py. It is
+// line-based text, one directive per line:
+//
+//   ports <numdownlinks> <numuplinks>
+//   shmem <portno> <shmemportname> <uplink: 0|1>
+//   server <portno> <hostport> [tuned]
+//   client <portno> <serverip> <hostport> [tuned]
+//   unixserver <portno> <socketpath>
+//   unixclient <portno> <socketpath>
+//   hashsalt <salt>
+//   mactable <numentries> <defaultport>
+//   range <lo> <hi> <port>
+//
+// server/client ports use TCP, and the optional "tuned" flag selects a tuned
+// socket (see socketport.h). "ports" must come before any port directive and "mactable" before any
+// "range". MACs not covered by a range are sent to defaultport. A port of
+// ANY_UPLINK (65534) spreads flows across all uplinks, seeded by the
+// optional hashsalt. Empty lines and lines starting with # are ignored.
+
+#include <fstream>
+#include <sstream>
+#include <string>
+#include <vector>
+
+// the switching table is indexed by the low 16 bits of the dest MAC
+#define MAC2PORT_ENTRIES (1 << 16)
+
+struct portconfig {
+  std::string type;
+  std::string name; // shmem port name, server ip or socket path
+  int hostport;
+  int uplink;
+  bool tuned;
+};
+
+static std::vector<portconfig> port_configs;
+
+static void config_error(const char *path, int lineno, const char *msg) {
+  fprintf(stderr, "switch config %s:%d: %s\n", path, lineno, msg);
+  exit(1);
+}
+
+// parse the config file, set NUMPORTS/NUMDOWNLINKS/NUMUPLINKS and mac2port
+void load_switch_config(const char *path) {
+  std::ifstream configfile(path);
+  if (!configfile) {
+    fprintf(stderr, "failed to open switch config %s\n", path);
+    exit(1);
+  }
+
+  std::string line;
+  int lineno = 0;
+  bool have_ports = false;
+  while (std::getline(configfile, line)) {
+    lineno++;
+    std::istringstream fields(line);
+    std::string directive;
+    if (!(fields >> directive) || directive[0] == '#') {
+      continue;
+    }
+
+    if (directive == "ports") {
+      if (have_ports || !(fields >> NUMDOWNLINKS >> NUMUPLINKS) ||
+          NUMDOWNLINKS < 0 || NUMUPLINKS < 0) {
+        config_error(path, lineno, "bad ports directive");
+      }
+      NUMPORTS = NUMDOWNLINKS + NUMUPLINKS;
+      port_configs.resize(NUMPORTS);
+      have_ports = true;
+    } else if (directive == "shmem" || directive == "server" ||
+               directive == "client" || directive == "unixserver" ||
+               directive == "unixclient") {
+      int portno;
+      if (!have_ports || !(fields >> portno) || portno < 0 ||
+          portno >= NUMPORTS) {
+        config_error(path, lineno, "bad port number");
+      }
+      portconfig &pc = port_configs[portno];
+      pc.type = directive;
+      bool ok;
+      if (directive == "shmem") {
+        ok = (bool)(fields >> pc.name >> pc.uplink);
+      } else if (directive == "server") {
+        ok = (bool)(fields >> pc.hostport);
+      } else if (directive == "client") {
+        ok = (bool)(fields >> pc.name >> pc.hostport);
+      } else {
+        ok = (bool)(fields >> pc.name);
+      }
+      std::string flag;
+      pc.tuned = false;
+      if (ok && (directive == "server" || directive == "client") &&
+          (fields >> flag)) {
+        ok = flag == "tuned";
+        pc.tuned = ok;
+      }
+      if (!ok) {
+        config_error(path, lineno, "bad port directive");
+      }
+    } else if (directive == "hashsalt") {
+      if (!(fields >> flow_hash_salt)) {
+        config_error(path, lineno, "bad hashsalt directive");
+      }
+    } else if (directive == "mactable") {
+      int numentries, defaultport;
+      if (mac2port || !(fields >> numentries >> defaultport) ||
+          numentries < 0 || numentries > MAC2PORT_ENTRIES) {
+        config_error(path, lineno, "bad mactable directive");
+      }
+      mac2port = (uint16_t *)malloc(sizeof(uint16_t) * MAC2PORT_ENTRIES);
+      std::fill(mac2port, mac2port + MAC2PORT_ENTRIES, defaultport);
+    } else if (directive == "range") {
+      int lo, hi, port;
+      if (!mac2port || !(fields >> lo >> hi >> port) || lo < 0 || lo > hi ||
+          hi > MAC2PORT_ENTRIES) {
+        config_error(path, lineno, "bad range directive");
+      }
+      std::fill(mac2port + lo, mac2port + hi, port);
+    } else {
+      config_error(path, lineno, "unknown directive");
+    }
+  }
+
+  if (!have_ports || !mac2port) {
+    config_error(path, lineno, "missing ports or mactable directive");
+  }
+  for (int i = 0; i < NUMPORTS; i++) {
+    if (port_configs[i].type.empty()) {
+      fprintf(stderr, "switch config %s: port %d is not configured\n", path, i);
+      exit(1);
+    }
+  }
+}
+
+// construct the ports described by the loaded config
+void setup_ports_from_config() {
+  ports = (BasePort **)calloc(NUMPORTS, sizeof(BasePort *));
+  for (int i = 0; i < NUMPORTS; i++) {
+    portconfig &pc = port_configs[i];
+    if (pc.type == "shmem") {
+      ports[i] = new ShmemPort(i, (char *)pc.name.c_str(), pc.uplink);
+    } else if (pc.type == "server") {
+      ports[i] = new SocketServerPort(i, pc.hostport, pc.tuned);
+    } else if (pc.type == "client") {
+      ports[i] = new SocketClientPort(
+          i, (char *)pc.name.c_str(), pc.hostport, pc.tuned);
+    } else if (pc.type == "unixserver") {
+      ports[i] = new UnixServerPort(i, (char *)pc.name.c_str());
+    } else {
+      ports[i] = new UnixClientPort(i, (char *)pc.name.c_str());
+    }
+  }
+}
+
+#endif // __RUNTIMECONFIG_H
@@ -3,127 +3,231 @@
 
 #include <arpa/inet.h>
 #include <netinet/in.h>
+#include <netinet/tcp.h>
 #include <sys/socket.h>
+#include <sys/un.h>
 #include <unistd.h>
 
-class SocketClientPort : public BasePort {
+// a batch that carries no flits is sent as just its first 8 bytes, which
+// hold this marker
+#define COMPRESS_MARKER (0xDEADBEEFDEADBEEFL)
+#define COMPRESS_NUM_BYTES (8)
+
+// socket buffer size requested by tuned ports, so that a whole batch fits in
+// the kernel buffers on both ends
+#define TUNED_SOCKBUF_BYTES (4 * 1024 * 1024)
+
+// Ports that carry each batch of tokens over a stream socket. Every batch
+// is sent and received in full before the next one, since the other side
+// needs it to advance. Subclasses only differ in how the socket connects.
+//
+// A "tuned" port sends each batch as soon as it is written instead of
+// letting Nagle's algorithm hold back the tail of the batch (or a whole
+// compressed batch) waiting for an ACK, and gives the socket buffers room
+// for a full batch so that send() doesn't block partway through it. The
+// buffers are sized before the socket connects or listens (see
+// size_socket_buffers), since that is when TCP picks its window scale.
+class StreamSocketPort : public BasePort {
 public:
-  SocketClientPort(int portNo, char *serverip, int hostport);
+  StreamSocketPort(int portNo, bool tuned);
   void tick();
   void tick_pre();
   void send();
   void recv();
 
-private:
-  int clientsocket;
-};
+protected:
+  void setup_socket(int fd);
+  void send_all(uint8_t *buf, int len);
+  void recv_all(uint8_t *buf, int len);
 
-SocketClientPort::SocketClientPort(int portNo, char *serverip, int hostport)
-    : BasePort(portNo, false) {
+  int sock;
+  bool tuned;
+};
 
-  struct sockaddr_in serv_addr;
+StreamSocketPort::StreamSocketPort(int portNo, bool tuned)
+    : BasePort(portNo, false), sock(-1), tuned(tuned) {
+  // setup "current" bufs. tick will swap for shmem passing
+  current_input_buf = (uint8_t *)calloc(BUFSIZE_BYTES, 1);
+  current_output_buf = (uint8_t *)calloc(BUFSIZE_BYTES, 1);
+}
 
-  // connect the uplink socket
-  fprintf(stdout,
-          "ClientSocketPort portNo %d connecting to uplink switch %s\n",
-          portNo,
-          serverip);
-  // this is a client
-  clientsocket = socket(AF_INET, SOCK_STREAM, 0);
-  if (clientsocket < 0) {
-    fprintf(stdout, "SOCK FAILED!\n");
-    exit(1);
+// take over a connected socket. its buffers were already sized, see
+// size_socket_buffers
+void StreamSocketPort::setup_socket(int fd) {
+  sock = fd;
+  if (!tuned) {
+    return;
   }
-  memset(&serv_addr, '0', sizeof(serv_addr));
-  serv_addr.sin_family = AF_INET;
-  serv_addr.sin_port = htons(hostport);
-
-  if (inet_pton(AF_INET, serverip, &serv_addr.sin_addr) <= 0) {
-    fprintf(stdout, "INVALID ADDR\n");
-    exit(1);
+  // Nagle's algorithm only exists for TCP, unix sockets send right away
+  int domain = AF_UNSPEC;
+  socklen_t optlen = sizeof(domain);
+  getsockopt(sock, SOL_SOCKET, SO_DOMAIN, &domain, &optlen);
+  int opt = 1;
+  if (domain == AF_INET &&
+      setsockopt(sock, IPPROTO_TCP, TCP_NODELAY, &opt, sizeof(opt))) {
+    perror("setsockopt TCP_NODELAY");
+    exit(EXIT_FAILURE);
   }
+}
 
-  while (connect(clientsocket,
-                 (struct sockaddr *)&serv_addr,
-                 sizeof(serv_addr)) < 0) {
-    fprintf(stdout, "CONNECTION FAILED, retrying in 1s.\n");
-    sleep(1);
+void StreamSocketPort::send_all(uint8_t *buf, int len) {
+  int amtsent = 0;
+  while (amtsent < len) {
+    int ret = ::send(sock, buf + amtsent, len - amtsent, 0);
+    if (ret <= 0) {
+      fprintf(stdout, "SOCKETPORT SEND ERROR\n");
+      exit(1);
+    }
+    amtsent += ret;
   }
-
-  // setup "current" bufs. tick will swap for shmem passing
-  current_input_buf = (uint8_t *)calloc(BUFSIZE_BYTES, 1);
-  current_output_buf = (uint8_t *)calloc(BUFSIZE_BYTES, 1);
-  ;
 }
 
-void SocketClientPort::send() {
-  if (((uint64_t *)current_output_buf)[0] == 0xDEADBEEFDEADBEEFL) {
-//        printf("sending compressed\n");
-#define COMPRESS_NUM_BYTES (8)
-    int amtsent =
-        ::send(clientsocket, current_output_buf, COMPRESS_NUM_BYTES, 0);
-    if (amtsent != COMPRESS_NUM_BYTES) {
-      printf("SOCKETPORT SEND ERROR\n");
+void StreamSocketPort::recv_all(uint8_t *buf, int len) {
+  // tuned ports let the kernel wait for the whole batch in one call
+  int flags = tuned ? MSG_WAITALL : 0;
+  int amtread = 0;
+  while (amtread < len) {
+    int ret = ::recv(sock, buf + amtread, len - amtread, flags);
+    if (ret <= 0) {
+      fprintf(stdout, "SOCKETPORT RECV ERROR\n");
       exit(1);
     }
+    amtread += ret;
+  }
+}
+
+void StreamSocketPort::send() {
+  if (((uint64_t *)current_output_buf)[0] == COMPRESS_MARKER) {
+    send_all(current_output_buf, COMPRESS_NUM_BYTES);
   } else {
-    int amtsent = ::send(clientsocket, current_output_buf, BUFSIZE_BYTES, 0);
-    if (amtsent != BUFSIZE_BYTES) {
-      printf("SOCKETPORT SEND ERROR\n");
-      exit(1);
-    }
+    send_all(current_output_buf, BUFSIZE_BYTES);
   }
 }
 
-void SocketClientPort::recv() {
-  int amtread = 0;
-  while (amtread < COMPRESS_NUM_BYTES) {
-    amtread += ::recv(clientsocket,
-                      current_input_buf + amtread,
-                      COMPRESS_NUM_BYTES - amtread,
-                      0);
-  }
-  if (((uint64_t *)current_input_buf)[0] == 0xDEADBEEFDEADBEEFL) {
-    //        printf("recv compressed\n");
+void StreamSocketPort::recv() {
+  recv_all(current_input_buf, COMPRESS_NUM_BYTES);
+  if (((uint64_t *)current_input_buf)[0] == COMPRESS_MARKER) {
     memset(current_input_buf, 0x0, BUFSIZE_BYTES);
     return;
   }
-
-  while (amtread < BUFSIZE_BYTES) {
-    amtread += ::recv(
-        clientsocket, current_input_buf + amtread, BUFSIZE_BYTES - amtread, 0);
-  }
+  recv_all(current_input_buf + COMPRESS_NUM_BYTES,
+           BUFSIZE_BYTES - COMPRESS_NUM_BYTES);
 }
 
-void SocketClientPort::tick() {
+void StreamSocketPort::tick() {
   // does nothing in this port
 }
 
-void SocketClientPort::tick_pre() {
+void StreamSocketPort::tick_pre() {
   // does nothing in this port
 }
 
-class SocketServerPort : public BasePort {
+// size the buffers of a tuned port's socket. this has to happen before
+// connect() or listen(): the TCP window scale is fixed by the handshake, and
+// accepted sockets inherit the buffer sizes of the listening socket. the
+// kernel caps the sizes at net.core.{w,r}mem_max, which is not an error, so
+// the sizes actually granted are logged instead.
+static void size_socket_buffers(int fd, int portNo) {
+  int bufsize = std::max((int)TUNED_SOCKBUF_BYTES, (int)(2 * BUFSIZE_BYTES));
+  setsockopt(fd, SOL_SOCKET, SO_SNDBUF, &bufsize, sizeof(bufsize));
+  setsockopt(fd, SOL_SOCKET, SO_RCVBUF, &bufsize, sizeof(bufsize));
+  int sndbuf = 0, rcvbuf = 0;
+  socklen_t optlen = sizeof(sndbuf);
+  getsockopt(fd, SOL_SOCKET, SO_SNDBUF, &sndbuf, &optlen);
+  optlen = sizeof(rcvbuf);
+  getsockopt(fd, SOL_SOCKET, SO_RCVBUF, &rcvbuf, &optlen);
+  fprintf(stdout,
+          "port %d socket buffers: requested %d, got send %d recv %d\n",
+          portNo,
+          bufsize,
+          sndbuf,
+          rcvbuf);
+}
+
+// accept a single connection on a listening socket
+static int accept_one(int server_fd, int portNo) {
+  if (listen(server_fd, 3) < 0) {
+    perror("listen");
+    exit(EXIT_FAILURE);
+  }
+  fprintf(stdout, "waiting for clients to connect\n");
+  int fd = accept(server_fd, NULL, NULL);
+  if (fd < 0) {
+    perror("accept");
+    exit(EXIT_FAILURE);
+  }
+  fprintf(stdout, "port %d accepted client\n", portNo);
+  close(server_fd);
+  return fd;
+}
+
+// connect to a server port, retrying until it is listening
+static int connect_retrying(int domain,
+                            struct sockaddr *addr,
+                            socklen_t addrlen,
+                            int portNo,
+                            bool tuned) {
+  int fd = socket(domain, SOCK_STREAM, 0);
+  if (fd < 0) {
+    fprintf(stdout, "SOCK FAILED!\n");
+    exit(1);
+  }
+  if (tuned) {
+    size_socket_buffers(fd, portNo);
+  }
+  while (connect(fd, addr, addrlen) < 0) {
+    fprintf(stdout, "CONNECTION FAILED, retrying in 1s.\n");
+    sleep(1);
+  }
+  return fd;
+}
+
+class SocketClientPort : public StreamSocketPort {
 public:
-  SocketServerPort(int portNo, int hostport);
-  void tick();
-  void tick_pre();
-  void send();
-  void recv();
+  SocketClientPort(int portNo, char *serverip, int hostport, bool tuned = false);
+};
+
+SocketClientPort::SocketClientPort(int portNo,
+                                   char *serverip,
+                                   int hostport,
+                                   bool tuned)
+    : StreamSocketPort(portNo, tuned) {
+  struct sockaddr_in serv_addr;
+
+  // connect the uplink socket
+  fprintf(stdout,
+          "ClientSocketPort portNo %d connecting to uplink switch %s\n",
+          portNo,
+          serverip);
+  memset(&serv_addr, 0, sizeof(serv_addr));
+  serv_addr.sin_family = AF_INET;
+  serv_addr.sin_port = htons(hostport);
 
-private:
-  int serversocket;
+  if (inet_pton(AF_INET, serverip, &serv_addr.sin_addr) <= 0) {
+    fprintf(stdout, "INVALID ADDR\n");
+    exit(1);
+  }
+
+  setup_socket(connect_retrying(AF_INET,
+                                (struct sockaddr *)&serv_addr,
+                                sizeof(serv_addr),
+                                portNo,
+                                tuned));
+}
+
+class SocketServerPort : public StreamSocketPort {
+public:
+  SocketServerPort(int portNo, int hostport, bool tuned = false);
 };
 
-SocketServerPort::SocketServerPort(int portNo, int hostport)
-    : BasePort(portNo, false) {
+SocketServerPort::SocketServerPort(int portNo, int hostport, bool tuned)
+    : StreamSocketPort(portNo, tuned) {
   int server_fd;
   struct sockaddr_in address;
   int opt = 1;
-  int addrlen = sizeof(address);
 
   // Creating socket file descriptor
-  if ((server_fd = socket(AF_INET, SOCK_STREAM, 0)) == 0) {
+  if ((server_fd = socket(AF_INET, SOCK_STREAM, 0)) < 0) {
     perror("socket failed");
     exit(EXIT_FAILURE);
   }
@@ -137,6 +241,7 @@ SocketServerPort::SocketServerPort(int portNo, int hostport)
     perror("setsockopt");
     exit(EXIT_FAILURE);
   }
+  memset(&address, 0, sizeof(address));
   address.sin_family = AF_INET;
   address.sin_addr.s_addr = INADDR_ANY;
   address.sin_port = htons(hostport);
@@ -146,71 +251,66 @@ SocketServerPort::SocketServerPort(int portNo, int hostport)
     perror("bind failed");
     exit(EXIT_FAILURE);
   }
-  if (listen(server_fd, 3) < 0) {
-    perror("listen");
-    exit(EXIT_FAILURE);
-  }
 
-  fprintf(stdout, "waiting for clients to connect\n");
-  if ((serversocket = accept(server_fd,
-                             (struct sockaddr *)&address,
-                             (socklen_t *)&addrlen)) < 0) {
-    perror("accept");
-    exit(EXIT_FAILURE);
-  } else {
-    fprintf(stdout, "SocketServerPort %d accepted client\n", portNo);
+  if (tuned) {
+    size_socket_buffers(server_fd, portNo);
   }
-
-  // setup "current" bufs. tick will swap for shmem passing
-  current_input_buf = (uint8_t *)calloc(BUFSIZE_BYTES, 1);
-  current_output_buf = (uint8_t *)calloc(BUFSIZE_BYTES, 1);
-  ;
+  setup_socket(accept_one(server_fd, portNo));
 }
 
-void SocketServerPort::send() {
-  if (((uint64_t *)current_output_buf)[0] == 0xDEADBEEFDEADBEEFL) {
-//        printf("sending compressed\n");
-#define COMPRESS_NUM_BYTES (8)
-    int amtsent =
-        ::send(serversocket, current_output_buf, COMPRESS_NUM_BYTES, 0);
-    if (amtsent != COMPRESS_NUM_BYTES) {
-      printf("SOCKETPORT SEND ERROR\n");
-      exit(1);
-    }
-  } else {
-    int amtsent = ::send(serversocket, current_output_buf, BUFSIZE_BYTES, 0);
-    if (amtsent != BUFSIZE_BYTES) {
-      printf("SOCKETPORT SEND ERROR\n");
-      exit(1);
-    }
+// Unix domain socket ports, for links between switches on the same host.
+// They are always tuned.
+static struct sockaddr_un unix_socket_addr(const char *path) {
+  struct sockaddr_un addr;
+  memset(&addr, 0, sizeof(addr));
+  addr.sun_family = AF_UNIX;
+  if (strlen(path) >= sizeof(addr.sun_path)) {
+    fprintf(stdout, "unix socket path %s is too long\n", path);
+    exit(1);
   }
+  strcpy(addr.sun_path, path);
+  return addr;
 }
 
-void SocketServerPort::recv() {
-  int amtread = 0;
-  while (amtread < COMPRESS_NUM_BYTES) {
-    amtread += ::recv(serversocket,
-                      current_input_buf + amtread,
-                      COMPRESS_NUM_BYTES - amtread,
-                      0);
-  }
-  if (((uint64_t *)current_input_buf)[0] == 0xDEADBEEFDEADBEEFL) {
-    //        printf("recv compressed\n");
-    memset(current_input_buf, 0x0, BUFSIZE_BYTES);
-    return;
-  }
+class UnixClientPort : public StreamSocketPort {
+public:
+  UnixClientPort(int portNo, char *path);
+};
 
-  while (amtread < BUFSIZE_BYTES) {
-    amtread += ::recv(
-        serversocket, current_input_buf + amtread, BUFSIZE_BYTES - amtread, 0);
-  }
+UnixClientPort::UnixClientPort(int portNo, char *path)
+    : StreamSocketPort(portNo, true) {
+  fprintf(stdout,
+          "UnixClientPort portNo %d connecting to uplink switch at %s\n",
+          portNo,
+          path);
+  struct sockaddr_un addr = unix_socket_addr(path);
+  setup_socket(connect_retrying(
+      AF_UNIX, (struct sockaddr *)&addr, sizeof(addr), portNo, tuned));
 }
 
-void SocketServerPort::tick() {
-  // does nothing in this port
-}
+class UnixServerPort : public StreamSocketPort {
+public:
+  UnixServerPort(int portNo, char *path);
+};
 
-void SocketServerPort::tick_pre() {
-  // does nothing in this port
+UnixServerPort::UnixServerPort(int portNo, char *path)
+    : StreamSocketPort(portNo, true) {
+  struct sockaddr_un addr = unix_socket_addr(path);
+  int server_fd = socket(AF_UNIX, SOCK_STREAM, 0);
+  if (server_fd < 0) {
+    perror("socket failed");
+    exit(EXIT_FAILURE);
+  }
+  // remove the socket of a previous run
+  unlink(path);
+  if (bind(server_fd, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+    perror("bind failed");
+    exit(EXIT_FAILURE);
+  }
+
+  if (tuned) {
+    size_socket_buffers(server_fd, portNo);
+  }
+  setup_socket(accept_one(server_fd, portNo));
 }
 #endif // __SOCKETPORT_H
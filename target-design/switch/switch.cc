@@ -51,10 +51,18 @@ int throttle_denom = 1;
 // TODO: expose in manager
 #define OUTPUT_BUF_SIZE (131072L)
 
+#ifdef SWITCH_RUNTIME_CONFIG
+// port counts are read from the config file given on the command line,
+// see runtimeconfig.h
+int NUMPORTS = 0;
+int NUMDOWNLINKS = 0;
+int NUMUPLINKS = 0;
+#else
 // pull in # clients config
 #define NUMCLIENTSCONFIG
 #include "switchconfig.h"
 #undef NUMCLIENTSCONFIG
+#endif
 
 // DO NOT TOUCH
 #define NUM_TOKENS (LINKLATENCY)
@@ -70,10 +78,16 @@ int throttle_denom = 1;
 
 uint64_t this_iter_cycles_start = 0;
 
+#ifdef SWITCH_RUNTIME_CONFIG
+// allocated and filled in by load_switch_config
+uint16_t *mac2port = NULL;
+uint64_t flow_hash_salt = 0;
+#else
 // pull in mac2port array
 #define MACPORTSCONFIG
 #include "switchconfig.h"
 #undef MACPORTSCONFIG
+#endif
 
 #include "baseport.h"
 #include "flit.h"
@@ -84,7 +98,12 @@ uint64_t this_iter_cycles_start = 0;
 // TODO: replace these port mapping hacks with a mac -> port mapping,
 // could be hardcoded
 
+#ifdef SWITCH_RUNTIME_CONFIG
+BasePort **ports;
+#include "runtimeconfig.h"
+#else
 BasePort *ports[NUMPORTS];
+#endif
 
 static FILE *capture;
 
@@ -179,14 +198,20 @@ void do_fast_switching() {
     switchpacket *tsp = pqueue.top().switchpack;
     pqueue.pop();
     uint16_t send_to_port =
-        get_port_from_flit(tsp->dat[0], 0 /* junk remove arg */);
+        get_port_from_flit(tsp->dat[0], flow_hash(tsp->dat, tsp->amtwritten));
     // printf("packet for port: %x\n", send_to_port);
     // printf("packet timestamp: %ld\n", tsp->timestamp);
     if (send_to_port == BROADCAST_ADJUSTED) {
 #define ADDUPLINK (NUMUPLINKS > 0 ? 1 : 0)
-      // this will only send broadcasts to the first (zeroeth) uplink.
-      // on a switch receiving broadcast packet from an uplink, this should
-      // automatically prevent switch from sending the broadcast to any uplink
+      // broadcasts flood the tree formed by every switch's first (zeroeth)
+      // uplink: they are copied to every port they didn't come from, except
+      // uplinks other than the first. a copy arriving on any other uplink is
+      // a duplicate, and forwarding it would loop forever in topologies with
+      // cycles (e.g. a torus).
+      if (tsp->sender > NUMDOWNLINKS) {
+        free(tsp);
+        continue;
+      }
       for (int i = 0; i < NUMDOWNLINKS + ADDUPLINK; i++) {
         if (i != tsp->sender) {
           switchpacket *tsp2 = (switchpacket *)malloc(sizeof(switchpacket));
@@ -227,9 +252,16 @@ static void simplify_frac(int n, int d, int *nn, int *dd) {
 int main(int argc, char *argv[]) {
   int bandwidth;
 
+#ifdef SWITCH_RUNTIME_CONFIG
+  if (argc < 5) {
+    // if insufficient args, error out
+    fprintf(stdout,
+            "usage: ./switch LINKLATENCY SWITCHLATENCY BANDWIDTH CONFIGFILE\n");
+#else
   if (argc < 4) {
     // if insufficient args, error out
     fprintf(stdout, "usage: ./switch LINKLATENCY SWITCHLATENCY BANDWIDTH\n");
+#endif
     fprintf(stdout, "insufficient args provided\n.");
     fprintf(stdout,
             "LINKLATENCY and SWITCHLATENCY should be provided in cycles.\n");
@@ -254,12 +286,20 @@ int main(int argc, char *argv[]) {
     exit(1);
   }
 
+#ifdef SWITCH_RUNTIME_CONFIG
+  load_switch_config(argv[4]);
+#endif
+
   omp_set_num_threads(
       NUMPORTS); // we parallelize over ports, so max threads = # ports
 
+#ifdef SWITCH_RUNTIME_CONFIG
+  setup_ports_from_config();
+#else
 #define PORTSETUPCONFIG
 #include "switchconfig.h"
 #undef PORTSETUPCONFIG
+#endif
 
 #ifdef CAPTURE
   capture = fopen("capture.txt", "w");